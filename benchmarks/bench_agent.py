@@ -0,0 +1,394 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+PowerMemAgent 端到端基准：用本地 Ollama 替身回放 chat_history 中的多轮对话
+测量 turns/sec、首句耗时（time-to-first-sentence）、Agent 自身开销、
+记忆写入吞吐和数据库增长，并与 benchmarks/baseline.json 比较，超出预算时以非零状态退出。
+基线必须由实际运行记录（--update-baseline，在参考机器上执行）；没有基线文件时只输出测量结果。
+
+LLM 的首 token 延迟和生成速率由替身服务器固定，测得的差异即为 Agent 自身的开销。
+Agent 的配置取自 conf.yaml，其中所有 localhost:11434 地址都会替换成替身服务器，
+记忆库写到临时目录，不会改动 powermem_data。
+
+用法（项目根目录）：
+    uv run python benchmarks/bench_agent.py
+    uv run python benchmarks/bench_agent.py --turns 20 --no-baseline
+    uv run python benchmarks/bench_agent.py --update-baseline
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+for path in (
+    PROJECT_ROOT,
+    PROJECT_ROOT / "Open-LLM-VTuber",
+    PROJECT_ROOT / "Open-LLM-VTuber" / "src",
+):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+from benchmarks.fake_ollama import (
+    FakeOllama,
+    add_server_arguments,
+    config_from_args,
+)
+
+AGENT_KEY = "custom_agents.powermem_agent.PowerMemAgent"
+OLLAMA_URLS = (
+    "http://localhost:11434",
+    "http://127.0.0.1:11434",
+)
+DEFAULT_BASELINE = (
+    PROJECT_ROOT / "benchmarks" / "baseline.json"
+)
+# 指标方向：True 表示越大越好
+METRICS = {
+    "turns_per_sec": True,
+    "ttfs_p50_ms": False,
+    "ttfs_p95_ms": False,
+    "overhead_p50_ms": False,
+    "memory_writes_per_sec": True,
+    "db_bytes_per_turn": False,
+}
+
+
+def load_conversations(
+    history_dir: Path, max_turns: int
+) -> list:
+    """按时间顺序读取聊天记录，每个文件是一段对话，只取用户说的话"""
+    conversations, total = [], 0
+    for file in sorted(history_dir.glob("*.json")):
+        with open(file, encoding="utf-8") as f:
+            records = json.load(f)
+        turns = [
+            r["content"]
+            for r in records
+            if r.get("role") == "human" and r.get("content")
+        ]
+        turns = turns[: max_turns - total]
+        if turns:
+            conversations.append(turns)
+            total += len(turns)
+        if total >= max_turns:
+            break
+    return conversations
+
+
+def redirect(value, base_url: str):
+    """把配置中的本地 Ollama 地址替换成替身服务器地址"""
+    if isinstance(value, dict):
+        return {
+            k: redirect(v, base_url)
+            for k, v in value.items()
+        }
+    if isinstance(value, str):
+        for url in OLLAMA_URLS:
+            if value.startswith(url):
+                return base_url + value[len(url) :]
+    return value
+
+
+def db_size(db_path: str) -> int:
+    return sum(
+        os.path.getsize(p)
+        for p in (db_path, db_path + "-wal")
+        if os.path.exists(p)
+    )
+
+
+def db_rows(db_path: str) -> int:
+    if not os.path.exists(db_path):
+        return 0
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM memories"
+        ).fetchone()[0]
+
+
+def create_agent(
+    conf: dict, base_url: str, data_dir: str, args
+):
+    from open_llm_vtuber.agent.stateless_llm_factory import (
+        LLMFactory,
+    )
+    from open_llm_vtuber.config_manager import (
+        TTSPreprocessorConfig,
+    )
+    from open_llm_vtuber.live2d_model import Live2dModel
+
+    from custom_agents.powermem_agent import PowerMemAgent
+
+    character = conf["character_config"]
+    agent_config = character["agent_config"]
+    settings = redirect(
+        dict(agent_config["agent_settings"][AGENT_KEY]),
+        base_url,
+    )
+    provider = settings.pop("llm_provider")
+    llm_settings = redirect(
+        dict(agent_config["llm_configs"][provider]),
+        base_url,
+    )
+    interrupt_method = llm_settings.pop(
+        "interrupt_method", "user"
+    )
+    llm = LLMFactory.create_llm(
+        llm_provider=provider, **llm_settings
+    )
+
+    settings.update(
+        powermem_user_id="bench",
+        powermem_data_dir=data_dir,
+        powermem_llm_config=dict(
+            settings.get("powermem_llm_config") or {},
+            base_url=f"{base_url}/v1",
+        ),
+    )
+    if args.memory_threshold is not None:
+        settings["memory_threshold"] = args.memory_threshold
+    return PowerMemAgent(
+        llm=llm,
+        system=character["persona_prompt"],
+        live2d_model=Live2dModel(
+            character["live2d_model_name"]
+        ),
+        tts_preprocessor_config=TTSPreprocessorConfig(
+            **character.get("tts_preprocessor_config", {})
+        ),
+        interrupt_method=interrupt_method,
+        **settings,
+    )
+
+
+async def run(args) -> dict:
+    from open_llm_vtuber.agent.input_types import (
+        BatchInput,
+        TextData,
+        TextSource,
+    )
+    from open_llm_vtuber.agent.output_types import (
+        SentenceOutput,
+    )
+
+    with open(args.config, encoding="utf-8") as f:
+        conf = yaml.safe_load(f)
+    conversations = load_conversations(
+        Path(args.history), args.turns
+    )
+    server_config = config_from_args(args)
+    # 不含 Agent 开销时一轮生成所需的时间
+    generation = (
+        server_config.first_token_ms / 1000
+        + (server_config.reply_tokens - 1)
+        / server_config.tokens_per_sec
+    )
+
+    server = FakeOllama(server_config)
+    base_url = await server.start()
+    with tempfile.TemporaryDirectory() as data_dir:
+        agent = create_agent(conf, base_url, data_dir, args)
+        db_path = os.path.join(data_dir, "bench_memory.db")
+        size_before = db_size(db_path)
+
+        ttfs, overhead = [], []
+        turns = 0
+        start = time.perf_counter()
+        for conversation in conversations:
+            agent._memory.clear()
+            for text in conversation:
+                batch = BatchInput(
+                    texts=[
+                        TextData(
+                            source=TextSource.INPUT,
+                            content=text,
+                        )
+                    ]
+                )
+                turn_start = time.perf_counter()
+                first = None
+                async for output in agent.chat(batch):
+                    if first is None and isinstance(
+                        output, SentenceOutput
+                    ):
+                        first = (
+                            time.perf_counter() - turn_start
+                        )
+                elapsed = time.perf_counter() - turn_start
+                if first is not None:
+                    ttfs.append(first)
+                overhead.append(elapsed - generation)
+                turns += 1
+        chat_seconds = time.perf_counter() - start
+
+        await agent.aclose(timeout=args.flush_timeout)
+        queue = agent._write_queue
+        size_after = db_size(db_path)
+        rows = db_rows(db_path)
+    await server.stop()
+
+    write_seconds = queue.write_latency.total
+    return {
+        "turns": turns,
+        "turns_per_sec": turns / chat_seconds,
+        "ttfs_p50_ms": float(np.percentile(ttfs, 50))
+        * 1000,
+        "ttfs_p95_ms": float(np.percentile(ttfs, 95))
+        * 1000,
+        "overhead_p50_ms": float(
+            np.percentile(overhead, 50)
+        )
+        * 1000,
+        "memory_writes": queue.written,
+        "memory_writes_per_sec": (
+            queue.written / write_seconds
+            if write_seconds
+            else 0.0
+        ),
+        "memory_rows": rows,
+        "db_growth_bytes": size_after - size_before,
+        "db_bytes_per_turn": (size_after - size_before)
+        / max(turns, 1),
+        "fake_server": server_config.__dict__,
+        "server_requests": server.requests,
+    }
+
+
+def compare(results: dict, baseline: dict) -> list:
+    """返回超出基线预算的指标说明列表"""
+    failures = []
+    for name, budget in baseline.get("metrics", {}).items():
+        value = results.get(name)
+        if value is None:
+            continue
+        if "min" in budget and value < budget["min"]:
+            failures.append(
+                f"{name}={value:.3f} is below the baseline minimum {budget['min']}"
+            )
+        if "max" in budget and value > budget["max"]:
+            failures.append(
+                f"{name}={value:.3f} exceeds the baseline maximum {budget['max']}"
+            )
+    return failures
+
+
+def make_baseline(results: dict, tolerance: float) -> dict:
+    metrics = {}
+    for name, higher_is_better in METRICS.items():
+        value = results[name]
+        metrics[name] = (
+            {"min": round(value * (1 - tolerance), 3)}
+            if higher_is_better
+            else {"max": round(value * (1 + tolerance), 3)}
+        )
+    return {
+        "fake_server": results["fake_server"],
+        "turns": results["turns"],
+        "tolerance": tolerance,
+        "metrics": metrics,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="PowerMemAgent end-to-end benchmark"
+    )
+    parser.add_argument(
+        "--config", default=str(PROJECT_ROOT / "conf.yaml")
+    )
+    parser.add_argument(
+        "--history",
+        default=str(
+            PROJECT_ROOT / "chat_history" / "mao_pro_001"
+        ),
+    )
+    parser.add_argument("--turns", type=int, default=36)
+    parser.add_argument(
+        "--memory-threshold", type=float, default=None
+    )
+    parser.add_argument(
+        "--flush-timeout", type=float, default=60.0
+    )
+    parser.add_argument(
+        "--baseline", default=str(DEFAULT_BASELINE)
+    )
+    parser.add_argument(
+        "--no-baseline", action="store_true"
+    )
+    parser.add_argument(
+        "--update-baseline", action="store_true"
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25
+    )
+    parser.add_argument(
+        "--json", help="write results to this file"
+    )
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    for name in (
+        "turns",
+        *METRICS,
+        "memory_writes",
+        "memory_rows",
+        "db_growth_bytes",
+    ):
+        print(f"{name:>22}: {results[name]:.3f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_baseline:
+        with open(
+            args.baseline, "w", encoding="utf-8"
+        ) as f:
+            json.dump(
+                make_baseline(results, args.tolerance),
+                f,
+                indent=2,
+            )
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return
+    if args.no_baseline:
+        return
+    if not os.path.exists(args.baseline):
+        print(
+            f"No baseline at {args.baseline}; "
+            "record one on the reference machine with --update-baseline"
+        )
+        return
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if (
+        baseline.get("fake_server")
+        != results["fake_server"]
+    ):
+        print(
+            "WARNING: fake server settings differ from the baseline, "
+            "the comparison may not be meaningful"
+        )
+    failures = compare(results, baseline)
+    if failures:
+        print("\n!!! PERFORMANCE REGRESSION !!!")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("All metrics within baseline budgets")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+记忆检索延迟基准：精确检索 vs IVF 近似索引
+在 1k / 10k / 100k 条合成记忆上测量单次检索的 p50/p99 延迟和 recall@k。
+
+用法（项目根目录）：
+    uv run python benchmarks/bench_ann_search.py
+    uv run python benchmarks/bench_ann_search.py --sizes 1000 10000 --sqlite
+--sqlite 会额外测量 PowerMem 自带的 SQLite 全表扫描（仅对不超过 10k 的规模执行，很慢）。
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(
+    0, str(Path(__file__).resolve().parent.parent)
+)
+
+from custom_agents.ann_index import IVFIndex, _normalize
+
+
+def make_dataset(
+    n: int, dim: int, seed: int = 0
+) -> np.ndarray:
+    """生成带聚类结构的向量，近似真实文本嵌入的分布"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(8, n // 50), dim))
+    labels = rng.integers(0, len(centers), n)
+    noise = rng.normal(scale=0.35, size=(n, dim))
+    return (centers[labels] + noise).astype(np.float32)
+
+
+def percentiles(samples: list) -> str:
+    ms = np.asarray(samples) * 1000
+    return f"p50={np.percentile(ms, 50):8.3f}ms  p99={np.percentile(ms, 99):8.3f}ms"
+
+
+def bench_exact(
+    matrix: np.ndarray, queries: np.ndarray, k: int
+):
+    normalized = _normalize(matrix)
+    timings, answers = [], []
+    for q in queries:
+        start = time.perf_counter()
+        scores = normalized @ _normalize(q)
+        top = np.argpartition(-scores, k)[:k]
+        timings.append(time.perf_counter() - start)
+        answers.append(set(top.tolist()))
+    return timings, answers
+
+
+def bench_ann(
+    matrix: np.ndarray,
+    queries: np.ndarray,
+    k: int,
+    nprobe: int,
+    workdir: str,
+):
+    index = IVFIndex(
+        f"{workdir}/bench_{len(matrix)}.db", nprobe=nprobe
+    )
+    start = time.perf_counter()
+    index.build(np.arange(len(matrix)), matrix)
+    build_time = time.perf_counter() - start
+    index.load()  # 与实际运行一致：从内存映射文件检索
+    timings, answers = [], []
+    for q in queries:
+        start = time.perf_counter()
+        result = index.search(q, k)
+        timings.append(time.perf_counter() - start)
+        answers.append(
+            {memory_id for memory_id, _ in result}
+        )
+    return timings, answers, build_time
+
+
+def bench_sqlite(
+    matrix: np.ndarray,
+    queries: np.ndarray,
+    k: int,
+    workdir: str,
+):
+    from powermem.storage.sqlite.sqlite_vector_store import (
+        SQLiteVectorStore,
+    )
+
+    store = SQLiteVectorStore(
+        f"{workdir}/sqlite_{len(matrix)}.db"
+    )
+    with store._lock:
+        store.connection.executemany(
+            "INSERT INTO memories (id, vector, payload) VALUES (?, ?, ?)",
+            (
+                (i, json.dumps(v.tolist()), "{}")
+                for i, v in enumerate(matrix)
+            ),
+        )
+        store.connection.commit()
+    timings = []
+    for q in queries:
+        start = time.perf_counter()
+        store.search("", vectors=[q.tolist()], limit=k)
+        timings.append(time.perf_counter() - start)
+    store.close()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Exact vs ANN memory search benchmark"
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 100000],
+    )
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--sqlite", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for n in args.sizes:
+            matrix = make_dataset(n, args.dim)
+            rng = np.random.default_rng(1)
+            # 查询取自库内向量加噪声，模拟“问过类似的问题”
+            queries = matrix[
+                rng.integers(0, n, args.queries)
+            ] + rng.normal(
+                scale=0.2, size=(args.queries, args.dim)
+            ).astype(
+                np.float32
+            )
+
+            exact_t, exact_ans = bench_exact(
+                matrix, queries, args.k
+            )
+            ann_t, ann_ans, build_time = bench_ann(
+                matrix,
+                queries,
+                args.k,
+                args.nprobe,
+                workdir,
+            )
+            recall = np.mean(
+                [
+                    len(a & e) / args.k
+                    for a, e in zip(ann_ans, exact_ans)
+                ]
+            )
+            print(
+                f"== {n} memories (dim={args.dim}, k={args.k}) =="
+            )
+            print(
+                f"  exact (numpy) : {percentiles(exact_t)}"
+            )
+            print(
+                f"  ann (ivf)     : {percentiles(ann_t)}  "
+                f"recall@{args.k}={recall:.3f}  build={build_time:.2f}s"
+            )
+            if args.sqlite and n <= 10000:
+                sqlite_t = bench_sqlite(
+                    matrix, queries[:20], args.k, workdir
+                )
+                print(
+                    f"  exact (sqlite): {percentiles(sqlite_t)}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+聊天记录存储基准：每会话一个 JSON 文件 vs HistoryStore（SQLite + FTS5）
+生成 N 个合成会话（默认 10k），分别测量列出会话、读取最新会话、跨会话检索、
+追加一条消息的耗时，以及从 JSON 迁移的耗时。
+
+用法（项目根目录）：
+    uv run python benchmarks/bench_history_store.py
+    uv run python benchmarks/bench_history_store.py --sessions 2000 --messages 30
+"""
+
+import argparse
+import json
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(
+    0, str(Path(__file__).resolve().parent.parent)
+)
+
+from custom_agents.history_store import (
+    HistoryStore,
+    migrate,
+    new_history_uid,
+)
+
+_CHARS = "的一是在不了有和人这中大为上个我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自"
+CONF_UID = "mao_pro_001"
+
+
+def make_json_history(
+    root: Path, sessions: int, messages: int, rng
+):
+    """按 Open-LLM-VTuber 的格式生成会话文件"""
+    conf_dir = root / CONF_UID
+    conf_dir.mkdir(parents=True)
+    start = datetime(2025, 1, 1)
+    for i in range(sessions):
+        moment = start + timedelta(minutes=37 * i)
+        records = [
+            {
+                "role": "metadata",
+                "timestamp": moment.isoformat(
+                    timespec="seconds"
+                ),
+            }
+        ]
+        for j in range(messages):
+            records.append(
+                {
+                    "role": "human" if j % 2 == 0 else "ai",
+                    "timestamp": (
+                        moment + timedelta(seconds=20 * j)
+                    ).isoformat(timespec="seconds"),
+                    "content": "".join(
+                        rng.choices(
+                            _CHARS, k=rng.randint(8, 60)
+                        )
+                    ),
+                    "name": (
+                        "Human" if j % 2 == 0 else "Mao"
+                    ),
+                }
+            )
+        path = conf_dir / f"{new_history_uid(moment)}.json"
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                records, f, ensure_ascii=False, indent=2
+            )
+    return conf_dir
+
+
+def timed(fn, repeat: int = 1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def json_list(conf_dir: Path):
+    """现有做法：打开并解析每个文件才能得到最后一条消息"""
+    sessions = []
+    for path in conf_dir.glob("*.json"):
+        with open(path, encoding="utf-8") as f:
+            records = json.load(f)
+        sessions.append((path.stem, records[-1]))
+    sessions.sort(
+        key=lambda s: s[1].get("timestamp", ""),
+        reverse=True,
+    )
+    return sessions[:50]
+
+
+def json_latest(conf_dir: Path):
+    """文件名以时间开头，按名字排序后读最后一个"""
+    path = sorted(conf_dir.glob("*.json"))[-1]
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def json_search(conf_dir: Path, query: str):
+    hits = []
+    for path in conf_dir.glob("*.json"):
+        with open(path, encoding="utf-8") as f:
+            for record in json.load(f):
+                if query in (record.get("content") or ""):
+                    hits.append((path.stem, record))
+    return hits[:20]
+
+
+def json_append(path: Path, message: dict):
+    with open(path, encoding="utf-8") as f:
+        records = json.load(f)
+    records.append(message)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(records, f, ensure_ascii=False, indent=2)
+
+
+def report(name: str, json_s: float, store_s: float):
+    print(
+        f"  {name:<16} json={json_s * 1000:10.2f}ms  "
+        f"store={store_s * 1000:8.3f}ms  speedup={json_s / store_s:8.1f}x"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Chat history storage benchmark"
+    )
+    parser.add_argument(
+        "--sessions", type=int, default=10000
+    )
+    parser.add_argument("--messages", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as workdir:
+        root = Path(workdir) / "chat_history"
+        start = time.perf_counter()
+        conf_dir = make_json_history(
+            root, args.sessions, args.messages, rng
+        )
+        print(
+            f"Generated {args.sessions} sessions x {args.messages} messages "
+            f"in {time.perf_counter() - start:.1f}s"
+        )
+
+        db_path = f"{workdir}/history.db"
+        migrate(str(root), db_path)
+        store = HistoryStore(db_path)
+        query = "".join(rng.choices(_CHARS, k=3))
+        latest = sorted(conf_dir.glob("*.json"))[-1]
+        latest_uid = latest.stem
+        message = {
+            "role": "human",
+            "timestamp": datetime.now().isoformat(
+                timespec="seconds"
+            ),
+            "content": "今天好难过",
+            "name": "Human",
+        }
+
+        print(f"Query '{query}':")
+        report(
+            "list sessions",
+            timed(lambda: json_list(conf_dir))[0],
+            timed(
+                lambda: store.list_sessions(CONF_UID), 100
+            )[0],
+        )
+        report(
+            "load latest",
+            timed(lambda: json_latest(conf_dir))[0],
+            timed(
+                lambda: store.get_messages(
+                    CONF_UID,
+                    store.latest_session(CONF_UID)[
+                        "history_uid"
+                    ],
+                ),
+                100,
+            )[0],
+        )
+        json_s, json_hits = timed(
+            lambda: json_search(conf_dir, query)
+        )
+        store_s, store_hits = timed(
+            lambda: store.search(query, CONF_UID), 20
+        )
+        report("search", json_s, store_s)
+        print(
+            f"  {'':<16} hits: json={len(json_hits)} store={len(store_hits)}"
+        )
+        report(
+            "append",
+            timed(lambda: json_append(latest, message), 20)[
+                0
+            ],
+            timed(
+                lambda: store.append(
+                    CONF_UID, latest_uid, **message
+                ),
+                200,
+            )[0],
+        )
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+混合检索基准：记忆库内 FTS5 关键词检索的延迟、命中率，以及能省掉多少次嵌入请求
+在合成的中文对话记忆上，用“谁 + 什么事”类的提问（答案就在某条记忆里）和与记忆无关的闲聊提问
+分别测量关键词检索 p50/p99、recall@k，以及按默认阈值会跳过嵌入的比例。
+给出 --embed-url 时再测量一次真实的嵌入请求往返作为对照（可以指向 benchmarks/fake_ollama.py）。
+
+用法（项目根目录）：
+    uv run python benchmarks/bench_hybrid_search.py
+    uv run python benchmarks/bench_hybrid_search.py --sizes 1000 10000 --embed-url http://127.0.0.1:11500
+"""
+
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(
+    0, str(Path(__file__).resolve().parent.parent)
+)
+
+from loguru import logger
+from powermem.storage.sqlite.sqlite_vector_store import (
+    SQLiteVectorStore,
+)
+
+from custom_agents.lexical_index import LexicalIndex
+
+NAMES = [
+    "小林",
+    "阿杰",
+    "妈妈",
+    "老板",
+    "小美",
+    "王老师",
+    "表哥",
+    "室友",
+    "Tom",
+    "莉莉",
+    "张阿姨",
+    "同桌",
+    "师兄",
+    "外婆",
+    "小周",
+    "阿强",
+]
+FACTS = [
+    ("喜欢吃火锅", "爱吃什么"),
+    ("星期五要加班到很晚", "星期五要干嘛"),
+    ("生日是3月5日", "生日是哪天"),
+    ("养了一只橘猫", "养了什么宠物"),
+    ("在学吉他", "在学什么乐器"),
+    ("考试没考好很难过", "考试怎么样"),
+    ("下个月去北京出差", "要去哪里出差"),
+    ("最近总是失眠", "睡得好吗"),
+    ("想换一份工作", "工作有什么打算"),
+    ("周末去爬山了", "周末去哪了"),
+]
+SMALL_TALK = [
+    "今天天气怎么样",
+    "你在干嘛呀",
+    "给我讲个笑话吧",
+    "我有点无聊",
+    "晚上吃点什么好呢",
+]
+
+
+def build_store(n: int, workdir: str, seed: int = 0):
+    rng = random.Random(seed)
+    store = SQLiteVectorStore(f"{workdir}/bench_{n}.db")
+    memories, payloads = [], []
+    for i in range(n):
+        name, (fact, _) = rng.choice(NAMES), rng.choice(
+            FACTS
+        )
+        memories.append((name, fact))
+        payloads.append(
+            {
+                "data": f"用户说：跟你说，{name}{fact}\n你回答：嗯嗯我记住啦，第{i}次聊到这个",
+                "user_id": "bench",
+            }
+        )
+    # 向量内容与本基准无关，用一维占位
+    store.insert([[0.0]] * n, payloads)
+    ids = [
+        row[0]
+        for row in store.connection.execute(
+            "SELECT id FROM memories ORDER BY rowid"
+        )
+    ]
+    return store, dict(zip(ids, memories))
+
+
+def percentiles(samples: list) -> str:
+    ms = np.asarray(samples) * 1000
+    return f"p50={np.percentile(ms, 50):7.3f}ms  p99={np.percentile(ms, 99):7.3f}ms"
+
+
+def bench(n: int, args, workdir: str):
+    store, memories = build_store(n, workdir)
+    start = time.perf_counter()
+    index = LexicalIndex(store)
+    index.sync()
+    print(
+        f"\n== {n} memories (index build {time.perf_counter() - start:.2f}s)"
+    )
+
+    rng = random.Random(1)
+    timings, found, skipped = [], 0, 0
+    for _ in range(args.queries):
+        name, (fact, question) = rng.choice(
+            NAMES
+        ), rng.choice(FACTS)
+        query = f"你还记得{name}{question}吗"
+        start = time.perf_counter()
+        hits = index.search(query, args.candidates)
+        timings.append(time.perf_counter() - start)
+        hits = [
+            h for h in hits if h[1] >= args.min_coverage
+        ]
+        top = [memories[h[0]] for h in hits[: args.top_k]]
+        found += (name, fact) in top
+        skipped += any(
+            c >= args.skip_coverage and t >= args.skip_terms
+            for _, c, t in hits
+        )
+    print(f"recall queries   {percentiles(timings)}")
+    print(
+        f"  recall@{args.top_k}={found / args.queries:.0%}  "
+        f"embedding skipped={skipped / args.queries:.0%}"
+    )
+
+    timings, skipped = [], 0
+    for query in SMALL_TALK * (
+        args.queries // len(SMALL_TALK)
+    ):
+        start = time.perf_counter()
+        hits = index.search(query, args.candidates)
+        timings.append(time.perf_counter() - start)
+        skipped += any(
+            c >= args.skip_coverage and t >= args.skip_terms
+            for _, c, t in hits
+        )
+    print(f"small talk       {percentiles(timings)}")
+    print(
+        f"  embedding skipped={skipped / max(len(timings), 1):.0%}"
+    )
+    store.close()
+
+
+def bench_embedding(url: str, samples: int = 20):
+    import httpx
+
+    timings = []
+    with httpx.Client(base_url=url, timeout=30) as client:
+        for i in range(samples):
+            start = time.perf_counter()
+            client.post(
+                "/api/embed",
+                json={
+                    "model": "nomic-embed-text",
+                    "input": f"你还记得小林的生日是哪天吗{i}",
+                },
+            ).raise_for_status()
+            timings.append(time.perf_counter() - start)
+    print(f"\nembedding round trip {percentiles(timings)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Lexical (FTS5) memory search benchmark"
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 10000],
+    )
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument(
+        "--candidates", type=int, default=20
+    )
+    parser.add_argument(
+        "--min-coverage", type=float, default=0.3
+    )
+    parser.add_argument(
+        "--skip-coverage", type=float, default=0.6
+    )
+    parser.add_argument("--skip-terms", type=int, default=2)
+    parser.add_argument("--embed-url")
+    args = parser.parse_args()
+
+    logger.remove()
+    with tempfile.TemporaryDirectory() as workdir:
+        for n in args.sizes:
+            bench(n, args, workdir)
+    if args.embed_url:
+        bench_embedding(args.embed_url)
+
+
+if __name__ == "__main__":
+    main()
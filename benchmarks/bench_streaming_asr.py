@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+流式 ASR 基准：实时率（RTF）与“说完话 -> 第一个 token”的延迟
+按 conf.yaml 加载现在的离线模型（sherpa_onnx_asr，SenseVoice）和 streaming_asr_config 中的流式模型，
+把 WAV 文件按 chunk_ms 切块、按真实语速（--speed 倍）送入，比较三种路径：
+  - offline：说完后整段离线解码，再检索记忆（一次嵌入请求），再请求对话模型；
+  - streaming：边说边解码，部分结果提前触发检索，说完只解码尾部；
+  - streaming+offline：同上，但说完后仍用离线模型得到最终文本（final_pass: offline）。
+嵌入和对话模型由进程内的 benchmarks/fake_ollama.py 替身提供，延迟可配置。
+WAV 默认取两个模型目录下 test_wavs/ 里的文件（sherpa-onnx 发布的模型都带）。
+
+用法（项目根目录）：
+    uv run python benchmarks/bench_streaming_asr.py
+    uv run python benchmarks/bench_streaming_asr.py --wavs a.wav b.wav --speed 4 --embed-ms 30
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+import wave
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from loguru import logger
+
+from benchmarks.fake_ollama import (
+    FakeOllama,
+    add_server_arguments,
+    config_from_args,
+)
+from custom_agents.memory_cache import text_similarity
+from custom_agents.streaming_asr import (
+    SAMPLE_RATE,
+    StreamingASREngine,
+    create_online_recognizer,
+)
+
+AGENT_KEY = "custom_agents.powermem_agent.PowerMemAgent"
+
+
+def read_wav(path: Path) -> np.ndarray:
+    """读取 16 位 PCM WAV，转成 16 kHz 单声道 float32"""
+    with wave.open(str(path)) as f:
+        rate, channels = f.getframerate(), f.getnchannels()
+        data = np.frombuffer(
+            f.readframes(f.getnframes()), dtype=np.int16
+        )
+    samples = (
+        data.reshape(-1, channels).mean(axis=1) / 32768
+    ).astype(np.float32)
+    if rate != SAMPLE_RATE:
+        positions = np.arange(
+            0, len(samples), rate / SAMPLE_RATE
+        )
+        samples = np.interp(
+            positions, np.arange(len(samples)), samples
+        ).astype(np.float32)
+    return samples
+
+
+class OfflineEngine:
+    """与 sherpa_onnx_asr 相同的 SenseVoice 离线识别"""
+
+    def __init__(self, settings: dict):
+        import sherpa_onnx
+
+        self.recognizer = (
+            sherpa_onnx.OfflineRecognizer.from_sense_voice(
+                model=str(
+                    PROJECT_ROOT / settings["sense_voice"]
+                ),
+                tokens=str(
+                    PROJECT_ROOT / settings["tokens"]
+                ),
+                num_threads=settings.get("num_threads", 4),
+                use_itn=settings.get("use_itn", True),
+                provider=settings.get("provider", "cpu"),
+            )
+        )
+        self.decode_seconds = 0.0
+
+    def transcribe_np(self, audio: np.ndarray) -> str:
+        start = time.perf_counter()
+        stream = self.recognizer.create_stream()
+        stream.accept_waveform(SAMPLE_RATE, audio)
+        self.recognizer.decode_stream(stream)
+        self.decode_seconds += time.perf_counter() - start
+        return stream.result.text.strip()
+
+    async def async_transcribe_np(
+        self, audio: np.ndarray
+    ) -> str:
+        return await asyncio.to_thread(
+            self.transcribe_np, audio
+        )
+
+
+class Prefetcher:
+    """与 PowerMemAgent.prefetch 相同的策略：同一时间一个检索，期间到达的新文本在其后再检索一次"""
+
+    def __init__(
+        self, client, model: str, similarity: float
+    ):
+        self.client = client
+        self.model = model
+        self.similarity = similarity
+        self.text = None
+        self.task = None
+        self.next_text = None
+
+    async def _retrieve(self, text: str):
+        response = await self.client.post(
+            "/api/embed",
+            json={"model": self.model, "input": text},
+        )
+        response.raise_for_status()
+
+    def prefetch(self, text: str):
+        if self.task is not None:
+            if (
+                text_similarity(text, self.text)
+                >= self.similarity
+            ):
+                return
+            if not self.task.done():
+                self.next_text = text
+                return
+        self.text, self.next_text = text, None
+        self.task = asyncio.ensure_future(
+            self._retrieve(text)
+        )
+        self.task.add_done_callback(self._on_done)
+
+    def _on_done(self, task):
+        if task is self.task and self.next_text:
+            self.prefetch(self.next_text)
+
+    async def retrieve(self, text: str):
+        """说完后取本轮的检索结果：预取的文本足够接近就等它，否则重新检索"""
+        if (
+            self.task is not None
+            and text_similarity(text, self.text)
+            >= self.similarity
+        ):
+            await self.task
+            return True
+        await self._retrieve(text)
+        return False
+
+
+async def first_token(
+    client, model: str, text: str
+) -> float:
+    """返回收到第一个 token 的时刻；读完整个回复再返回，不中途断开"""
+    arrived = None
+    async with client.stream(
+        "POST",
+        "/api/chat",
+        json={
+            "model": model,
+            "messages": [{"role": "user", "content": text}],
+            "stream": True,
+        },
+    ) as response:
+        async for line in response.aiter_lines():
+            if line and arrived is None:
+                arrived = time.perf_counter()
+    return arrived
+
+
+async def run_offline(audio, offline, client, args) -> dict:
+    # 离线路径在说话期间什么也不做，说完才开始
+    await asyncio.sleep(
+        len(audio) / SAMPLE_RATE / args.speed
+    )
+    end = time.perf_counter()
+    before = offline.decode_seconds
+    text = await offline.async_transcribe_np(audio)
+    decode = offline.decode_seconds - before
+    await Prefetcher(
+        client, args.embed_model, args.similarity
+    ).retrieve(text)
+    token = await first_token(client, args.chat_model, text)
+    return {
+        "text": text,
+        "rtf": decode / (len(audio) / SAMPLE_RATE),
+        "eos_to_token": token - end,
+        "prefetched": False,
+    }
+
+
+async def run_streaming(
+    audio, engine, client, args
+) -> dict:
+    prefetcher = Prefetcher(
+        client, args.embed_model, args.similarity
+    )
+    chunk = int(SAMPLE_RATE * args.chunk_ms / 1000)
+    # final_pass: offline 时离线解码的耗时也计入实时率
+    before = (
+        engine._decode_seconds
+        + engine._fallback.decode_seconds
+    )
+    for i, start in enumerate(range(0, len(audio), chunk)):
+        engine.feed(
+            "bench",
+            audio[start : start + chunk],
+            on_partial=prefetcher.prefetch,
+            restart=i == 0,
+        )
+        await asyncio.sleep(
+            args.chunk_ms / 1000 / args.speed
+        )
+    end = time.perf_counter()
+    text = await engine.async_transcribe_np(audio)
+    prefetched = await prefetcher.retrieve(text)
+    token = await first_token(client, args.chat_model, text)
+    return {
+        "text": text,
+        "rtf": (
+            engine._decode_seconds
+            + engine._fallback.decode_seconds
+            - before
+        )
+        / (len(audio) / SAMPLE_RATE),
+        "eos_to_token": token - end,
+        "prefetched": prefetched,
+    }
+
+
+def default_wavs(conf_asr: dict, streaming: dict) -> list:
+    dirs = {
+        (PROJECT_ROOT / path).parent / "test_wavs"
+        for path in (
+            conf_asr.get("sense_voice"),
+            streaming.get("tokens"),
+        )
+        if path
+    }
+    return sorted(
+        wav for d in dirs for wav in d.glob("*.wav")
+    )
+
+
+def summarize(name: str, results: list):
+    ms = (
+        np.array([r["eos_to_token"] for r in results])
+        * 1000
+    )
+    rtf = np.mean([r["rtf"] for r in results])
+    hits = sum(r["prefetched"] for r in results)
+    print(
+        f"{name:<18} rtf={rtf:.3f}  end-of-speech -> first token "
+        f"p50={np.percentile(ms, 50):6.0f}ms p90={np.percentile(ms, 90):6.0f}ms  "
+        f"retrieval done early {hits}/{len(results)}"
+    )
+
+
+async def main_async(args):
+    with open(args.config, encoding="utf-8") as f:
+        conf = yaml.safe_load(f)
+    character = conf["character_config"]
+    offline_settings = character["asr_config"][
+        "sherpa_onnx_asr"
+    ]
+    streaming = dict(
+        character["agent_config"]["agent_settings"][
+            AGENT_KEY
+        ].get("streaming_asr_config")
+        or {}
+    )
+    for name in ("enabled", "final_pass"):
+        streaming.pop(name, None)
+    min_partial_chars = streaming.pop(
+        "min_partial_chars", 2
+    )
+    for name in (
+        "tokens",
+        "encoder",
+        "decoder",
+        "joiner",
+        "model",
+    ):
+        if streaming.get(name):
+            streaming[name] = str(
+                PROJECT_ROOT / streaming[name]
+            )
+
+    wavs = [Path(w) for w in args.wavs] or default_wavs(
+        offline_settings, streaming
+    )
+    if not wavs:
+        sys.exit(
+            "No WAV files found; pass them with --wavs"
+        )
+    audios = [read_wav(w) for w in wavs]
+    print(
+        f"{len(wavs)} WAV file(s), {sum(len(a) for a in audios) / SAMPLE_RATE:.1f}s of audio, "
+        f"chunk={args.chunk_ms}ms speed={args.speed}x"
+    )
+
+    offline = OfflineEngine(offline_settings)
+    recognizer = create_online_recognizer(**streaming)
+    engines = {
+        "streaming": StreamingASREngine(
+            offline,
+            recognizer,
+            min_partial_chars=min_partial_chars,
+        ),
+        "streaming+offline": StreamingASREngine(
+            offline,
+            recognizer,
+            final_pass="offline",
+            min_partial_chars=min_partial_chars,
+        ),
+    }
+
+    import httpx
+
+    server = FakeOllama(config_from_args(args))
+    base_url = await server.start()
+    try:
+        async with httpx.AsyncClient(
+            base_url=base_url, timeout=30
+        ) as client:
+            results = {"offline": []}
+            for audio in audios:
+                results["offline"].append(
+                    await run_offline(
+                        audio, offline, client, args
+                    )
+                )
+            for name, engine in engines.items():
+                results[name] = [
+                    await run_streaming(
+                        audio, engine, client, args
+                    )
+                    for audio in audios
+                ]
+    finally:
+        await server.stop()
+
+    print()
+    for name, items in results.items():
+        summarize(name, items)
+    if args.show_text:
+        for wav, *texts in zip(
+            wavs, *(results[n] for n in results)
+        ):
+            print(f"\n{wav.name}")
+            for name, r in zip(results, texts):
+                print(f"  {name:<18} {r['text']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Streaming vs offline ASR latency benchmark"
+    )
+    parser.add_argument(
+        "--config", default=str(PROJECT_ROOT / "conf.yaml")
+    )
+    parser.add_argument("--wavs", nargs="*", default=[])
+    parser.add_argument(
+        "--chunk-ms", type=float, default=100
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="feed audio this many times faster than real time",
+    )
+    parser.add_argument(
+        "--similarity", type=float, default=0.8
+    )
+    parser.add_argument(
+        "--embed-model", default="nomic-embed-text"
+    )
+    parser.add_argument(
+        "--chat-model",
+        default="goekdenizguelmez/JOSIEFIED-Qwen2.5:7b",
+    )
+    parser.add_argument("--show-text", action="store_true")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    logger.remove()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+TTS 缓存基准：首句音频延迟（time-to-first-audio）与整轮音频就绪时间
+把 chat_history/ 里 AI 的回复按句切开当作 LLM 的流式输出逐句回放（每句间隔按生成速度估算），
+服务端按顺序逐句请求 TTS，用一个按字数计时的假引擎代替 edge_tts，分别测量：
+  - none：直接调用引擎（现状）；
+  - cache：加上音频缓存和逐句预取（冷启动，缓存从空开始）；
+  - warm：缓存里已有前一半会话的音频（磁盘缓存跨重启保留），再回放。
+三种情况都只统计后一半会话。
+
+用法（项目根目录）：
+    uv run python benchmarks/bench_tts_cache.py
+    uv run python benchmarks/bench_tts_cache.py --history chat_history --base-ms 250 --per-char-ms 15
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(
+    0, str(Path(__file__).resolve().parent.parent)
+)
+
+from loguru import logger
+
+from custom_agents import tts_cache
+
+
+class FakeEngine:
+    """合成耗时 = base + 每字耗时 × 字数，输出一个与字数成正比的文件"""
+
+    def __init__(
+        self, workdir: str, base: float, per_char: float
+    ):
+        self.workdir = workdir
+        self.base = base
+        self.per_char = per_char
+        self.calls = 0
+
+    def generate_cache_file_name(
+        self, file_name_no_ext, file_extension="mp3"
+    ):
+        return os.path.join(
+            self.workdir,
+            f"{file_name_no_ext}.{file_extension}",
+        )
+
+    def _write(self, text, file_name_no_ext) -> str:
+        self.calls += 1
+        path = self.generate_cache_file_name(
+            file_name_no_ext or f"temp_{self.calls}"
+        )
+        with open(path, "wb") as f:
+            f.write(b"\0" * 2000 * max(len(text), 1))
+        return path
+
+    def generate_audio(self, text, file_name_no_ext=None):
+        time.sleep(self.base + self.per_char * len(text))
+        return self._write(text, file_name_no_ext)
+
+    async def async_generate_audio(
+        self, text, file_name_no_ext=None
+    ):
+        await asyncio.sleep(
+            self.base + self.per_char * len(text)
+        )
+        return self._write(text, file_name_no_ext)
+
+
+def load_turns(history: Path) -> list:
+    turns = []
+    for path in sorted(history.rglob("*.json")):
+        for message in json.loads(
+            path.read_text(encoding="utf-8")
+        ):
+            if message.get("role") != "ai":
+                continue
+            text = tts_cache._STAGE.sub(
+                "", message.get("content", "")
+            )
+            sentences = [
+                s.strip()
+                for s in tts_cache._SENTENCE.findall(text)
+                if s.strip()
+            ]
+            if sentences:
+                turns.append(sentences)
+    return turns
+
+
+async def replay(
+    turn: list, engine, args, prefetch
+) -> tuple:
+    """返回 (首句音频就绪时间, 末句音频就绪时间)，从本轮第一个 token 起算"""
+    start = time.perf_counter()
+    queue = asyncio.Queue()
+
+    async def llm():
+        for sentence in turn:
+            await asyncio.sleep(
+                len(sentence) / args.chars_per_sec
+            )
+            if prefetch:
+                engine.prefetch(sentence)
+            queue.put_nowait(sentence)
+        queue.put_nowait(None)
+
+    producer = asyncio.create_task(llm())
+    first = last = None
+    while (sentence := await queue.get()) is not None:
+        path = await engine.async_generate_audio(sentence)
+        os.remove(path)
+        last = time.perf_counter() - start
+        if first is None:
+            first = last
+    await producer
+    return first, last
+
+
+async def run_mode(
+    mode: str,
+    earlier: list,
+    turns: list,
+    args,
+    workdir: str,
+) -> dict:
+    tts_cache._POOLS.clear()
+    tts_cache._CACHES.clear()
+    raw = FakeEngine(
+        workdir,
+        args.base_ms / 1000,
+        args.per_char_ms / 1000,
+    )
+    engine = raw
+    if mode != "none":
+        cache_dir = os.path.join(workdir, f"cache_{mode}")
+        engine = tts_cache.wrap_engine(
+            raw,
+            "fake_tts",
+            {"voice": "zh-CN-XiaoyiNeural"},
+            directory=cache_dir,
+            workers=args.workers,
+            warm_history_dir=None,
+        )
+        if mode == "warm":
+            pool = next(iter(tts_cache._POOLS.values()))
+            sentences = [
+                s for turn in earlier for s in turn
+            ]
+            await asyncio.to_thread(
+                tts_cache._warm, pool, sentences, 0
+            )
+            pool.cache.hits = pool.cache.misses = 0
+            pool.synthesized = raw.calls = 0
+    firsts, lasts = [], []
+    for turn in turns:
+        first, last = await replay(
+            turn, engine, args, prefetch=mode != "none"
+        )
+        firsts.append(first)
+        lasts.append(last)
+    result = {
+        "ttfa": np.percentile(firsts, [50, 90]) * 1000,
+        "turn": np.percentile(lasts, [50, 90]) * 1000,
+        "calls": raw.calls,
+        "stats": "",
+    }
+    if mode != "none":
+        result["stats"] = tts_cache.tts_cache_stats()[0]
+    return result
+
+
+async def main_async(args):
+    turns = load_turns(Path(args.history))
+    if args.turns:
+        turns = turns[: args.turns]
+    half = len(turns) // 2
+    earlier, turns = turns[:half], turns[half:]
+    sentences = sum(len(t) for t in turns)
+    print(
+        f"replaying {len(turns)} turns, {sentences} sentences from {args.history} "
+        f"(warm cache holds the {half} turns before them)"
+    )
+    with tempfile.TemporaryDirectory() as workdir:
+        for mode in ("none", "cache", "warm"):
+            r = await run_mode(
+                mode, earlier, turns, args, workdir
+            )
+            print(
+                f"{mode:<6} ttfa p50={r['ttfa'][0]:6.0f}ms p90={r['ttfa'][1]:6.0f}ms  "
+                f"all audio p50={r['turn'][0]:6.0f}ms p90={r['turn'][1]:6.0f}ms  "
+                f"synth calls={r['calls']}"
+            )
+            if r["stats"]:
+                print(f"       {r['stats']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sentence-level TTS cache benchmark"
+    )
+    parser.add_argument("--history", default="chat_history")
+    parser.add_argument("--turns", type=int, default=0)
+    parser.add_argument(
+        "--base-ms", type=float, default=250
+    )
+    parser.add_argument(
+        "--per-char-ms", type=float, default=15
+    )
+    parser.add_argument(
+        "--chars-per-sec", type=float, default=40
+    )
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    logger.remove()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
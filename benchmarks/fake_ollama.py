@@ -0,0 +1,469 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+本地 Ollama 替身服务器，用于离线、可复现地测量 Kristina 自身的开销
+提供 /api/chat（流式 NDJSON）、/api/generate（仅预加载）、/api/embed、/api/embeddings、/api/tags 和
+/v1/chat/completions（OpenAI 兼容，含 SSE 流式），首 token 延迟、生成速率、
+嵌入延迟都可配置。回复和向量都由输入确定性生成，相同输入得到相同结果。
+
+PowerMem 抽取事实时会带 response_format=json_object 调用 /v1/chat/completions，
+这里按它的两种提示词分别返回 {"facts": [...]} 和 {"memory": [...]}。
+
+用法（项目根目录）：
+    uv run python benchmarks/fake_ollama.py --port 11500 --first-token-ms 80 --tokens-per-sec 40
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import re
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from aiohttp import web
+
+# 回复由这些短句循环拼成，带中文句读，便于句子切分
+_PHRASES = [
+    "嗯嗯，我在这儿呢",
+    "哼，这还用你说呀",
+    "（其实偷偷开心了一下）",
+    "你今天过得怎么样呀",
+    "要不要听个笑话嘛",
+    "下次自己搞定呗",
+]
+_FACTS_BLOCK = re.compile(
+    r"New facts:\s*```\s*(.*?)```", re.S
+)
+
+
+@dataclass
+class FakeOllamaConfig:
+    first_token_ms: float = 80.0
+    tokens_per_sec: float = 40.0
+    reply_tokens: int = 48
+    embed_ms: float = 15.0
+    embed_dim: int = 768
+    model: str = "goekdenizguelmez/JOSIEFIED-Qwen2.5:7b"
+
+
+def _seed(text: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(
+            text.encode("utf-8"), digest_size=8
+        ).digest(),
+        "little",
+    )
+
+
+def fake_embedding(text: str, dim: int) -> list:
+    """字符二元组哈希到固定维度再归一化，字面相近的文本向量也相近"""
+    vec = np.zeros(dim, dtype=np.float32)
+    text = text or " "
+    grams = [
+        text[i : i + 2]
+        for i in range(max(1, len(text) - 1))
+    ]
+    for gram in grams:
+        h = _seed(gram)
+        vec[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = np.linalg.norm(vec)
+    return (vec / norm if norm else vec).tolist()
+
+
+def reply_tokens(prompt: str, count: int) -> list:
+    """根据最后一条用户输入确定性地生成回复 token（约 2 个汉字一个 token）"""
+    rng = np.random.default_rng(_seed(prompt))
+    text = ""
+    while len(text) < count * 2:
+        phrase = _PHRASES[rng.integers(len(_PHRASES))]
+        text += phrase + (
+            "。" if rng.random() < 0.5 else "！"
+        )
+    text = text[: count * 2]
+    return [text[i : i + 2] for i in range(0, len(text), 2)]
+
+
+def _message_text(message: dict) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return " ".join(
+            part.get("text", "")
+            for part in content
+            if part.get("type") == "text"
+        )
+    return str(content)
+
+
+def _prompt_tokens(messages: list) -> int:
+    return sum(
+        len(_message_text(m)) // 2 + 4 for m in messages
+    )
+
+
+def _json_reply(messages: list) -> str:
+    """模拟 PowerMem 的事实抽取与记忆更新决策"""
+    prompt = "\n".join(_message_text(m) for m in messages)
+    block = _FACTS_BLOCK.search(prompt)
+    if block:
+        facts = [
+            line[2:].strip()
+            for line in block.group(1).splitlines()
+            if line.startswith("- ")
+        ]
+        return json.dumps(
+            {
+                "memory": [
+                    {
+                        "id": str(i),
+                        "text": fact,
+                        "event": "ADD",
+                    }
+                    for i, fact in enumerate(facts)
+                ]
+            },
+            ensure_ascii=False,
+        )
+    conversation = prompt.rsplit("Input:", 1)[-1]
+    facts = []
+    for line in conversation.splitlines():
+        line = line.split(":", 1)[-1].strip()
+        if line and len(facts) < 2:
+            facts.append(line[:60])
+    return json.dumps({"facts": facts}, ensure_ascii=False)
+
+
+class FakeOllama:
+    def __init__(self, config: FakeOllamaConfig = None):
+        self.config = config or FakeOllamaConfig()
+        self.requests: dict = {}
+        self.app = web.Application()
+        self.app.add_routes(
+            [
+                web.get("/", self.root),
+                web.get("/api/tags", self.tags),
+                web.post("/api/pull", self.pull),
+                web.post("/api/generate", self.generate),
+                web.post("/api/chat", self.api_chat),
+                web.post("/api/embed", self.api_embed),
+                web.post(
+                    "/api/embeddings", self.api_embeddings
+                ),
+                web.post(
+                    "/v1/chat/completions", self.openai_chat
+                ),
+            ]
+        )
+        self._runner = None
+
+    def _count(self, path: str):
+        self.requests[path] = self.requests.get(path, 0) + 1
+
+    async def start(
+        self, host: str = "127.0.0.1", port: int = 0
+    ) -> str:
+        """在当前事件循环中启动，返回 base URL（port=0 时自动分配端口）"""
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def root(self, request):
+        return web.Response(text="Ollama is running")
+
+    async def tags(self, request):
+        self._count("/api/tags")
+        names = [
+            self.config.model,
+            "nomic-embed-text",
+            "nomic-embed-text:latest",
+        ]
+        return web.json_response(
+            {
+                "models": [
+                    {"name": name, "model": name}
+                    for name in names
+                ]
+            }
+        )
+
+    async def pull(self, request):
+        # 任何模型都视为已就绪
+        self._count("/api/pull")
+        return web.json_response({"status": "success"})
+
+    async def generate(self, request):
+        # 只支持不带 prompt 的模型预加载请求
+        self._count("/api/generate")
+        body = await request.json()
+        return web.json_response(
+            {
+                "model": body.get(
+                    "model", self.config.model
+                ),
+                "response": "",
+                "done": True,
+                "done_reason": "load",
+            }
+        )
+
+    async def _embed_delay(self, n: int = 1):
+        await asyncio.sleep(self.config.embed_ms * n / 1000)
+
+    async def api_embed(self, request):
+        self._count("/api/embed")
+        body = await request.json()
+        inputs = body.get("input", "")
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        await self._embed_delay(len(inputs))
+        return web.json_response(
+            {
+                "model": body.get("model"),
+                "embeddings": [
+                    fake_embedding(t, self.config.embed_dim)
+                    for t in inputs
+                ],
+            }
+        )
+
+    async def api_embeddings(self, request):
+        self._count("/api/embeddings")
+        body = await request.json()
+        await self._embed_delay()
+        return web.json_response(
+            {
+                "embedding": fake_embedding(
+                    body.get("prompt", ""),
+                    self.config.embed_dim,
+                )
+            }
+        )
+
+    async def _tokens(self, messages: list):
+        """按配置的首 token 延迟和生成速率逐个产出 token"""
+        last_user = next(
+            (
+                _message_text(m)
+                for m in reversed(messages)
+                if m.get("role") == "user"
+            ),
+            "",
+        )
+        await asyncio.sleep(
+            self.config.first_token_ms / 1000
+        )
+        interval = 1 / max(self.config.tokens_per_sec, 1e-6)
+        for i, token in enumerate(
+            reply_tokens(
+                last_user, self.config.reply_tokens
+            )
+        ):
+            if i:
+                await asyncio.sleep(interval)
+            yield token
+
+    async def api_chat(self, request):
+        self._count("/api/chat")
+        body = await request.json()
+        messages = body.get("messages", [])
+        start = time.perf_counter_ns()
+        prompt_tokens = _prompt_tokens(messages)
+        done = {
+            "model": body.get("model", self.config.model),
+            "done": True,
+            "done_reason": "stop",
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(
+                self.config.first_token_ms * 1e6
+            ),
+            "eval_count": self.config.reply_tokens,
+        }
+        if not body.get("stream", True):
+            text = "".join(
+                [t async for t in self._tokens(messages)]
+            )
+            done["message"] = {
+                "role": "assistant",
+                "content": text,
+            }
+            done["total_duration"] = (
+                time.perf_counter_ns() - start
+            )
+            return web.json_response(done)
+
+        response = web.StreamResponse(
+            headers={"Content-Type": "application/x-ndjson"}
+        )
+        await response.prepare(request)
+        async for token in self._tokens(messages):
+            chunk = {
+                "model": done["model"],
+                "message": {
+                    "role": "assistant",
+                    "content": token,
+                },
+                "done": False,
+            }
+            await response.write(
+                (
+                    json.dumps(chunk, ensure_ascii=False)
+                    + "\n"
+                ).encode()
+            )
+        done["message"] = {
+            "role": "assistant",
+            "content": "",
+        }
+        done["total_duration"] = (
+            time.perf_counter_ns() - start
+        )
+        await response.write(
+            (json.dumps(done) + "\n").encode()
+        )
+        await response.write_eof()
+        return response
+
+    async def openai_chat(self, request):
+        self._count("/v1/chat/completions")
+        body = await request.json()
+        messages = body.get("messages", [])
+        model = body.get("model", self.config.model)
+        usage = {
+            "prompt_tokens": _prompt_tokens(messages),
+            "completion_tokens": self.config.reply_tokens,
+        }
+        usage["total_tokens"] = sum(usage.values())
+        base = {
+            "id": f"chatcmpl-{_seed(str(time.time_ns()))}",
+            "created": int(time.time()),
+            "model": model,
+        }
+
+        if (body.get("response_format") or {}).get(
+            "type"
+        ) == "json_object":
+            await asyncio.sleep(
+                self.config.first_token_ms / 1000
+            )
+            text = _json_reply(messages)
+        elif not body.get("stream"):
+            text = "".join(
+                [t async for t in self._tokens(messages)]
+            )
+        else:
+            response = web.StreamResponse(
+                headers={
+                    "Content-Type": "text/event-stream"
+                }
+            )
+            await response.prepare(request)
+            async for token in self._tokens(messages):
+                chunk = dict(
+                    base,
+                    object="chat.completion.chunk",
+                    choices=[
+                        {
+                            "index": 0,
+                            "delta": {"content": token},
+                            "finish_reason": None,
+                        }
+                    ],
+                )
+                await response.write(
+                    f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode()
+                )
+            final = dict(
+                base,
+                object="chat.completion.chunk",
+                choices=[
+                    {
+                        "index": 0,
+                        "delta": {},
+                        "finish_reason": "stop",
+                    }
+                ],
+            )
+            await response.write(
+                f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode()
+            )
+            await response.write_eof()
+            return response
+
+        return web.json_response(
+            dict(
+                base,
+                object="chat.completion",
+                choices=[
+                    {
+                        "index": 0,
+                        "message": {
+                            "role": "assistant",
+                            "content": text,
+                        },
+                        "finish_reason": "stop",
+                    }
+                ],
+                usage=usage,
+            )
+        )
+
+
+def add_server_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--first-token-ms", type=float, default=80.0
+    )
+    parser.add_argument(
+        "--tokens-per-sec", type=float, default=40.0
+    )
+    parser.add_argument(
+        "--reply-tokens", type=int, default=48
+    )
+    parser.add_argument(
+        "--embed-ms", type=float, default=15.0
+    )
+    parser.add_argument(
+        "--embed-dim", type=int, default=768
+    )
+
+
+def config_from_args(args) -> FakeOllamaConfig:
+    return FakeOllamaConfig(
+        first_token_ms=args.first_token_ms,
+        tokens_per_sec=args.tokens_per_sec,
+        reply_tokens=args.reply_tokens,
+        embed_ms=args.embed_ms,
+        embed_dim=args.embed_dim,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local Ollama stand-in for benchmarks"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    server = FakeOllama(config_from_args(args))
+    print(
+        f"Fake Ollama listening on http://{args.host}:{args.port}"
+    )
+    web.run_app(
+        server.app,
+        host=args.host,
+        port=args.port,
+        print=None,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+# custom_agents/ann_index.py
+import gc
+import os
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+from loguru import logger
+
+from custom_agents.vector_rows import (
+    fetch_ids,
+    fetch_vectors,
+)
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _kmeans(
+    data: np.ndarray,
+    k: int,
+    iterations: int = 10,
+    seed: int = 0,
+) -> np.ndarray:
+    """球面 k-means（数据已归一化，按内积分配），返回归一化后的聚类中心"""
+    rng = np.random.default_rng(seed)
+    centroids = data[
+        rng.choice(len(data), k, replace=False)
+    ].copy()
+    for _ in range(iterations):
+        assign = np.argmax(data @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        # 空簇重新随机取一个样本作为中心
+        sums[empty] = data[
+            rng.choice(len(data), empty.sum())
+        ]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class IVFIndex:
+    """SQLite 向量库旁路的倒排文件（IVF）近似最近邻索引
+
+    索引文件与 .db 放在同一目录，以内存映射方式加载：
+      <db>.ann.vectors.npy    归一化后的 float32 向量
+      <db>.ann.ids.npy        对应的记忆 id
+      <db>.ann.lists.npy      每行所属的聚类编号
+      <db>.ann.centroids.npy  聚类中心（行数少于 min_train_size 时为空，退化为暴力检索）
+      <db>.ann.trained.npy    训练聚类中心时的行数
+    新写入的向量先放进内存增量区，累计 flush_every 条后再合并落盘。
+    """
+
+    _FILES = (
+        "vectors",
+        "ids",
+        "lists",
+        "centroids",
+        "trained",
+    )
+
+    def __init__(
+        self,
+        db_path: str,
+        nprobe: int = 8,
+        min_train_size: int = 1024,
+        flush_every: int = 256,
+    ):
+        self.prefix = db_path + ".ann"
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.flush_every = flush_every
+        self._lock = threading.RLock()
+        self._ready = False
+        self._clear()
+
+    def _clear(self):
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._lists = np.empty(0, dtype=np.int32)
+        self._centroids = np.empty((0, 0), dtype=np.float32)
+        self._trained = 0
+        self._order = np.empty(0, dtype=np.int64)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._delta_ids: list = []
+        self._delta_vectors: list = []
+        self._deleted: set = set()
+
+    def _path(self, name: str) -> str:
+        return f"{self.prefix}.{name}.npy"
+
+    def __len__(self) -> int:
+        return (
+            len(self._ids)
+            + len(self._delta_ids)
+            - len(self._deleted)
+        )
+
+    # ---------- 加载与校验 ----------
+
+    def load(self) -> bool:
+        """以内存映射方式加载索引文件，文件不完整时返回 False"""
+        if not all(
+            os.path.exists(self._path(name))
+            for name in self._FILES
+        ):
+            return False
+        with self._lock:
+            self._clear()
+            self._vectors = np.load(
+                self._path("vectors"), mmap_mode="r"
+            )
+            self._ids = np.load(self._path("ids"))
+            self._lists = np.load(self._path("lists"))
+            self._centroids = np.load(
+                self._path("centroids")
+            )
+            self._trained = int(
+                np.load(self._path("trained"))[0]
+            )
+            self._build_inverted_lists()
+        return True
+
+    def verify(self, store) -> bool:
+        """核对索引与 SQLite 中的记忆 id 是否一致，不一致时标记为需要重建"""
+        with self._lock:
+            if not self._ready and not self.load():
+                logger.info(
+                    "ANN index not found, will build on first use"
+                )
+                return False
+            # 更新过的记忆同时在删除标记和增量区中，先减去删除标记再并上增量区
+            indexed = (
+                set(self._ids.tolist()) - self._deleted
+            ) | set(self._delta_ids)
+            stored = set(fetch_ids(store).tolist())
+            self._ready = indexed == stored
+            if not self._ready:
+                logger.warning(
+                    f"ANN index out of sync with SQLite "
+                    f"({len(indexed)} indexed vs {len(stored)} stored), "
+                    "will rebuild on first use"
+                )
+            return self._ready
+
+    def ensure_ready(self, store):
+        with self._lock:
+            if not self._ready:
+                self.rebuild(store)
+
+    def rebuild(self, store):
+        """从 SQLite 读出全部向量重建索引"""
+
+        start = time.perf_counter()
+        ids, matrix = fetch_vectors(store)
+        self.build(ids, matrix)
+        logger.info(
+            f"Rebuilt ANN index with {len(ids)} vectors "
+            f"({len(self._centroids)} lists) in {time.perf_counter() - start:.2f}s"
+        )
+
+    # ---------- 构建与落盘 ----------
+
+    def build(self, ids: np.ndarray, matrix: np.ndarray):
+        """由现成的 id 与向量数组构建索引并落盘"""
+        with self._lock:
+            self._build(ids, matrix)
+            self._save()
+            self._ready = True
+
+    def _build(
+        self,
+        ids: np.ndarray,
+        matrix: np.ndarray,
+        centroids: Optional[np.ndarray] = None,
+        trained: int = 0,
+    ):
+        self._clear()
+        if len(ids) == 0:
+            return
+        vectors = _normalize(matrix)
+        if centroids is None or len(centroids) == 0:
+            trained = 0
+            if len(ids) >= self.min_train_size:
+                trained = len(ids)
+                nlist = int(np.sqrt(len(ids)))
+                sample = vectors[
+                    np.random.default_rng(0).choice(
+                        len(vectors),
+                        min(len(vectors), nlist * 64),
+                        replace=False,
+                    )
+                ]
+                centroids = _kmeans(sample, nlist)
+            else:
+                centroids = np.empty(
+                    (0, 0), dtype=np.float32
+                )
+        self._vectors = vectors
+        self._ids = np.asarray(ids, dtype=np.int64)
+        self._centroids = centroids
+        self._trained = trained
+        self._lists = self._assign(vectors)
+        self._build_inverted_lists()
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        if len(self._centroids) == 0:
+            return np.zeros(len(vectors), dtype=np.int32)
+        lists = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), 8192):
+            chunk = vectors[start : start + 8192]
+            lists[start : start + len(chunk)] = np.argmax(
+                chunk @ self._centroids.T, axis=1
+            )
+        return lists
+
+    def _build_inverted_lists(self):
+        """按聚类编号排序行号，offsets[i]:offsets[i+1] 即第 i 个倒排表"""
+        nlist = max(1, len(self._centroids))
+        self._order = np.argsort(self._lists, kind="stable")
+        counts = np.bincount(self._lists, minlength=nlist)
+        self._offsets = np.concatenate(
+            ([0], np.cumsum(counts))
+        )
+
+    def _save(self):
+        arrays = {
+            "vectors": np.ascontiguousarray(self._vectors),
+            "ids": self._ids,
+            "lists": self._lists,
+            "centroids": self._centroids,
+            "trained": np.array(
+                [self._trained], dtype=np.int64
+            ),
+        }
+        # Windows 下被映射的文件无法替换，先释放旧的内存映射
+        self._vectors = arrays["vectors"] = np.array(
+            arrays["vectors"]
+        )
+        gc.collect()
+        for name, array in arrays.items():
+            tmp_path = self._path(name) + ".tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp_path, self._path(name))
+
+    def flush(self):
+        """把增量区与删除标记合并进主索引并落盘"""
+        with self._lock:
+            if not self._delta_ids and not self._deleted:
+                return
+            keep = ~np.isin(self._ids, list(self._deleted))
+            ids = self._ids[keep]
+            vectors = (
+                self._vectors[keep] if len(ids) else None
+            )
+            if self._delta_ids:
+                delta = np.stack(self._delta_vectors)
+                ids = np.concatenate(
+                    (
+                        ids,
+                        np.asarray(
+                            self._delta_ids, dtype=np.int64
+                        ),
+                    )
+                )
+                vectors = (
+                    delta
+                    if vectors is None
+                    else np.concatenate((vectors, delta))
+                )
+            # 行数跨过训练阈值或比训练时增长一倍以上时重新聚类，否则沿用原聚类中心
+            centroids = self._centroids
+            if (
+                len(centroids) == 0
+                or len(ids) > 2 * self._trained
+            ):
+                centroids = None
+            if vectors is None:
+                self._clear()
+            else:
+                self._build(
+                    ids, vectors, centroids, self._trained
+                )
+            self._save()
+
+    # ---------- 增量更新 ----------
+
+    def upsert(self, ids: np.ndarray, vectors: np.ndarray):
+        if len(ids) == 0:
+            return
+        vectors = _normalize(vectors)
+        with self._lock:
+            self.remove(ids)
+            for memory_id, vector in zip(ids, vectors):
+                self._delta_ids.append(int(memory_id))
+                self._delta_vectors.append(vector)
+            if len(self._delta_ids) >= self.flush_every:
+                self.flush()
+
+    def remove(self, ids):
+        with self._lock:
+            ids = [int(memory_id) for memory_id in ids]
+            # 只有已经在主索引里的 id 才需要删除标记（新 id 经 upsert 也会走到这里）
+            indexed = set(
+                self._ids[np.isin(self._ids, ids)].tolist()
+            )
+            for memory_id in ids:
+                if memory_id in self._delta_ids:
+                    index = self._delta_ids.index(memory_id)
+                    del self._delta_ids[index]
+                    del self._delta_vectors[index]
+                elif memory_id in indexed:
+                    self._deleted.add(memory_id)
+
+    # ---------- 检索 ----------
+
+    def search(self, query, k: int) -> list:
+        """返回 [(id, score), ...]，score 为余弦相似度，按降序排列"""
+        q = _normalize(np.asarray(query, dtype=np.float32))
+        with self._lock:
+            if len(self._centroids):
+                probe = np.argsort(self._centroids @ q)[
+                    -self.nprobe :
+                ]
+                rows = np.concatenate(
+                    [
+                        self._order[
+                            self._offsets[
+                                i
+                            ] : self._offsets[i + 1]
+                        ]
+                        for i in probe
+                    ]
+                )
+                rows.sort()
+            else:
+                rows = np.arange(len(self._ids))
+            ids = self._ids[rows]
+            scores = (
+                self._vectors[rows] @ q
+                if len(rows)
+                else np.empty(0, dtype=np.float32)
+            )
+            if self._deleted:
+                keep = ~np.isin(ids, list(self._deleted))
+                ids, scores = ids[keep], scores[keep]
+            if self._delta_ids:
+                ids = np.concatenate(
+                    (
+                        ids,
+                        np.asarray(
+                            self._delta_ids, dtype=np.int64
+                        ),
+                    )
+                )
+                scores = np.concatenate(
+                    (
+                        scores,
+                        np.stack(self._delta_vectors) @ q,
+                    )
+                )
+        if len(ids) > k:
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(len(ids))
+        top = top[np.argsort(-scores[top])]
+        return [
+            (int(ids[i]), float(scores[i])) for i in top
+        ]
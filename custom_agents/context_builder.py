@@ -0,0 +1,158 @@
+# custom_agents/context_builder.py
+import re
+from typing import Any
+
+from custom_agents.metrics import RollingStats
+
+# 中日韩字符在 Qwen 等模型的分词器里大约一字一 token，其余文本约 4 字符一 token
+_CJK = re.compile(
+    "[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]"
+)
+# 每条消息的角色标记等固定开销
+_MESSAGE_OVERHEAD = 4
+_IMAGE_TOKENS = 256
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的 token 数（不依赖具体分词器）"""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _content_tokens(content: Any) -> int:
+    if isinstance(content, str):
+        return estimate_tokens(content)
+    tokens = 0
+    for part in content or []:
+        if part.get("type") == "text":
+            tokens += estimate_tokens(part.get("text", ""))
+        else:
+            tokens += _IMAGE_TOKENS
+    return tokens
+
+
+class ContextBuilder:
+    """按 token 预算组装每轮发给 LLM 的上下文
+
+    优先级：系统提示词 > 检索到的记忆 > 本轮输入 > 由近及远的历史对话。
+    超出预算时从最早的历史开始丢弃，并且一次丢到低水位（low_watermark × 可用预算），
+    这样窗口起点能在接下来若干轮保持不变，方便 Ollama 复用 KV 缓存。
+    每条消息的 token 数只计算一次并缓存。
+    """
+
+    def __init__(
+        self,
+        budget: int,
+        memory_share: float = 0.25,
+        reserve_tokens: int = 512,
+        low_watermark: float = 0.75,
+    ):
+        self.budget = budget
+        self.memory_share = memory_share
+        self.reserve_tokens = reserve_tokens
+        self.low_watermark = low_watermark
+        self._token_cache: dict = {}
+        self._window_start = 0
+        self.prompt_tokens = RollingStats()
+        self.last_turn: dict = {}
+
+    def message_tokens(self, message: dict) -> int:
+        entry = self._token_cache.get(id(message))
+        if entry is not None and entry[0] is message:
+            return entry[1]
+        tokens = _MESSAGE_OVERHEAD + _content_tokens(
+            message.get("content")
+        )
+        self._token_cache[id(message)] = (message, tokens)
+        return tokens
+
+    def _prune_cache(self, history: list):
+        if len(self._token_cache) > 2 * len(history) + 16:
+            alive = {id(m) for m in history}
+            self._token_cache = {
+                k: v
+                for k, v in self._token_cache.items()
+                if k in alive
+            }
+
+    def fit_memory(self, memory_context: str) -> str:
+        """把【回忆】文本截断到预算中记忆所占的份额以内（按整条记忆截断）"""
+        if not memory_context or self.budget <= 0:
+            return memory_context
+        limit = int(self.budget * self.memory_share)
+        lines = memory_context.splitlines(keepends=True)
+        kept, used = [], 0
+        for line in lines:
+            tokens = estimate_tokens(line)
+            if used + tokens > limit and kept:
+                break
+            kept.append(line)
+            used += tokens
+        return "".join(kept)
+
+    def window(
+        self,
+        history: list,
+        system: str,
+        user_message: dict = None,
+    ) -> list:
+        """返回不超过预算的最近历史（原列表的切片，不复制整段对话）"""
+        self._prune_cache(history)
+        if self._window_start > len(history):
+            # 历史被清空或替换（切换会话等），窗口从头开始
+            self._window_start = 0
+
+        system_tokens = estimate_tokens(system)
+        user_tokens = (
+            self.message_tokens(user_message)
+            if user_message
+            else 0
+        )
+        fixed = (
+            system_tokens
+            + user_tokens
+            + self.reserve_tokens
+        )
+        available = max(0, self.budget - fixed)
+
+        history_tokens = sum(
+            self.message_tokens(m)
+            for m in history[self._window_start :]
+        )
+        if self.budget > 0 and history_tokens > available:
+            target = int(available * self.low_watermark)
+            start = self._window_start
+            while (
+                start < len(history)
+                and history_tokens > target
+            ):
+                history_tokens -= self.message_tokens(
+                    history[start]
+                )
+                start += 1
+            # 不要让窗口以 assistant 消息开头
+            while (
+                start < len(history)
+                and history[start].get("role")
+                == "assistant"
+            ):
+                history_tokens -= self.message_tokens(
+                    history[start]
+                )
+                start += 1
+            self._window_start = start
+
+        total = system_tokens + user_tokens + history_tokens
+        self.prompt_tokens.add(total)
+        self.last_turn = {
+            "system": system_tokens,
+            "user": user_tokens,
+            "history": history_tokens,
+            "history_turns": len(history)
+            - self._window_start,
+            "dropped_turns": self._window_start,
+            "total": total,
+        }
+        return history[self._window_start :]
@@ -0,0 +1,500 @@
+# custom_agents/history_store.py
+"""
+带索引的聊天记录存储：SQLite + FTS5，替代每个会话一个 JSON 数组文件的 chat_history/
+
+sessions 表是每个会话的索引（开始时间、消息数、最后一条消息），
+列出会话、读取最新会话都只查这张表；追加一条消息是一次 INSERT 加一次索引更新，
+不再重写整个文件。消息全文用 FTS5 trigram 分词索引，中文子串也能检索；
+SQLite 不支持 FTS5/trigram 或查询少于 3 个字符时退回 LIKE 扫描。
+
+目前只用于迁移和离线查询：服务端仍然把聊天记录写进 chat_history/ 的 JSON 文件，
+这里不会自动收到新消息。迁移可以重复执行，消息数没变的会话跳过、有新消息的会话重新导入，
+需要最新数据时重新运行即可：
+    uv run python -m custom_agents.history_store chat_history --db chat_history/history.db
+"""
+
+import argparse
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from loguru import logger
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    conf_uid TEXT NOT NULL,
+    history_uid TEXT NOT NULL,
+    started_at TEXT,
+    updated_at TEXT,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    last_role TEXT,
+    last_message TEXT,
+    metadata TEXT,
+    PRIMARY KEY (conf_uid, history_uid)
+);
+CREATE INDEX IF NOT EXISTS sessions_recent
+    ON sessions (conf_uid, updated_at DESC);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    conf_uid TEXT NOT NULL,
+    history_uid TEXT NOT NULL,
+    role TEXT NOT NULL,
+    timestamp TEXT,
+    content TEXT NOT NULL,
+    name TEXT,
+    avatar TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_session
+    ON messages (conf_uid, history_uid, id);
+"""
+
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content)
+    VALUES ('delete', old.id, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content)
+    VALUES ('delete', old.id, old.content);
+    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+"""
+
+_SESSION_COLUMNS = (
+    "conf_uid, history_uid, started_at, updated_at, "
+    "message_count, last_role, last_message, metadata"
+)
+
+
+def new_history_uid(
+    moment: Optional[datetime] = None,
+) -> str:
+    """与 Open-LLM-VTuber 的会话文件名格式一致：时间 + uuid"""
+    moment = moment or datetime.now()
+    return f"{moment.strftime('%Y-%m-%d_%H-%M-%S')}_{uuid.uuid4().hex}"
+
+
+def _session(row) -> dict:
+    session = dict(row)
+    session["metadata"] = json.loads(
+        session["metadata"] or "{}"
+    )
+    return session
+
+
+class HistoryStore:
+    """按会话索引的只追加聊天记录存储（线程安全）"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        if db_path != ":memory:":
+            Path(db_path).parent.mkdir(
+                parents=True, exist_ok=True
+            )
+        self.connection = sqlite3.connect(
+            db_path, check_same_thread=False
+        )
+        self.connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self.connection.execute(
+                "PRAGMA journal_mode=WAL"
+            )
+            self.connection.execute(
+                "PRAGMA synchronous=NORMAL"
+            )
+            self.connection.executescript(_SCHEMA)
+            try:
+                self.connection.executescript(_FTS_SCHEMA)
+                self.fts = True
+            except sqlite3.OperationalError as e:
+                logger.warning(
+                    f"FTS5 trigram index unavailable ({e}), search will scan messages"
+                )
+                self.fts = False
+            self.connection.commit()
+
+    def commit(self):
+        with self._lock:
+            self.connection.commit()
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+    # ---- 写入 ----
+
+    def create_session(
+        self,
+        conf_uid: str,
+        history_uid: Optional[str] = None,
+        timestamp: Optional[str] = None,
+        metadata: Optional[dict] = None,
+    ) -> str:
+        timestamp = timestamp or datetime.now().isoformat(
+            timespec="seconds"
+        )
+        history_uid = history_uid or new_history_uid()
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO sessions "
+                "(conf_uid, history_uid, started_at, updated_at, metadata) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    conf_uid,
+                    history_uid,
+                    timestamp,
+                    timestamp,
+                    json.dumps(
+                        metadata or {}, ensure_ascii=False
+                    ),
+                ),
+            )
+            self.connection.commit()
+        return history_uid
+
+    def append(
+        self,
+        conf_uid: str,
+        history_uid: str,
+        role: str,
+        content: str,
+        name: Optional[str] = None,
+        avatar: Optional[str] = None,
+        timestamp: Optional[str] = None,
+    ) -> int:
+        """追加一条消息并更新会话索引，单个事务、与会话长度无关"""
+        timestamp = timestamp or datetime.now().isoformat(
+            timespec="seconds"
+        )
+        with self._lock:
+            cursor = self.connection.execute(
+                "INSERT INTO messages "
+                "(conf_uid, history_uid, role, timestamp, content, name, avatar) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    conf_uid,
+                    history_uid,
+                    role,
+                    timestamp,
+                    content,
+                    name,
+                    avatar,
+                ),
+            )
+            self.connection.execute(
+                "INSERT INTO sessions "
+                "(conf_uid, history_uid, started_at, updated_at, message_count, "
+                "last_role, last_message, metadata) "
+                "VALUES (?, ?, ?, ?, 1, ?, ?, '{}') "
+                "ON CONFLICT (conf_uid, history_uid) DO UPDATE SET "
+                "updated_at = excluded.updated_at, "
+                "message_count = message_count + 1, "
+                "last_role = excluded.last_role, "
+                "last_message = excluded.last_message",
+                (
+                    conf_uid,
+                    history_uid,
+                    timestamp,
+                    timestamp,
+                    role,
+                    content,
+                ),
+            )
+            self.connection.commit()
+        return cursor.lastrowid
+
+    def update_metadata(
+        self,
+        conf_uid: str,
+        history_uid: str,
+        metadata: dict,
+    ):
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT metadata FROM sessions WHERE conf_uid = ? AND history_uid = ?",
+                (conf_uid, history_uid),
+            ).fetchone()
+            if row is None:
+                return
+            merged = json.loads(row[0] or "{}")
+            merged.update(metadata)
+            self.connection.execute(
+                "UPDATE sessions SET metadata = ? WHERE conf_uid = ? AND history_uid = ?",
+                (
+                    json.dumps(merged, ensure_ascii=False),
+                    conf_uid,
+                    history_uid,
+                ),
+            )
+            self.connection.commit()
+
+    def delete_session(
+        self, conf_uid: str, history_uid: str
+    ) -> bool:
+        with self._lock:
+            self.connection.execute(
+                "DELETE FROM messages WHERE conf_uid = ? AND history_uid = ?",
+                (conf_uid, history_uid),
+            )
+            deleted = self.connection.execute(
+                "DELETE FROM sessions WHERE conf_uid = ? AND history_uid = ?",
+                (conf_uid, history_uid),
+            ).rowcount
+            self.connection.commit()
+        return bool(deleted)
+
+    # ---- 读取 ----
+
+    def list_sessions(
+        self,
+        conf_uid: str,
+        limit: int = 50,
+        offset: int = 0,
+    ) -> list:
+        """按最近更新时间倒序分页列出会话（只读索引表）"""
+        with self._lock:
+            rows = self.connection.execute(
+                f"SELECT {_SESSION_COLUMNS} FROM sessions WHERE conf_uid = ? "
+                "ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+                (conf_uid, limit, offset),
+            ).fetchall()
+        return [_session(row) for row in rows]
+
+    def latest_session(
+        self, conf_uid: str
+    ) -> Optional[dict]:
+        sessions = self.list_sessions(conf_uid, limit=1)
+        return sessions[0] if sessions else None
+
+    def get_session(
+        self, conf_uid: str, history_uid: str
+    ) -> Optional[dict]:
+        with self._lock:
+            row = self.connection.execute(
+                f"SELECT {_SESSION_COLUMNS} FROM sessions "
+                "WHERE conf_uid = ? AND history_uid = ?",
+                (conf_uid, history_uid),
+            ).fetchone()
+        return _session(row) if row else None
+
+    def get_messages(
+        self,
+        conf_uid: str,
+        history_uid: str,
+        limit: int = -1,
+        offset: int = 0,
+        latest: bool = False,
+    ) -> list:
+        """分页读取会话消息（按时间顺序）；latest=True 时分页从最新一条往前数"""
+        order = "DESC" if latest else "ASC"
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT id, role, timestamp, content, name, avatar FROM messages "
+                "WHERE conf_uid = ? AND history_uid = ? "
+                f"ORDER BY id {order} LIMIT ? OFFSET ?",
+                (conf_uid, history_uid, limit, offset),
+            ).fetchall()
+        messages = [dict(row) for row in rows]
+        if latest:
+            messages.reverse()
+        return messages
+
+    def search(
+        self,
+        query: str,
+        conf_uid: Optional[str] = None,
+        limit: int = 20,
+        offset: int = 0,
+    ) -> list:
+        """跨会话全文检索，返回命中的消息（含所属会话和片段）"""
+        query = query.strip()
+        if not query:
+            return []
+        scope = "AND m.conf_uid = ? " if conf_uid else ""
+        params = [conf_uid] if conf_uid else []
+        if self.fts and len(query) >= 3:
+            sql = (
+                "SELECT m.id, m.conf_uid, m.history_uid, m.role, m.timestamp, "
+                "snippet(messages_fts, 0, '[', ']', '…', 16) AS snippet "
+                "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+                f"WHERE messages_fts MATCH ? {scope}"
+                "ORDER BY rank LIMIT ? OFFSET ?"
+            )
+            params = [
+                '"' + query.replace('"', '""') + '"',
+                *params,
+            ]
+        else:
+            escaped = (
+                query.replace("\\", "\\\\")
+                .replace("%", "\\%")
+                .replace("_", "\\_")
+            )
+            sql = (
+                "SELECT m.id, m.conf_uid, m.history_uid, m.role, m.timestamp, "
+                "m.content AS snippet FROM messages m "
+                f"WHERE m.content LIKE ? ESCAPE '\\' {scope}"
+                "ORDER BY m.id DESC LIMIT ? OFFSET ?"
+            )
+            params = [f"%{escaped}%", *params]
+        with self._lock:
+            rows = self.connection.execute(
+                sql, (*params, limit, offset)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    # ---- 迁移 ----
+
+    def import_session_file(
+        self, conf_uid: str, path: Path, commit: bool = True
+    ) -> int:
+        """导入一个 JSON 会话文件；已导入且消息数相同则跳过，返回写入的消息数
+
+        commit=False 时不提交事务，由调用方攒够一批文件后调用 commit()。
+        """
+        with open(path, encoding="utf-8") as f:
+            records = json.load(f)
+        metadata = next(
+            (
+                r
+                for r in records
+                if r.get("role") == "metadata"
+            ),
+            {},
+        )
+        messages = [
+            r
+            for r in records
+            if r.get("role") != "metadata"
+            and r.get("content") is not None
+        ]
+        history_uid = path.stem
+        existing = self.get_session(conf_uid, history_uid)
+        if existing and existing["message_count"] == len(
+            messages
+        ):
+            return 0
+
+        started = metadata.get("timestamp") or (
+            messages[0].get("timestamp")
+            if messages
+            else None
+        )
+        last = messages[-1] if messages else {}
+        with self._lock:
+            self.connection.execute(
+                "DELETE FROM messages WHERE conf_uid = ? AND history_uid = ?",
+                (conf_uid, history_uid),
+            )
+            self.connection.executemany(
+                "INSERT INTO messages "
+                "(conf_uid, history_uid, role, timestamp, content, name, avatar) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        conf_uid,
+                        history_uid,
+                        m.get("role"),
+                        m.get("timestamp"),
+                        m.get("content"),
+                        m.get("name"),
+                        m.get("avatar"),
+                    )
+                    for m in messages
+                ),
+            )
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO sessions ({_SESSION_COLUMNS}) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    conf_uid,
+                    history_uid,
+                    started,
+                    last.get("timestamp") or started,
+                    len(messages),
+                    last.get("role"),
+                    last.get("content"),
+                    json.dumps(
+                        {
+                            k: v
+                            for k, v in metadata.items()
+                            if k
+                            not in ("role", "timestamp")
+                        },
+                        ensure_ascii=False,
+                    ),
+                ),
+            )
+            if commit:
+                self.connection.commit()
+        return len(messages)
+
+
+def migrate(
+    history_root: str,
+    db_path: str,
+    files_per_commit: int = 200,
+) -> dict:
+    """把 chat_history/<conf_uid>/*.json 全部导入 SQLite（每 files_per_commit 个文件一个事务）"""
+    store = HistoryStore(db_path)
+    stats = {"sessions": 0, "skipped": 0, "messages": 0}
+    start = time.perf_counter()
+    for conf_dir in sorted(Path(history_root).iterdir()):
+        if not conf_dir.is_dir():
+            continue
+        for path in sorted(conf_dir.glob("*.json")):
+            try:
+                count = store.import_session_file(
+                    conf_dir.name, path, commit=False
+                )
+            except (OSError, ValueError) as e:
+                logger.error(f"Skipping {path}: {e}")
+                continue
+            if count:
+                stats["sessions"] += 1
+                stats["messages"] += count
+                if (
+                    stats["sessions"] % files_per_commit
+                    == 0
+                ):
+                    store.commit()
+            else:
+                stats["skipped"] += 1
+    store.commit()
+    store.close()
+    stats["seconds"] = time.perf_counter() - start
+    print(
+        f"Migrated {stats['sessions']} session(s), {stats['messages']} message(s) "
+        f"in {stats['seconds']:.2f}s ({stats['skipped']} unchanged) -> {db_path}"
+    )
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Migrate chat_history JSON files into the indexed history store"
+    )
+    parser.add_argument(
+        "history_root", nargs="?", default="chat_history"
+    )
+    parser.add_argument(
+        "--db", default="chat_history/history.db"
+    )
+    args = parser.parse_args()
+    migrate(args.history_root, args.db)
+
+
+if __name__ == "__main__":
+    main()
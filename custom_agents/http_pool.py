@@ -0,0 +1,541 @@
+# custom_agents/http_pool.py
+"""
+按 base URL 共享的 keep-alive HTTP 连接池（Ollama 的嵌入、PowerMem 抽取和对话请求共用）
+
+每个 base URL 一个 HTTPPool，内部是一对共享的 httpx 传输层（同步给 PowerMem 的线程用，
+异步给对话用），所有客户端都挂在同一个连接池上复用连接。
+请求在发出前要先通过一个按优先级排队的闸门：同时在途的请求数不超过 max_connections，
+排队时对话（FOREGROUND）总是先于后台记忆写入（BACKGROUND）。
+连接失败、排队超时或 503 时按指数退避加随机抖动重试；请求发出后连接被关闭只对幂等方法重试。
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import httpx
+from loguru import logger
+
+from custom_agents.metrics import RollingStats
+from custom_agents.ollama_stats import _CLIENT_ATTRS
+
+FOREGROUND = 0
+BACKGROUND = 10
+
+_priority: contextvars.ContextVar = contextvars.ContextVar(
+    "http_priority", default=FOREGROUND
+)
+# 连接没建立起来或在池中排队超时：请求还没有发出，任何方法都可以重试
+_NOT_SENT = (
+    httpx.ConnectError,
+    httpx.ConnectTimeout,
+    httpx.PoolTimeout,
+)
+# 请求发出后连接被关闭时服务器可能已经执行过它，只有幂等方法可以重发；
+# 对话和生成都是 POST，重发会让模型再跑一遍
+_IDEMPOTENT = frozenset(
+    ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+)
+
+
+def _can_retry(
+    request: httpx.Request, error: Exception
+) -> bool:
+    return isinstance(error, _NOT_SENT) or (
+        isinstance(error, httpx.RemoteProtocolError)
+        and request.method in _IDEMPOTENT
+    )
+
+
+@contextmanager
+def request_priority(level: int):
+    """在代码块内（含其中启动的任务和 to_thread 线程）发出的请求使用该优先级"""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+class _ThreadWaiter:
+    """线程里的排队者；grant / cancelled 都在闸门的锁内读写"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+        self.cancelled = False
+
+    def grant(self) -> bool:
+        if self.cancelled:
+            return False
+        self.event.set()
+        self.granted = True
+        return True
+
+
+class _AsyncWaiter:
+    """事件循环里的排队者；grant / cancelled 都在闸门的锁内读写"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False
+        self.cancelled = False
+
+    def grant(self) -> bool:
+        if self.cancelled:
+            return False
+        try:
+            self.loop.call_soon_threadsafe(self._resolve)
+        except RuntimeError:
+            # 事件循环已经关闭，没人会再等这个名额
+            return False
+        self.granted = True
+        return True
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class PriorityGate:
+    """限制同时在途请求数的闸门，排队按（优先级，到达顺序）放行；同步、异步共用
+
+    归还名额时直接把它交给下一个排队者：线程用 Event 等待，协程用事件循环里的 Future 等待，
+    排队的协程不占用线程池。等待超过 timeout 秒抛出 httpx.PoolTimeout（None 表示一直等）。
+    """
+
+    def __init__(
+        self, capacity: int, timeout: float = None
+    ):
+        self.capacity = capacity
+        self.timeout = timeout
+        self.in_use = 0
+        self._lock = threading.Lock()
+        self._waiting: list = []
+        self._seq = itertools.count()
+        self.queued = 0
+        self.queue_delay = RollingStats()
+
+    def _take_locked(self) -> bool:
+        if (
+            self.in_use < self.capacity
+            and not self._waiting
+        ):
+            self.in_use += 1
+            return True
+        return False
+
+    def _enqueue_locked(self, priority: int, waiter):
+        self.queued += 1
+        heapq.heappush(
+            self._waiting,
+            (priority, next(self._seq), waiter),
+        )
+
+    def _grant_locked(self):
+        while self._waiting and self.in_use < self.capacity:
+            _, _, waiter = heapq.heappop(self._waiting)
+            if waiter.grant():
+                self.in_use += 1
+
+    def try_acquire(self, priority: int) -> bool:
+        """无人排队且有空位时立即占用，否则返回 False"""
+        with self._lock:
+            if not self._take_locked():
+                return False
+        self.queue_delay.add(0.0)
+        return True
+
+    def acquire(self, priority: int):
+        start = time.perf_counter()
+        with self._lock:
+            if self._take_locked():
+                waiter = None
+            else:
+                waiter = _ThreadWaiter()
+                self._enqueue_locked(priority, waiter)
+        if waiter is not None and not waiter.event.wait(
+            self.timeout
+        ):
+            self._abandon(waiter)
+        self.queue_delay.add(time.perf_counter() - start)
+
+    async def acquire_async(self, priority: int):
+        start = time.perf_counter()
+        with self._lock:
+            if self._take_locked():
+                waiter = None
+            else:
+                waiter = _AsyncWaiter(
+                    asyncio.get_running_loop()
+                )
+                self._enqueue_locked(priority, waiter)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(
+                    asyncio.shield(waiter.future),
+                    self.timeout,
+                )
+            except asyncio.TimeoutError:
+                self._abandon(waiter)
+            except asyncio.CancelledError:
+                # 请求已取消：还在排队就放弃排位，已经拿到名额就立即归还
+                with self._lock:
+                    waiter.cancelled = True
+                    granted = waiter.granted
+                if granted:
+                    self.release()
+                raise
+        self.queue_delay.add(time.perf_counter() - start)
+
+    def _abandon(self, waiter):
+        """排队超时：放弃排位；超时的同时恰好拿到名额就照常使用"""
+        with self._lock:
+            waiter.cancelled = True
+            granted = waiter.granted
+        if not granted:
+            raise httpx.PoolTimeout(
+                f"No connection slot freed within {self.timeout}s"
+            )
+
+    def release(self):
+        with self._lock:
+            self.in_use -= 1
+            self._grant_locked()
+
+
+class HTTPPool:
+    """一个 base URL 的共享连接池、优先级闸门、重试策略和计数器"""
+
+    def __init__(
+        self,
+        base_url: str,
+        max_connections: int = 4,
+        max_keepalive: int = 4,
+        keepalive_expiry: float = 60.0,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 120.0,
+        retries: int = 2,
+        backoff: float = 0.2,
+        queue_timeout: float = 30.0,
+    ):
+        self.base_url = base_url
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = httpx.Timeout(
+            read_timeout, connect=connect_timeout
+        )
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        # 排队等名额的上限：连接超时之外再给 queue_timeout 秒的排队预算
+        self.gate = PriorityGate(
+            max_connections,
+            timeout=connect_timeout + queue_timeout,
+        )
+        self._transport = httpx.HTTPTransport(limits=limits)
+        self._async_transport = httpx.AsyncHTTPTransport(
+            limits=limits
+        )
+        self.requests = 0
+        self.responses = 0
+        self.new_connections = 0
+        self.retried = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    # ---- 计数 ----
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def _on_trace(self, event: str, info: dict):
+        if event == "connection.connect_tcp.complete":
+            self._count("new_connections")
+
+    async def _on_trace_async(self, event: str, info: dict):
+        self._on_trace(event, info)
+
+    def _delay(self, attempt: int) -> float:
+        return (
+            self.backoff
+            * (2**attempt)
+            * (0.5 + random.random())
+        )
+
+    @property
+    def reused(self) -> int:
+        """得到响应的请求中复用已有连接的次数"""
+        return max(0, self.responses - self.new_connections)
+
+    def stats(self) -> str:
+        reuse = (
+            self.reused / self.responses
+            if self.responses
+            else 0.0
+        )
+        return (
+            f"{self.base_url}: requests={self.requests} "
+            f"new_connections={self.new_connections} reuse={reuse:.0%} "
+            f"queued={self.gate.queued} retried={self.retried} failed={self.failed} "
+            f"queue_delay[{self.gate.queue_delay.format()}]"
+        )
+
+    # ---- 传输层 ----
+
+    def transport(self) -> httpx.BaseTransport:
+        return _PooledTransport(self)
+
+    def async_transport(self) -> httpx.AsyncBaseTransport:
+        return _PooledAsyncTransport(self)
+
+    def client(self, **kwargs) -> httpx.Client:
+        kwargs.setdefault("timeout", self.timeout)
+        return httpx.Client(
+            transport=self.transport(), **kwargs
+        )
+
+    def async_client(self, **kwargs) -> httpx.AsyncClient:
+        kwargs.setdefault("timeout", self.timeout)
+        return httpx.AsyncClient(
+            transport=self.async_transport(), **kwargs
+        )
+
+    def close(self):
+        self._transport.close()
+
+
+class _PooledTransport(httpx.BaseTransport):
+    def __init__(self, pool: HTTPPool):
+        self.pool = pool
+
+    def handle_request(self, request):
+        pool = self.pool
+        request.extensions["trace"] = pool._on_trace
+        pool.gate.acquire(current_priority())
+        try:
+            for attempt in range(pool.retries + 1):
+                pool._count("requests")
+                try:
+                    response = (
+                        pool._transport.handle_request(
+                            request
+                        )
+                    )
+                except httpx.TransportError as e:
+                    if (
+                        attempt >= pool.retries
+                        or not _can_retry(request, e)
+                    ):
+                        pool._count("failed")
+                        raise
+                else:
+                    if (
+                        response.status_code != 503
+                        or attempt >= pool.retries
+                    ):
+                        # 流式响应读完之前连接仍被占用，读完/关闭时才释放闸门
+                        response.stream = _ReleasingStream(
+                            response.stream, pool.gate
+                        )
+                        pool._count("responses")
+                        return response
+                    response.close()
+                pool._count("retried")
+                time.sleep(pool._delay(attempt))
+        except BaseException:
+            pool.gate.release()
+            raise
+
+    def close(self):
+        pass
+
+
+class _PooledAsyncTransport(httpx.AsyncBaseTransport):
+    def __init__(self, pool: HTTPPool):
+        self.pool = pool
+
+    async def handle_async_request(self, request):
+        pool = self.pool
+        request.extensions["trace"] = pool._on_trace_async
+        await pool.gate.acquire_async(current_priority())
+        try:
+            for attempt in range(pool.retries + 1):
+                pool._count("requests")
+                try:
+                    response = await pool._async_transport.handle_async_request(
+                        request
+                    )
+                except httpx.TransportError as e:
+                    if (
+                        attempt >= pool.retries
+                        or not _can_retry(request, e)
+                    ):
+                        pool._count("failed")
+                        raise
+                else:
+                    if (
+                        response.status_code != 503
+                        or attempt >= pool.retries
+                    ):
+                        response.stream = (
+                            _AsyncReleasingStream(
+                                response.stream, pool.gate
+                            )
+                        )
+                        pool._count("responses")
+                        return response
+                    await response.aclose()
+                pool._count("retried")
+                await asyncio.sleep(pool._delay(attempt))
+        except BaseException:
+            pool.gate.release()
+            raise
+
+    async def aclose(self):
+        pass
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    def __init__(self, stream, gate: PriorityGate):
+        self._stream = stream
+        self._gate = gate
+        self._released = False
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if not self._released:
+                self._released = True
+                self._gate.release()
+
+
+class _AsyncReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, gate: PriorityGate):
+        self._stream = stream
+        self._gate = gate
+        self._released = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                self._gate.release()
+
+
+_POOLS: dict = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def _origin(url: str) -> str:
+    """http://localhost:11434/v1 与 http://localhost:11434 共用一个连接池"""
+    parts = urlsplit(str(url))
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_pool(base_url: str, **config) -> HTTPPool:
+    """取得（或创建）该地址的共享连接池；配置只在第一次创建时生效"""
+    origin = _origin(base_url)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(origin)
+        if pool is None:
+            pool = _POOLS[origin] = HTTPPool(
+                origin, **config
+            )
+        return pool
+
+
+def all_pools() -> list:
+    with _POOLS_LOCK:
+        return list(_POOLS.values())
+
+
+def _rebind_ollama(client, pool_config: dict) -> bool:
+    """把 ollama.Client / AsyncClient 内部的 httpx 客户端换成共享连接池上的客户端"""
+    old = getattr(client, "_client", None)
+    if not isinstance(
+        old, (httpx.Client, httpx.AsyncClient)
+    ):
+        return False
+    pool = get_pool(str(old.base_url), **pool_config)
+    options = dict(
+        base_url=old.base_url,
+        headers=old.headers,
+        follow_redirects=True,
+    )
+    if isinstance(old, httpx.AsyncClient):
+        client._client = pool.async_client(**options)
+    else:
+        client._client = pool.client(**options)
+        old.close()
+    return True
+
+
+def _rebind_openai(client, pool_config: dict):
+    """返回挂在共享连接池上的 OpenAI / AsyncOpenAI 客户端副本"""
+    pool = get_pool(str(client.base_url), **pool_config)
+    if type(client).__name__.startswith("Async"):
+        return client.with_options(
+            http_client=pool.async_client()
+        )
+    return client.with_options(http_client=pool.client())
+
+
+def attach_client(
+    owner, attr: str, pool_config: dict
+) -> bool:
+    """把 owner.attr 上的 ollama 或 OpenAI 客户端接入共享连接池"""
+    client = getattr(owner, attr, None)
+    if client is None:
+        return False
+    package = type(client).__module__.split(".")[0]
+    try:
+        if package == "ollama":
+            return _rebind_ollama(client, pool_config)
+        if package == "openai":
+            setattr(
+                owner,
+                attr,
+                _rebind_openai(client, pool_config),
+            )
+            return True
+    except Exception as e:
+        logger.warning(
+            f"Could not attach {type(client).__name__} to the shared HTTP pool: {e}"
+        )
+    return False
+
+
+def attach_llm(llm, pool_config: dict) -> bool:
+    """把 Open-LLM-VTuber LLM 对象持有的客户端接入共享连接池"""
+    for attr in _CLIENT_ATTRS:
+        if attach_client(llm, attr, pool_config):
+            logger.debug(
+                f"Chat LLM client '{attr}' attached to the shared HTTP pool"
+            )
+            return True
+    return False
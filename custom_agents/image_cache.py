@@ -0,0 +1,175 @@
+# custom_agents/image_cache.py
+"""
+多模态输入的图片预处理：缩小、重新编码，并按内容哈希缓存
+
+前端送来的截图和摄像头画面是原始分辨率的 data URL（PNG 截图常有几 MB），
+原样发给 Ollama 时要在 HTTP 里传一遍、再由视觉编码器解码缩放一遍。Agent 在每轮开始时
+（与记忆检索同时）在工作线程里处理本轮的图片，_to_messages 直接使用处理结果：
+- 每张图只解码一次，长边缩到 max_side 以内，重新编码为 JPEG / WebP；
+- 处理结果按 data URL 的哈希缓存，桌宠反复看到同一画面时直接复用，不再解码；
+- 同一轮里重复的图片只发送一次；
+- 带透明通道的截图先铺到白色背景上再转 RGB，透明区域不会变成黑色；
+- 重新编码后反而更大（例如本来就很小的 JPEG）时保留原图。
+Pillow 随 Open-LLM-VTuber 安装；导入失败时原样发送图片。
+"""
+
+import base64
+import binascii
+import hashlib
+import io
+import time
+from dataclasses import dataclass
+
+from loguru import logger
+
+from custom_agents.memory_cache import TTLCache
+from custom_agents.metrics import RollingStats
+
+
+@dataclass
+class ProcessedImage:
+    url: str
+    digest: str
+    width: int
+    height: int
+    original_bytes: int
+    bytes: int
+
+
+class ImagePreprocessor:
+    def __init__(
+        self,
+        max_side: int = 1280,
+        format: str = "jpeg",
+        quality: int = 80,
+        cache_size: int = 32,
+        cache_ttl: float = 3600.0,
+    ):
+        if format not in ("jpeg", "webp"):
+            raise ValueError(
+                f"Unknown image format: {format}"
+            )
+        self.max_side = max_side
+        self.format = format
+        self.quality = quality
+        self._cache = TTLCache(cache_size, cache_ttl)
+        self.available = True
+        self.images = 0
+        self.original_bytes = 0
+        self.sent_bytes = 0
+        self.process_seconds = RollingStats()
+
+    @staticmethod
+    def digest(data_url: str) -> str:
+        return hashlib.blake2b(
+            data_url.encode("ascii", "replace"),
+            digest_size=16,
+        ).hexdigest()
+
+    def process(self, data_url: str) -> ProcessedImage:
+        """返回处理后的图片；无法解码时原样返回"""
+        key = self.digest(data_url)
+        result = self._cache.get(key)
+        if result is None:
+            start = time.perf_counter()
+            result = self._encode(data_url, key)
+            self.process_seconds.add(
+                time.perf_counter() - start
+            )
+            self._cache.put(key, result)
+        self.images += 1
+        self.original_bytes += result.original_bytes
+        self.sent_bytes += result.bytes
+        return result
+
+    def _encode(
+        self, data_url: str, key: str
+    ) -> ProcessedImage:
+        unchanged = ProcessedImage(
+            data_url,
+            key,
+            0,
+            0,
+            len(data_url),
+            len(data_url),
+        )
+        if not self.available:
+            return unchanged
+        try:
+            from PIL import Image, ImageOps
+        except ImportError as e:
+            logger.warning(
+                f"Pillow unavailable ({e}), images are sent unchanged"
+            )
+            self.available = False
+            return unchanged
+        try:
+            raw = base64.b64decode(
+                data_url.partition(",")[2], validate=False
+            )
+            image = Image.open(io.BytesIO(raw))
+            # JPEG 可以在解码时直接按 1/2、1/4… 缩小，省掉大部分解码工作
+            image.draft(
+                "RGB", (self.max_side, self.max_side)
+            )
+            image = ImageOps.exif_transpose(image)
+            if image.mode in ("RGBA", "LA") or (
+                image.mode == "P"
+                and "transparency" in image.info
+            ):
+                image = image.convert("RGBA")
+                background = Image.new(
+                    "RGB", image.size, (255, 255, 255)
+                )
+                background.paste(
+                    image, mask=image.getchannel("A")
+                )
+                image = background
+            elif image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.thumbnail(
+                (self.max_side, self.max_side),
+                Image.Resampling.BILINEAR,
+                reducing_gap=2.0,
+            )
+            buffer = io.BytesIO()
+            image.save(
+                buffer,
+                format=self.format.upper(),
+                quality=self.quality,
+            )
+        except (
+            OSError,
+            ValueError,
+            binascii.Error,
+            Image.DecompressionBombError,
+        ) as e:
+            logger.warning(
+                f"Failed to preprocess image, sending it unchanged: {e}"
+            )
+            return unchanged
+        url = (
+            f"data:image/{self.format};base64,"
+            + base64.b64encode(buffer.getvalue()).decode(
+                "ascii"
+            )
+        )
+        if len(url) >= len(data_url):
+            url = data_url
+        return ProcessedImage(
+            url,
+            key,
+            image.width,
+            image.height,
+            len(data_url),
+            len(url),
+        )
+
+    def stats(self) -> str:
+        saved = self.original_bytes - self.sent_bytes
+        return (
+            f"images={self.images} cache_hits={self._cache.hits} "
+            f"sent={self.sent_bytes / 1024:.0f}KB saved={saved / 1024:.0f}KB "
+            f"({saved / self.original_bytes if self.original_bytes else 0:.0%}); "
+            f"processing {self.process_seconds.format()}"
+        )
@@ -0,0 +1,237 @@
+# custom_agents/lexical_index.py
+"""
+记忆库内的关键词索引（SQLite FTS5），供混合检索使用
+
+很多回忆类的提问靠的是原样出现的词：名字、日期、“星期五”。这类查询不需要先请求一次
+Ollama 嵌入，直接在 <user>_memory.db 里的 FTS5 表上查就能命中，耗时在毫秒以内。
+
+中文没有空格分词，FTS5 自带的 trigram 分词又要求查询词至少 3 个字，
+而中文词多为两个字，所以这里在写入前把文本切成字符二元组（“星期五” -> “星期 期五”），
+数字与相邻汉字一起切（“3月5日” -> “3月 月5 5日”），英文单词保持完整，再交给 unicode61 分词。
+查询同样切分后各项取 OR，按 bm25 排序。
+
+每条命中还会算一个 0~1 的覆盖率：命中的查询项占全部查询项的比例，按 idf 加权，
+记忆库里从没出现过的查询项不计入（它们任何一条记忆都不可能命中），
+出现在超过 max_df 比例记忆里的常见项（“你回答”“用户说”）也不参与检索和覆盖率。
+覆盖率高说明查询里的关键信息都在这条记忆里，混合检索据此决定是否跳过向量检索。
+
+索引只在本进程写入记忆时增量维护；打开时与记忆表核对一次，
+补上其他进程（导入脚本、离线整理）写入或删除的行。
+"""
+
+import json
+import math
+import re
+import sqlite3
+from typing import Iterable
+
+from loguru import logger
+
+_SEGMENT = re.compile(
+    r"[a-z]+|[0-9\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+"
+)
+_UNIT = re.compile(r"[0-9]+|.")
+
+
+def lexical_terms(text: str) -> list:
+    """把文本切成索引项：汉字（及夹在其中的数字）取相邻二元组，英文单词和数字串保持完整"""
+    terms = []
+    for segment in _SEGMENT.findall(text.lower()):
+        if segment.isascii() and segment.isalpha():
+            terms.append(segment)
+            continue
+        units = _UNIT.findall(segment)
+        if len(units) == 1:
+            terms.append(units[0])
+        else:
+            terms.extend(
+                a + b for a, b in zip(units, units[1:])
+            )
+    return terms
+
+
+class LexicalIndex:
+    """与 PowerMem 向量表同库的 FTS5 索引，rowid 即记忆 id"""
+
+    def __init__(self, store, max_df: float = 0.5):
+        self.store = store
+        self.table = f"{store.collection_name}_lexical"
+        self.max_df = max_df
+        self.available = True
+        self._total = 0
+        try:
+            with store._lock:
+                store.connection.executescript(f"""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5(
+                        terms, tokenize='unicode61'
+                    );
+                    CREATE VIRTUAL TABLE IF NOT EXISTS {self.table}_vocab
+                        USING fts5vocab({self.table}, 'row');
+                    """)
+                store.connection.commit()
+                self._total = store.connection.execute(
+                    f"SELECT COUNT(*) FROM {self.table}"
+                ).fetchone()[0]
+        except sqlite3.OperationalError as e:
+            logger.warning(
+                f"FTS5 unavailable ({e}), hybrid memory search disabled"
+            )
+            self.available = False
+
+    def _execute(self, sql: str, params=()) -> list:
+        with self.store._lock:
+            return self.store.connection.execute(
+                sql, params
+            ).fetchall()
+
+    def sync(self) -> tuple:
+        """补齐缺失的行、删除已不存在的行，返回 (新增, 删除) 条数"""
+        if not self.available:
+            return 0, 0
+        memories = self.store.collection_name
+        missing = [
+            row[0]
+            for row in self._execute(
+                f"SELECT id FROM {memories} WHERE id NOT IN "
+                f"(SELECT rowid FROM {self.table})"
+            )
+        ]
+        stale = [
+            row[0]
+            for row in self._execute(
+                f"SELECT rowid FROM {self.table} WHERE rowid NOT IN "
+                f"(SELECT id FROM {memories})"
+            )
+        ]
+        self.remove(stale)
+        self.upsert(missing)
+        if missing or stale:
+            logger.info(
+                f"Lexical memory index synced: +{len(missing)} -{len(stale)}"
+            )
+        return len(missing), len(stale)
+
+    def upsert(self, ids: Iterable[int]):
+        ids = [int(i) for i in ids]
+        if not self.available or not ids:
+            return
+        placeholders = ",".join("?" * len(ids))
+        with self.store._lock:
+            connection = self.store.connection
+            rows = connection.execute(
+                f"SELECT id, payload FROM {self.store.collection_name} "
+                f"WHERE id IN ({placeholders})",
+                ids,
+            ).fetchall()
+            self._total -= connection.execute(
+                f"DELETE FROM {self.table} WHERE rowid IN ({placeholders})",
+                ids,
+            ).rowcount
+            entries = [
+                (
+                    memory_id,
+                    " ".join(
+                        lexical_terms(
+                            json.loads(payload or "{}").get(
+                                "data"
+                            )
+                            or ""
+                        )
+                    ),
+                )
+                for memory_id, payload in rows
+            ]
+            connection.executemany(
+                f"INSERT INTO {self.table} (rowid, terms) VALUES (?, ?)",
+                entries,
+            )
+            connection.commit()
+            self._total += len(entries)
+
+    def remove(self, ids: Iterable[int]):
+        ids = [int(i) for i in ids]
+        if not self.available or not ids:
+            return
+        with self.store._lock:
+            self._total -= self.store.connection.execute(
+                f"DELETE FROM {self.table} WHERE rowid IN "
+                f"({','.join('?' * len(ids))})",
+                ids,
+            ).rowcount
+            self.store.connection.commit()
+
+    def _idf(self, terms: list) -> dict:
+        """查询项 -> idf；记忆库里没有出现过的项和过于常见的项不返回"""
+        total = self._total
+        rows = self._execute(
+            f"SELECT term, doc FROM {self.table}_vocab "
+            f"WHERE term IN ({','.join('?' * len(terms))})",
+            terms,
+        )
+        return {
+            term: math.log(
+                1 + (total - doc + 0.5) / (doc + 0.5)
+            )
+            for term, doc in rows
+            if doc <= self.max_df * total
+        }
+
+    def search(self, query: str, limit: int) -> list:
+        """返回 [(记忆 id, 覆盖率, 命中的查询项数), ...]，按 bm25 从好到差排列
+
+        每个用户一个 .db，这里不按 user_id 过滤，由调用方读取记忆时再核对
+        """
+        terms = list(dict.fromkeys(lexical_terms(query)))
+        if not self.available or not terms:
+            return []
+        idf = self._idf(terms)
+        if not idf:
+            return []
+        expression = " OR ".join(
+            '"' + term.replace('"', '""') + '"'
+            for term in idf
+        )
+        rows = self._execute(
+            f"SELECT rowid, terms FROM {self.table} "
+            f"WHERE {self.table} MATCH ? "
+            f"ORDER BY bm25({self.table}) LIMIT ?",
+            (expression, limit),
+        )
+        total = sum(idf.values())
+        hits = []
+        for memory_id, indexed in rows:
+            matched = idf.keys() & set(indexed.split())
+            hits.append(
+                (
+                    memory_id,
+                    sum(idf[t] for t in matched) / total,
+                    len(matched),
+                )
+            )
+        return hits
+
+
+def reciprocal_rank_fusion(
+    rankings: list, limit: int, k: int = 60
+) -> list:
+    """把多路检索结果（PowerMem 格式，各自已按相关度排序）按 RRF 融合，返回前 limit 条
+
+    同一条记忆出现在多路结果中时，字段以先出现的那一路为准（向量结果应放在前面，
+    保留余弦相似度作为 score），其余路独有的字段（如 lexical_match）保留。
+    """
+    fused, items = {}, {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            memory_id = int(item["id"])
+            fused[memory_id] = fused.get(
+                memory_id, 0.0
+            ) + 1.0 / (k + rank + 1)
+            items[memory_id] = {
+                **item,
+                **items.get(memory_id, {}),
+            }
+    order = sorted(fused, key=fused.get, reverse=True)
+    return [
+        {**items[memory_id], "rrf": fused[memory_id]}
+        for memory_id in order[:limit]
+    ]
@@ -0,0 +1,192 @@
+# custom_agents/log_config.py
+"""
+日志输出配置与热路径日志的限流通道
+
+两种模式：
+- "debug"（默认）：每次启动一个同步写入的 DEBUG 日志文件，带完整的变量诊断，开发时用；
+- "production"：每个 sink 由一个专用写线程输出，事件循环只负责格式化并放入队列，
+  不再等待终端和磁盘；文件固定为 logs/kristina.log，按大小（或时间）轮转、zip 压缩、过期清理，
+  轮转和压缩也都在写线程里完成。
+
+没有用 loguru 的 enqueue=True：它为跨进程设计，每条日志都要 pickle 并写一次管道，
+在调用方的开销比同步写缓冲文件还大（见 benchmarks/bench_logging.py）。
+
+每轮对话都会执行的 DEBUG 日志通过 hot_log 输出。生产模式下 hot_log 先按调用位置限流：
+每个位置在 window 秒内最多放行 burst 条，其余直接丢弃（不构造 loguru 记录，几乎没有开销）
+并计数，下一条放行的日志末尾注明被丢弃的条数。普通 logger 调用不受影响。
+"""
+
+import copy
+import queue
+import sys
+import threading
+import time
+
+from loguru import logger
+
+
+class HotPathSampler:
+    def __init__(
+        self, burst: int = 5, window: float = 10.0
+    ):
+        self.burst = burst
+        self.window = window
+        self._windows: dict = {}
+        self._lock = threading.Lock()
+        self.passed = 0
+        self.suppressed = 0
+
+    def admit(self, key) -> int:
+        """放行时返回此前被丢弃的条数，丢弃时返回 -1"""
+        now = time.monotonic()
+        with self._lock:
+            start, count, dropped = self._windows.get(
+                key, (now, 0, 0)
+            )
+            if now - start >= self.window:
+                start, count = now, 0
+            if count >= self.burst:
+                self._windows[key] = (
+                    start,
+                    count,
+                    dropped + 1,
+                )
+                self.suppressed += 1
+                return -1
+            self._windows[key] = (start, count + 1, 0)
+            self.passed += 1
+            return dropped
+
+
+class HotLog:
+    """热路径日志通道，用法同 logger.debug / logger.info"""
+
+    def __init__(self):
+        self.sampler = None
+
+    def _log(
+        self, level: str, message: str, *args, **kwargs
+    ):
+        if self.sampler is not None:
+            caller = sys._getframe(2)
+            dropped = self.sampler.admit(
+                (caller.f_code, caller.f_lineno)
+            )
+            if dropped < 0:
+                return
+            if dropped:
+                message = (
+                    f"{message} [+{dropped} suppressed]"
+                )
+        logger.opt(depth=2).log(
+            level, message, *args, **kwargs
+        )
+
+    def debug(self, message: str, *args, **kwargs):
+        self._log("DEBUG", message, *args, **kwargs)
+
+    def info(self, message: str, *args, **kwargs):
+        self._log("INFO", message, *args, **kwargs)
+
+
+hot_log = HotLog()
+
+
+class BackgroundWriter:
+    """loguru sink：调用方只把格式化好的文本放进队列，由写线程交给独立 logger 的真实 sink"""
+
+    _STOP = object()
+
+    def __init__(self, template, sink, **options):
+        # template 是没有 handler 时复制出来的 logger（loguru 文档中创建独立 logger 的做法）
+        self._logger = copy.deepcopy(template)
+        self._logger.add(
+            sink, level=0, format="{message}", **options
+        )
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(
+            target=self._drain,
+            name="log-writer",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _drain(self):
+        emit = self._logger.opt(raw=True).log
+        while True:
+            message = self._queue.get()
+            if message is self._STOP:
+                break
+            emit(message.record["level"].no, message)
+        self._logger.remove()
+
+    def write(self, message):
+        self._queue.put(message)
+
+    def stop(self):
+        # loguru 移除 sink 时调用（包括退出时），写完队列里剩下的日志
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+
+CONSOLE_FORMAT = "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> | {message}"
+FILE_FORMAT = "{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <8} | {name}:{function}:{line} | {message} | {extra}"
+
+
+def configure_logging(
+    console_level: str = "INFO",
+    mode: str = "debug",
+    log_dir: str = "logs",
+    console=sys.stderr,
+    rotation: str = "20 MB",
+    retention: str = "14 days",
+    compression: str = "zip",
+) -> list:
+    """按模式重新配置 loguru 的 sink，返回 sink id 列表"""
+    if mode not in ("debug", "production"):
+        raise ValueError(f"Unknown log mode: {mode}")
+    logger.remove()
+    production = mode == "production"
+    template = copy.deepcopy(logger)
+    hot_log.sampler = (
+        HotPathSampler() if production else None
+    )
+    sinks = [
+        logger.add(
+            (
+                BackgroundWriter(template, console)
+                if production
+                else console
+            ),
+            level=console_level,
+            format=CONSOLE_FORMAT,
+            colorize=True,
+        )
+    ]
+    if production:
+        sinks.append(
+            logger.add(
+                BackgroundWriter(
+                    template,
+                    f"{log_dir}/kristina.log",
+                    rotation=rotation,
+                    retention=retention,
+                    compression=compression,
+                ),
+                level="DEBUG",
+                format=FILE_FORMAT,
+                backtrace=True,
+                diagnose=False,
+            )
+        )
+    else:
+        sinks.append(
+            logger.add(
+                f"{log_dir}/debug_{time.time()}.log",
+                level="DEBUG",
+                format=FILE_FORMAT,
+                backtrace=True,
+                diagnose=True,
+            )
+        )
+    return sinks
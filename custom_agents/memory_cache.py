@@ -0,0 +1,125 @@
+# custom_agents/memory_cache.py
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from difflib import SequenceMatcher
+from typing import Any, Hashable, Optional
+
+# 归一化时去掉的尾部语气词与标点，让“你记得我最喜欢星期几吗？”
+# 和“你记得我最喜欢星期几吗”命中同一条缓存
+_TRAILING_CHARS = "？?！!。.，,~～…、 呀啊呢吧嘛啦哦"
+
+
+# 单独成句时不携带信息的语气词和英文寒暄；只有整句都由它们（加标点）组成时才算寒暄
+_INTERJECTIONS = frozenset(
+    "嗯哦噢喔啊呀哇哈呵嘿诶欸额呃唔嘛呢吧啦咯哟"
+)
+_FILLER_WORDS = frozenset(
+    (
+        "ok",
+        "okay",
+        "hmm",
+        "hm",
+        "um",
+        "uh",
+        "hi",
+        "hey",
+        "lol",
+        "haha",
+    )
+)
+_TOKEN = re.compile(r"[a-z0-9]+|\S")
+
+
+def is_filler(text: str) -> bool:
+    """整句只由空白、标点和语气词组成（“嗯嗯”“哈哈！”“ok~”），空文本也算"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return all(
+        token in _INTERJECTIONS
+        or token in _FILLER_WORDS
+        or not token.isalnum()
+        for token in _TOKEN.findall(text)
+    )
+
+
+def normalize_query(text: str) -> str:
+    """把查询文本归一化为缓存键（全半角统一、小写、压缩空白、去尾部语气词）"""
+    text = unicodedata.normalize("NFKC", text)
+    text = " ".join(text.lower().split())
+    return text.rstrip(_TRAILING_CHARS)
+
+
+def text_similarity(a: str, b: str) -> float:
+    """两段查询文本归一化后的相似度（0~1），用于判断预取结果能否复用"""
+    a, b = normalize_query(a), normalize_query(b)
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    return SequenceMatcher(None, a, b).ratio()
+
+
+class TTLCache:
+    """线程安全的 LRU + TTL 缓存，并统计命中/未命中次数"""
+
+    _MISSING = object()
+
+    def __init__(
+        self, maxsize: int = 256, ttl: float = 600.0
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+        self, key: Hashable, default: Any = None
+    ) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, self._MISSING)
+            if entry is self._MISSING or entry[0] < now:
+                if entry is not self._MISSING:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(
+        self,
+        key: Hashable,
+        value: Any,
+        ttl: Optional[float] = None,
+    ) -> None:
+        expires = time.monotonic() + (
+            self.ttl if ttl is None else ttl
+        )
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> str:
+        return (
+            f"hits={self.hits} misses={self.misses} "
+            f"rate={self.hit_rate:.0%} size={len(self)}"
+        )
@@ -0,0 +1,468 @@
+# custom_agents/memory_consolidation.py
+"""
+长期记忆整理：合并近似重复的记忆、清理过期的低价值记忆、压缩数据库
+
+每轮对话都会写入一条新记忆，同一件事反复说就会留下许多几乎相同的记录，
+检索变慢、结果也更杂。整理按批次做向量化的相似度计算（新记忆 × 全部记忆），
+余弦相似度达到 similarity 的记忆归为一簇，只保留时间最新的一条作为规范记忆，
+其标签取全簇并集、时间取全簇最新，其余删除。
+可选的过期清理（expire_days > 0）只删除没人用的记忆：超过 expire_days 天、没有标签、
+从未被合并过（没有反复提到），并且最近 expire_days 天里一次也没有被检索注入对话。
+检索记录由 Agent 通过 note_retrieved 交给整理器，随整理状态一起保存；
+开始记录还不满 expire_days 天时不清理任何记忆。有删除时最后执行 VACUUM 和 REINDEX。
+
+整理是增量的：状态文件记录上次处理到的记忆 id（雪花 id 随时间递增），
+下次只拿新记忆与全库比较。
+
+单独运行（请先关闭 Kristina）；--measure-latency 会在整理前后各做几次全表检索并报告耗时，
+Agent 内的定期整理不做这项测量，以免长时间占用向量库的锁：
+    uv run python -m custom_agents.memory_consolidation powermem_data/kristina_memory.db --measure-latency
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+import numpy as np
+from loguru import logger
+
+from custom_agents.vector_rows import decode_vector
+
+
+def _db_size(db_path: str) -> int:
+    return sum(
+        os.path.getsize(p)
+        for p in (db_path, db_path + "-wal")
+        if os.path.exists(p)
+    )
+
+
+def _moment(payload: dict) -> datetime:
+    """记忆的时间：优先 metadata.timestamp（本地时间），否则 created_at"""
+    metadata = payload.get("metadata") or {}
+    for value in (
+        metadata.get("timestamp"),
+        payload.get("updated_at"),
+        payload.get("created_at"),
+    ):
+        if not value:
+            continue
+        try:
+            return datetime.fromisoformat(
+                str(value)
+            ).astimezone()
+        except ValueError:
+            continue
+    return datetime.fromtimestamp(0).astimezone()
+
+
+class _Clusters:
+    """按 id 合并的并查集"""
+
+    def __init__(self):
+        self._parent: dict = {}
+
+    def find(self, x: int) -> int:
+        parent = self._parent.setdefault(x, x)
+        if parent != x:
+            parent = self._parent[x] = self.find(parent)
+        return parent
+
+    def union(self, a: int, b: int):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self._parent[max(ra, rb)] = min(ra, rb)
+
+    def groups(self) -> list:
+        groups: dict = {}
+        for x in self._parent:
+            groups.setdefault(self.find(x), []).append(x)
+        return [g for g in groups.values() if len(g) > 1]
+
+
+class MemoryConsolidator:
+    def __init__(
+        self,
+        store,
+        state_path: str,
+        similarity: float = 0.95,
+        expire_days: float = 0,
+        batch_size: int = 256,
+        latency_samples: int = 0,
+    ):
+        self.store = store
+        self.state_path = state_path
+        self.similarity = similarity
+        self.expire_days = expire_days
+        self.batch_size = batch_size
+        self.latency_samples = latency_samples
+        # 同一个库同一时间只整理一次（定期任务与手动调用可能重叠）
+        self._run_lock = threading.Lock()
+        self._retrieved_lock = threading.Lock()
+        self.last_id = 0
+        state = {}
+        if os.path.exists(state_path):
+            with open(state_path, encoding="utf-8") as f:
+                state = json.load(f)
+        self.last_id = state.get("last_id", 0)
+        # 记忆 id -> 最近一次被检索注入对话的时间（Unix 时间戳）
+        self._retrieved = {
+            int(memory_id): moment
+            for memory_id, moment in (
+                state.get("retrieved") or {}
+            ).items()
+        }
+        self.tracking_since = state.get(
+            "tracking_since", time.time()
+        )
+
+    @property
+    def _table(self) -> str:
+        return self.store.collection_name
+
+    def _save_state(self, last_id: int):
+        self.last_id = last_id
+        with self._retrieved_lock:
+            retrieved = dict(self._retrieved)
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "last_id": last_id,
+                    "last_run": datetime.now().isoformat(),
+                    "tracking_since": self.tracking_since,
+                    "retrieved": retrieved,
+                },
+                f,
+            )
+        os.replace(tmp, self.state_path)
+
+    def note_retrieved(self, ids: list):
+        """Agent 把检索到并注入对话的记忆 id 交给整理器（任意线程调用）"""
+        now = time.time()
+        with self._retrieved_lock:
+            for memory_id in ids:
+                self._retrieved[int(memory_id)] = now
+
+    def flush(self):
+        """保存检索记录（分片关闭时调用）"""
+        self._save_state(self.last_id)
+
+    def pending(self) -> int:
+        """上次整理之后新增的记忆条数"""
+        with self.store._lock:
+            return self.store.connection.execute(
+                f"SELECT COUNT(*) FROM {self._table} WHERE id > ?",
+                (self.last_id,),
+            ).fetchone()[0]
+
+    def _load(self) -> tuple:
+        with self.store._lock:
+            rows = self.store.connection.execute(
+                f"SELECT id, vector, payload FROM {self._table} ORDER BY id"
+            ).fetchall()
+        if not rows:
+            return (
+                np.empty(0, dtype=np.int64),
+                np.empty((0, 0), dtype=np.float32),
+                {},
+            )
+        ids = np.array(
+            [row[0] for row in rows], dtype=np.int64
+        )
+        matrix = np.stack(
+            [decode_vector(row[1]) for row in rows]
+        )
+        norms = np.linalg.norm(
+            matrix, axis=1, keepdims=True
+        )
+        matrix /= np.where(norms == 0, 1, norms)
+        payloads = {
+            row[0]: json.loads(row[2]) for row in rows
+        }
+        return ids, matrix, payloads
+
+    def _search_latency(
+        self, matrix: np.ndarray
+    ) -> Optional[float]:
+        """用库内向量作为查询，测量一次检索的中位耗时（毫秒）；latency_samples 为 0 时不测"""
+        if not len(matrix) or self.latency_samples <= 0:
+            return None
+        rng = np.random.default_rng(0)
+        samples = []
+        for row in rng.integers(
+            0, len(matrix), self.latency_samples
+        ):
+            start = time.perf_counter()
+            self.store.search(
+                "", vectors=[matrix[row].tolist()], limit=5
+            )
+            samples.append(time.perf_counter() - start)
+        return float(np.median(samples)) * 1000
+
+    def _cluster(
+        self,
+        ids: np.ndarray,
+        matrix: np.ndarray,
+        payloads: dict,
+    ) -> list:
+        """新记忆逐批与全库计算相似度，返回需要合并的 id 簇"""
+        clusters = _Clusters()
+        users = np.array(
+            [payloads[int(i)].get("user_id") for i in ids],
+            dtype=object,
+        )
+        start = int(
+            np.searchsorted(ids, self.last_id, "right")
+        )
+        for lo in range(start, len(ids), self.batch_size):
+            hi = min(lo + self.batch_size, len(ids))
+            scores = matrix[lo:hi] @ matrix.T
+            # 只看与自己之前的记忆的相似度，避免同一对算两次
+            scores[
+                np.arange(hi - lo)[:, None]
+                <= np.arange(len(ids))[None, :] - lo
+            ] = -1
+            rows, cols = np.nonzero(
+                scores >= self.similarity
+            )
+            for r, c in zip(rows, cols):
+                if users[lo + r] == users[c]:
+                    clusters.union(
+                        int(ids[lo + r]), int(ids[c])
+                    )
+        return clusters.groups()
+
+    def _merge(self, group: list, payloads: dict) -> tuple:
+        """返回 (规范记忆 id, 新 payload, 要删除的 id)"""
+        group = sorted(
+            group, key=lambda i: _moment(payloads[i])
+        )
+        keep = group[-1]
+        payload = dict(payloads[keep])
+        metadata = dict(payload.get("metadata") or {})
+        tags, merged = [], 0
+        for memory_id in group:
+            other = (
+                payloads[memory_id].get("metadata") or {}
+            )
+            for tag in other.get("tags") or []:
+                if tag not in tags:
+                    tags.append(tag)
+            merged += other.get("merged", 1)
+        metadata["tags"] = tags
+        # 规范记忆本身就是簇中最新的一条，timestamp 保持不变
+        metadata["merged"] = merged
+        payload["metadata"] = metadata
+        payload["updated_at"] = max(
+            str(payloads[i].get("updated_at") or "")
+            for i in group
+        )
+        return keep, payload, group[:-1]
+
+    def _expired(
+        self, payloads: dict, deleted: set
+    ) -> list:
+        window = self.expire_days * 86400
+        # 检索记录还没覆盖完整的 expire_days 天，无法判断哪些记忆没人用
+        if (
+            self.expire_days <= 0
+            or time.time() - self.tracking_since < window
+        ):
+            return []
+        cutoff = datetime.now().astimezone() - timedelta(
+            days=self.expire_days
+        )
+        last_used = time.time() - window
+        with self._retrieved_lock:
+            retrieved = dict(self._retrieved)
+        expired = []
+        for memory_id, payload in payloads.items():
+            metadata = payload.get("metadata") or {}
+            if (
+                memory_id not in deleted
+                and not metadata.get("tags")
+                and metadata.get("merged", 1) <= 1
+                and _moment(payload) < cutoff
+                and retrieved.get(memory_id, 0) < last_used
+            ):
+                expired.append(memory_id)
+        return expired
+
+    def run(self) -> dict:
+        """整理一次，返回行数、数据库大小和检索耗时的变化"""
+        with self._run_lock:
+            return self._run()
+
+    def _run(self) -> dict:
+        db_path = self.store.db_path
+        start = time.perf_counter()
+        ids, matrix, payloads = self._load()
+        report = {
+            "rows_before": len(ids),
+            "new_rows": int(
+                np.count_nonzero(ids > self.last_id)
+            ),
+            "size_before": _db_size(db_path),
+            "search_ms_before": self._search_latency(
+                matrix
+            ),
+            "merged_clusters": 0,
+            "merged_rows": 0,
+            "expired_rows": 0,
+        }
+
+        updates, deleted = [], set()
+        if report["new_rows"]:
+            for group in self._cluster(
+                ids, matrix, payloads
+            ):
+                keep, payload, removed = self._merge(
+                    group, payloads
+                )
+                updates.append((keep, payload))
+                deleted.update(removed)
+                report["merged_clusters"] += 1
+                report["merged_rows"] += len(removed)
+        expired = self._expired(payloads, deleted)
+        deleted.update(expired)
+        report["expired_rows"] = len(expired)
+        with self._retrieved_lock:
+            for memory_id in deleted:
+                self._retrieved.pop(memory_id, None)
+
+        if updates or deleted:
+            with self.store._lock:
+                connection = self.store.connection
+                connection.executemany(
+                    f"UPDATE {self._table} SET payload = ? WHERE id = ?",
+                    [
+                        (
+                            json.dumps(payload),
+                            memory_id,
+                        )
+                        for memory_id, payload in updates
+                    ],
+                )
+                connection.executemany(
+                    f"DELETE FROM {self._table} WHERE id = ?",
+                    [(memory_id,) for memory_id in deleted],
+                )
+                connection.commit()
+                if deleted:
+                    connection.execute("VACUUM")
+                    connection.execute(
+                        f"REINDEX {self._table}"
+                    )
+                if hasattr(
+                    self.store, "_invalidate_matrix"
+                ):
+                    self.store._invalidate_matrix()
+        if len(ids):
+            self._save_state(int(ids[-1]))
+        logger.debug(
+            f"Consolidation merged {report['merged_rows']} and expired "
+            f"{report['expired_rows']} of {report['rows_before']} memories"
+        )
+
+        keep_rows = ~np.isin(ids, list(deleted))
+        report.update(
+            rows_after=int(keep_rows.sum()),
+            size_after=_db_size(db_path),
+            search_ms_after=self._search_latency(
+                matrix[keep_rows]
+            ),
+            deleted_ids=sorted(deleted),
+            updated_ids=[
+                memory_id for memory_id, _ in updates
+            ],
+            seconds=time.perf_counter() - start,
+        )
+        return report
+
+
+def format_report(report: dict) -> str:
+    search = ""
+    if report.get("search_ms_before") is not None:
+        search = (
+            f"search {report['search_ms_before']:.2f}ms -> "
+            f"{report['search_ms_after'] or 0:.2f}ms; "
+        )
+    return (
+        f"rows {report['rows_before']} -> {report['rows_after']} "
+        f"({report['new_rows']} new, {report['merged_rows']} merged into "
+        f"{report['merged_clusters']} cluster(s), {report['expired_rows']} expired); "
+        f"size {report['size_before'] / 1024:.1f} KB -> {report['size_after'] / 1024:.1f} KB; "
+        f"{search}took {report['seconds']:.2f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Merge near-duplicate memories and compact a PowerMem SQLite database"
+    )
+    parser.add_argument("db_path")
+    parser.add_argument(
+        "--storage",
+        choices=("json", "float16", "int8"),
+        default="json",
+    )
+    parser.add_argument(
+        "--similarity", type=float, default=0.95
+    )
+    parser.add_argument(
+        "--expire-days",
+        type=float,
+        default=0,
+        help="delete untagged, never-merged memories older than this that were not "
+        "retrieved in that many days; 0 disables expiry",
+    )
+    parser.add_argument(
+        "--measure-latency",
+        action="store_true",
+        help="time a few full-table searches before and after consolidating",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Compare all memories, not only those added since the last run",
+    )
+    args = parser.parse_args()
+
+    if args.storage == "json":
+        from powermem.storage.sqlite.sqlite_vector_store import (
+            SQLiteVectorStore,
+        )
+
+        store = SQLiteVectorStore(args.db_path)
+    else:
+        from custom_agents.quantized_store import (
+            QuantizedSQLiteVectorStore,
+        )
+
+        store = QuantizedSQLiteVectorStore(
+            args.db_path, mode=args.storage
+        )
+    # 与 Agent 共用状态文件（<user>_memory.db -> <user>_consolidation.json），检索记录才对得上
+    stem = os.path.splitext(args.db_path)[0]
+    if stem.endswith("_memory"):
+        stem = stem[: -len("_memory")]
+    consolidator = MemoryConsolidator(
+        store,
+        stem + "_consolidation.json",
+        similarity=args.similarity,
+        expire_days=args.expire_days,
+        latency_samples=5 if args.measure_latency else 0,
+    )
+    if args.full:
+        consolidator.last_id = 0
+    print(format_report(consolidator.run()))
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+# custom_agents/memory_registry.py
+"""
+进程级 PowerMem 客户端注册表
+
+服务端为每个客户端连接新建一个 Agent，如果每次都新建 Memory，重连时要重新打开数据库、
+重新创建嵌入和抽取客户端（Ollama 嵌入客户端初始化时还要请求一次模型列表）。
+注册表按 (user_id, 数据库路径, 嵌入/LLM 配置, 向量存储格式) 缓存 Memory 分片并引用计数：
+新会话直接拿到已经打开的分片，最后一个使用者释放后分片保留 idle_seconds 秒，
+期间没有新会话才关闭。
+
+同一组嵌入/LLM 配置只创建一次客户端：第一个分片由 Memory(config) 正常构造，
+之后其他用户的分片复制它的客户端，只新开自己的 SQLite 文件（每个用户一个 .db）。
+模板随使用这组配置的最后一个分片关闭而丢弃，不会让已关闭的 Memory 一直留在内存里。
+分片数据库默认切换为 WAL 模式并设置 busy_timeout，多个分片、记忆整理和
+import_history 等其他进程可以同时写入而不互相报 "database is locked"。
+"""
+
+import copy
+import json
+import os
+import threading
+import time
+
+from loguru import logger
+from powermem import Memory
+from powermem.storage.adapter import StorageAdapter
+from powermem.storage.sqlite.sqlite_vector_store import (
+    SQLiteVectorStore,
+)
+
+from custom_agents.http_pool import attach_client
+
+
+class MemoryShard:
+    """一个用户数据库上的 Memory 客户端，以及挂在它上面、需要在会话间共享的对象"""
+
+    def __init__(
+        self,
+        key: tuple,
+        memory: Memory,
+        db_path: str,
+        idle_seconds: float,
+        clients_key: str = "",
+    ):
+        self.key = key
+        self.memory = memory
+        # 嵌入/LLM 配置，对应 _TEMPLATES 中的模板
+        self.clients_key = clients_key
+        self.db_path = db_path
+        self.idle_seconds = idle_seconds
+        self.refs = 0
+        self.idle_since = None
+        # 记忆代数：任一会话写入后递增，所有会话的检索结果缓存随之失效
+        self.generation = 0
+        self._resources: dict = {}
+        self._tasks: dict = {}
+        self._lock = threading.Lock()
+
+    def shared(self, name: str, factory):
+        """取得（或用 factory 创建）分片内共享的对象，如 ANN 索引和记忆整理器"""
+        with self._lock:
+            if name not in self._resources:
+                self._resources[name] = factory()
+            return self._resources[name]
+
+    def get(self, name: str):
+        """已创建的共享对象，没有时返回 None"""
+        with self._lock:
+            return self._resources.get(name)
+
+    def ensure_task(self, name: str, factory):
+        """分片内同名的后台任务（如定期记忆整理）只运行一个；没有或已结束时用 factory 创建"""
+        with self._lock:
+            task = self._tasks.get(name)
+            if task is None or task.done():
+                task = self._tasks[name] = factory()
+            return task
+
+    def close(self):
+        for task in self._tasks.values():
+            if task.done():
+                continue
+            try:
+                task.get_loop().call_soon_threadsafe(
+                    task.cancel
+                )
+            except RuntimeError:
+                pass
+        self._tasks.clear()
+        for resource in self._resources.values():
+            flush = getattr(resource, "flush", None)
+            if flush is not None:
+                try:
+                    flush()
+                except Exception as e:
+                    logger.error(
+                        f"Failed to flush {type(resource).__name__}: {e}"
+                    )
+        self._resources.clear()
+        self.memory.storage.vector_store.close()
+
+
+_SHARDS: dict = {}
+# 嵌入/LLM 配置 -> 第一个用该配置构造的 Memory，后续分片复制它的客户端；
+# 使用这组配置的分片全部关闭后删除
+_TEMPLATES: dict = {}
+# 可重入：会话对象被垃圾回收时的 release_memory 可能发生在持有锁的同一线程里
+_LOCK = threading.RLock()
+_counters = {
+    "created": 0,
+    "cloned": 0,
+    "reused": 0,
+    "closed": 0,
+}
+
+
+def _freeze(value) -> str:
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def _open_store(db_path: str, vector_storage: str):
+    if vector_storage == "json":
+        return SQLiteVectorStore(db_path)
+    from custom_agents.quantized_store import (
+        QuantizedSQLiteVectorStore,
+    )
+
+    return QuantizedSQLiteVectorStore(
+        db_path, mode=vector_storage
+    )
+
+
+def _enable_wal(store, busy_timeout_ms: int):
+    with store._lock:
+        store.connection.execute("PRAGMA journal_mode=WAL")
+        store.connection.execute(
+            "PRAGMA synchronous=NORMAL"
+        )
+        store.connection.execute(
+            f"PRAGMA busy_timeout={int(busy_timeout_ms)}"
+        )
+
+
+def _clone(
+    template: Memory,
+    full_config: dict,
+    db_path: str,
+    vector_storage: str,
+) -> Memory:
+    """复用模板的嵌入、LLM 等客户端，只为新用户打开自己的向量库"""
+    memory = copy.copy(template)
+    memory.config = {
+        **template.config,
+        "vector_store": full_config["vector_store"],
+    }
+    memory.storage = type(template.storage)(
+        _open_store(db_path, vector_storage),
+        memory.embedding,
+        memory.sparse_embedder,
+    )
+    return memory
+
+
+def _clients_key(full_config: dict) -> str:
+    return _freeze(
+        {
+            name: full_config[name]
+            for name in ("embedder", "llm")
+        }
+    )
+
+
+def _build(
+    full_config: dict,
+    db_path: str,
+    vector_storage: str,
+    http_pool_config: dict,
+) -> tuple:
+    """返回 (Memory, 是否复用了已有客户端)；调用方持有 _LOCK"""
+    clients_key = _clients_key(full_config)
+    template = _TEMPLATES.get(clients_key)
+    if template is not None:
+        return (
+            _clone(
+                template,
+                full_config,
+                db_path,
+                vector_storage,
+            ),
+            True,
+        )
+
+    memory = Memory(config=full_config)
+    # 嵌入和事实抽取客户端接入共享连接池
+    if http_pool_config is not None:
+        attach_client(
+            memory.embedding, "client", http_pool_config
+        )
+        attach_client(
+            memory.llm, "client", http_pool_config
+        )
+    # 可选的紧凑向量存储：替换 PowerMem 默认的 JSON 向量库
+    if vector_storage != "json":
+        memory.storage.vector_store.close()
+        memory.storage = StorageAdapter(
+            _open_store(db_path, vector_storage),
+            memory.embedding,
+            memory.sparse_embedder,
+        )
+    _TEMPLATES[clients_key] = memory
+    return memory, False
+
+
+def acquire_memory(
+    user_id: str,
+    db_path: str,
+    full_config: dict,
+    vector_storage: str = "json",
+    http_pool_config: dict = None,
+    idle_seconds: float = 300.0,
+    wal: bool = True,
+    busy_timeout_ms: int = 5000,
+) -> MemoryShard:
+    """取得（或创建）该用户数据库的分片并增加引用计数；配置只在第一次创建时生效"""
+    key = (
+        user_id,
+        os.path.abspath(db_path),
+        _freeze(full_config["embedder"]),
+        _freeze(full_config["llm"]),
+        vector_storage,
+    )
+    with _LOCK:
+        _close_idle_locked()
+        shard = _SHARDS.get(key)
+        if shard is not None:
+            shard.refs += 1
+            shard.idle_since = None
+            _counters["reused"] += 1
+            logger.info(
+                f"Reusing PowerMem client for user '{user_id}' (refs={shard.refs})"
+            )
+            return shard
+
+        start = time.perf_counter()
+        memory, cloned = _build(
+            full_config,
+            db_path,
+            vector_storage,
+            http_pool_config,
+        )
+        if wal:
+            _enable_wal(
+                memory.storage.vector_store,
+                busy_timeout_ms,
+            )
+        shard = _SHARDS[key] = MemoryShard(
+            key,
+            memory,
+            db_path,
+            idle_seconds,
+            _clients_key(full_config),
+        )
+        shard.refs = 1
+        _counters["cloned" if cloned else "created"] += 1
+        logger.info(
+            f"Opened PowerMem client for user '{user_id}' in "
+            f"{time.perf_counter() - start:.2f}s"
+            + (" (shared embedder/LLM)" if cloned else "")
+        )
+        return shard
+
+
+def release_memory(shard: MemoryShard):
+    """会话结束时调用；引用归零的分片在 idle_seconds 后关闭（0 表示立即关闭）"""
+    with _LOCK:
+        if shard.refs <= 0:
+            return
+        shard.refs -= 1
+        if shard.refs == 0:
+            shard.idle_since = time.monotonic()
+        _close_idle_locked()
+
+
+def _close_idle_locked():
+    now = time.monotonic()
+    for key, shard in list(_SHARDS.items()):
+        if (
+            shard.refs == 0
+            and now - shard.idle_since >= shard.idle_seconds
+        ):
+            del _SHARDS[key]
+            _close_shard(shard)
+            _drop_template_locked(shard)
+
+
+def _drop_template_locked(shard: MemoryShard):
+    """没有分片再使用这组嵌入/LLM 配置时丢弃模板 Memory"""
+    clients_key = shard.clients_key
+    if not any(
+        other.clients_key == clients_key
+        for other in _SHARDS.values()
+    ):
+        _TEMPLATES.pop(clients_key, None)
+
+
+def _close_shard(shard: MemoryShard):
+    try:
+        shard.close()
+        _counters["closed"] += 1
+        logger.debug(
+            f"Closed idle PowerMem client: {shard.db_path}"
+        )
+    except Exception as e:
+        logger.error(
+            f"Failed to close PowerMem client {shard.db_path}: {e}"
+        )
+
+
+def close_idle():
+    with _LOCK:
+        _close_idle_locked()
+
+
+def close_all_memory():
+    """进程退出前关闭全部分片（刷写 ANN 索引等共享对象）"""
+    with _LOCK:
+        shards = list(_SHARDS.values())
+        _SHARDS.clear()
+        _TEMPLATES.clear()
+    for shard in shards:
+        _close_shard(shard)
+
+
+def registry_stats() -> str:
+    with _LOCK:
+        active = sum(
+            1 for shard in _SHARDS.values() if shard.refs
+        )
+        return (
+            f"open={len(_SHARDS)} active={active} "
+            f"created={_counters['created']} cloned={_counters['cloned']} "
+            f"reused={_counters['reused']} closed={_counters['closed']}"
+        )
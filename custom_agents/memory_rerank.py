@@ -0,0 +1,100 @@
+# custom_agents/memory_rerank.py
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+
+def _age_days(candidate: dict, now: datetime) -> float:
+    """记忆距今的天数，优先使用写入时记录的 metadata.timestamp"""
+    value = (candidate.get("metadata") or {}).get(
+        "timestamp"
+    ) or candidate.get("created_at")
+    if not value:
+        return 0.0
+    try:
+        moment = (
+            value
+            if isinstance(value, datetime)
+            else datetime.fromisoformat(str(value))
+        )
+    except ValueError:
+        return 0.0
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return max(0.0, (now - moment).total_seconds() / 86400)
+
+
+def rerank_memories(
+    query_vector,
+    candidates: list,
+    vectors: np.ndarray,
+    top_k: int,
+    half_life_days: float = 30.0,
+    recency_weight: float = 0.1,
+    tag_boosts: Optional[dict] = None,
+    mmr_lambda: float = 0.7,
+    dedup_threshold: float = 0.92,
+    now: Optional[datetime] = None,
+) -> list:
+    """对过量召回的候选记忆重新打分并做 MMR 多样化，返回最多 top_k 条
+
+    综合分 = 余弦相似度 + recency_weight × 时间衰减 + 标签加权；
+    再按 MMR 依次挑选，与已选记忆相似度超过 dedup_threshold 的视为重复直接跳过，
+    这样同一事实的多份拷贝不会占满 top_k。
+    vectors 的行与 candidates 一一对应。
+    """
+    if not candidates:
+        return []
+    now = now or datetime.now()
+    q = np.asarray(query_vector, dtype=np.float32)
+    q = q / (np.linalg.norm(q) or 1.0)
+    v = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(v, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    v = v / norms
+
+    similarity = v @ q
+    ages = np.array(
+        [_age_days(c, now) for c in candidates],
+        dtype=np.float32,
+    )
+    decay = np.power(0.5, ages / max(half_life_days, 1e-6))
+    boost = np.zeros(len(candidates), dtype=np.float32)
+    if tag_boosts:
+        for i, c in enumerate(candidates):
+            tags = (c.get("metadata") or {}).get(
+                "tags"
+            ) or []
+            boost[i] = sum(
+                tag_boosts.get(t, 0.0) for t in tags
+            )
+    relevance = similarity + recency_weight * decay + boost
+
+    pairwise = v @ v.T
+    selected: list = []
+    remaining = np.ones(len(candidates), dtype=bool)
+    while len(selected) < top_k and remaining.any():
+        if selected:
+            redundancy = pairwise[:, selected].max(axis=1)
+            remaining &= redundancy < dedup_threshold
+            if not remaining.any():
+                break
+            mmr = (
+                mmr_lambda * relevance
+                - (1 - mmr_lambda) * redundancy
+            )
+        else:
+            mmr = relevance
+        best = int(
+            np.argmax(np.where(remaining, mmr, -np.inf))
+        )
+        selected.append(best)
+        remaining[best] = False
+
+    results = []
+    for i in selected:
+        item = dict(candidates[i])
+        item["rerank_score"] = float(relevance[i])
+        results.append(item)
+    return results
@@ -0,0 +1,439 @@
+# custom_agents/memory_writer.py
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Callable, Optional
+
+from loguru import logger
+
+from custom_agents.log_config import hot_log
+from custom_agents.metrics import RollingStats
+
+
+@dataclass
+class PendingInteraction:
+    """一轮等待写入长期记忆的对话"""
+
+    user_input: str
+    response: str
+    timestamp: str = field(
+        default_factory=lambda: datetime.now().isoformat()
+    )
+    # 流式输出时已匹配出的标签；None 表示写入时再提取
+    tags: Optional[list] = None
+    # 所属轮次的追踪编号，写入完成后据此补记耗时
+    trace_id: Optional[int] = None
+
+
+class UnwrittenError(Exception):
+    """一批对话只写入了一部分；items 是（从失败的那条起）尚未写入的对话"""
+
+    def __init__(self, items: list):
+        super().__init__(
+            f"{len(items)} interaction(s) not written"
+        )
+        self.items = items
+
+
+class MemoryWriteQueue:
+    """单写者的后台记忆写入队列
+
+    所有对话通过有界 asyncio.Queue 交给唯一的写入任务，
+    写入任务把短时间内到达的多轮对话取成一批，在同一个工作线程调用里逐条写入，
+    避免每轮对话各开一个线程去抢占 Ollama。
+    write_batch 中途失败时抛出 UnwrittenError，只有其中尚未写入的对话算作失败。
+    队列满时丢弃最旧的一条（同步提交）或等待空位（异步提交）。
+    给出 scheduler 时，写入推迟到对话之间的空闲间隙执行，
+    等待期间新到达的对话会并入同一批。
+    已经开始写入的一批不会再交还给调用方：取消写入任务停不下工作线程，
+    交还的话这批对话会被重复写入（或存入磁盘日志、下次启动时再写一遍）。
+    """
+
+    def __init__(
+        self,
+        write_batch: Callable[[list], None],
+        maxsize: int = 32,
+        max_batch: int = 4,
+        coalesce_seconds: float = 2.0,
+        scheduler=None,
+    ):
+        self._write_batch = write_batch
+        self._scheduler = scheduler
+        self.maxsize = maxsize
+        self.max_batch = max_batch
+        self.coalesce_seconds = coalesce_seconds
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+        # 已取出、还在等空闲间隙的一批（尚未开始写入）
+        self._inflight: list = []
+        # 正在工作线程中写入的一批
+        self._writing: Optional[asyncio.Future] = None
+        self._closed = False
+
+        self.submitted = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.write_latency = RollingStats()
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def _ensure_writer(self) -> asyncio.Queue:
+        """在当前事件循环中惰性创建队列和写入任务"""
+        if self._queue is None:
+            self._queue = asyncio.Queue(
+                maxsize=self.maxsize
+            )
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(
+                self._run(), name="powermem-writer"
+            )
+        return self._queue
+
+    def submit(self, item: PendingInteraction) -> None:
+        """同步提交（供 _add_message 使用），队列满时丢弃最旧的一条"""
+        if self._closed:
+            logger.warning(
+                "Memory write queue is closed, ignoring interaction"
+            )
+            return
+        queue = self._ensure_writer()
+        if queue.full():
+            dropped = queue.get_nowait()
+            queue.task_done()
+            self.dropped += 1
+            logger.warning(
+                f"Memory write queue full ({self.maxsize}), dropped oldest "
+                f"interaction: {dropped.user_input[:30]}..."
+            )
+        queue.put_nowait(item)
+        self.submitted += 1
+        hot_log.debug(
+            f"Queued interaction for memory write (depth={queue.qsize()})"
+        )
+
+    async def put(self, item: PendingInteraction) -> None:
+        """异步提交，队列满时等待空位（背压）"""
+        queue = self._ensure_writer()
+        await queue.put(item)
+        self.submitted += 1
+
+    async def _collect_batch(
+        self, queue: asyncio.Queue
+    ) -> list:
+        """取出一条后，在合并窗口内尽量再多取几条"""
+        batch = self._inflight = [await queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.coalesce_seconds
+        while len(batch) < self.max_batch:
+            if not queue.empty():
+                batch.append(queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(
+                    await asyncio.wait_for(
+                        queue.get(), remaining
+                    )
+                )
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        queue = self._queue
+        while True:
+            batch = await self._collect_batch(queue)
+            start = time.perf_counter()
+            try:
+                async with (
+                    self._scheduler.background()
+                    if self._scheduler
+                    else nullcontext()
+                ):
+                    while (
+                        len(batch) < self.max_batch
+                        and not queue.empty()
+                    ):
+                        batch.append(queue.get_nowait())
+                    start = time.perf_counter()
+                    self._inflight = []
+                    self._writing = asyncio.ensure_future(
+                        asyncio.to_thread(
+                            self._write_batch, batch
+                        )
+                    )
+                    # 写入任务被取消时工作线程仍在写，aclose 还要等它
+                    await asyncio.shield(self._writing)
+                self.written += len(batch)
+                self.batches += 1
+            except Exception as e:
+                unwritten = (
+                    e.items
+                    if isinstance(e, UnwrittenError)
+                    else batch
+                )
+                self.written += len(batch) - len(unwritten)
+                self.failed += len(unwritten)
+                logger.error(
+                    f"Failed to write {len(unwritten)} interaction(s) to PowerMem: "
+                    f"{e.__cause__ or e}"
+                )
+            finally:
+                self.write_latency.add(
+                    time.perf_counter() - start
+                )
+                self._inflight = []
+                for _ in batch:
+                    queue.task_done()
+            hot_log.debug(
+                f"Memory writer stats: {self.stats()}"
+            )
+
+    def _drain(self) -> list:
+        """取出尚未开始写入的全部对话（等空闲间隙的一批和仍在排队的）"""
+        pending = list(self._inflight)
+        self._inflight = []
+        while (
+            self._queue is not None
+            and not self._queue.empty()
+        ):
+            pending.append(self._queue.get_nowait())
+            self._queue.task_done()
+        return pending
+
+    def abandon(self) -> list:
+        """不再写入：停止写入任务并返回尚未开始写入的对话（会话对象被回收时调用，可在任意线程）；
+        正在工作线程中写入的一批照常写完"""
+        self._closed = True
+        writer, self._writer = self._writer, None
+        writing = self._writing
+        if writer is not None and not writer.done():
+            try:
+                loop = writer.get_loop()
+                loop.call_soon_threadsafe(writer.cancel)
+                if writing is not None:
+                    loop.call_soon_threadsafe(
+                        writing.add_done_callback,
+                        _log_write_failure,
+                    )
+            except RuntimeError:
+                # 事件循环已经关闭，写入任务不会再运行
+                pass
+        return self._drain()
+
+    async def _finish_writing(self, deadline: float):
+        """等工作线程写完正在写入的一批；超过期限时让它在后台写完，不再交还这批对话"""
+        writing = self._writing
+        if writing is None or writing.done():
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(writing),
+                timeout=max(deadline - loop.time(), 0),
+            )
+        except asyncio.TimeoutError:
+            logger.warning(
+                "A memory write batch is still running past the flush deadline; "
+                "it keeps writing in the background"
+            )
+            writing.add_done_callback(_log_write_failure)
+        except Exception:
+            # 写入任务已经记录了失败
+            pass
+
+    async def aclose(self, timeout: float = 10.0) -> list:
+        """停止写入任务，在期限内尽量写完剩余对话，返回仍未写入的部分
+
+        服务器的事件循环可能已经随 KeyboardInterrupt 关闭，
+        这时写入任务已经失效，剩余对话由当前事件循环直接写入。
+        """
+        self._closed = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        writer = self._writer
+        if (
+            writer is not None
+            and not writer.done()
+            and writer.get_loop() is loop
+        ):
+            try:
+                await asyncio.wait_for(
+                    self._queue.join(), timeout=timeout
+                )
+            except asyncio.TimeoutError:
+                logger.warning(
+                    f"Memory writer did not finish within {timeout:.1f}s"
+                )
+            writer.cancel()
+            # 先取出尚未开始写入的对话，写入任务处理取消时会丢掉手上的一批
+            pending = self._drain()
+            await self._finish_writing(deadline)
+        else:
+            pending = self._drain()
+        self._writer = None
+
+        while pending:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            batch = pending[: self.max_batch]
+            try:
+                await asyncio.wait_for(
+                    asyncio.to_thread(
+                        self._write_batch, batch
+                    ),
+                    timeout=remaining,
+                )
+            except asyncio.TimeoutError:
+                break
+            except Exception as e:
+                if isinstance(e, UnwrittenError):
+                    # 已写入的那几条不再交还，免得存进磁盘日志后重复写入
+                    self.written += len(batch) - len(
+                        e.items
+                    )
+                    pending = (
+                        e.items + pending[len(batch) :]
+                    )
+                logger.error(
+                    f"Failed to flush {len(batch)} interaction(s) on shutdown: "
+                    f"{e.__cause__ or e}"
+                )
+                break
+            self.written += len(batch)
+            pending = pending[len(batch) :]
+        return pending
+
+    def stats(self) -> str:
+        return (
+            f"depth={self.depth} submitted={self.submitted} "
+            f"written={self.written} batches={self.batches} "
+            f"dropped={self.dropped} failed={self.failed} "
+            f"latency[{self.write_latency.format()}]"
+        )
+
+
+def _log_write_failure(future):
+    if not future.cancelled() and future.exception():
+        logger.error(
+            f"Background memory write failed: {future.exception()}"
+        )
+
+
+class MemoryJournal:
+    """未能在关闭前写入的对话的磁盘日志（JSON Lines），下次启动时重放
+
+    重放的对话写入成功后才从日志中删除，重放途中再次崩溃也不会丢失；
+    同一用户的会话共用一个日志对象，日志只交给其中一个会话重放一次。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._claimed = False
+        self._replaying: list = []
+
+    @staticmethod
+    def _line(item: PendingInteraction) -> str:
+        return json.dumps(asdict(item), ensure_ascii=False)
+
+    def _lines(self) -> list:
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding="utf-8") as f:
+            return [
+                line.strip() for line in f if line.strip()
+            ]
+
+    def spill(self, items: list) -> None:
+        """追加到日志；还在日志里等待重放的对话不会重复写入"""
+        if not items:
+            return
+        with self._lock:
+            existing = set(self._lines())
+            lines = [
+                line
+                for line in map(self._line, items)
+                if line not in existing
+            ]
+            with open(
+                self.path, "a", encoding="utf-8"
+            ) as f:
+                for line in lines:
+                    f.write(line + "\n")
+        logger.info(
+            f"Spilled {len(items)} unwritten interaction(s) to {self.path}"
+        )
+
+    def load(self) -> list:
+        items = []
+        for line in self._lines():
+            try:
+                items.append(
+                    PendingInteraction(**json.loads(line))
+                )
+            except (ValueError, TypeError) as e:
+                logger.warning(
+                    f"Skipping corrupt journal line in {self.path}: {e}"
+                )
+        return items
+
+    def claim(self) -> list:
+        """取出日志中等待重放的对话；只有第一次调用返回，之后返回空列表"""
+        with self._lock:
+            if self._claimed:
+                return []
+            self._claimed = True
+            self._replaying = self.load()
+            return list(self._replaying)
+
+    def written(self, items: list) -> None:
+        """重放的对话写入成功后调用，从日志中删除它们"""
+        if not self._replaying:
+            return
+        with self._lock:
+            done = {id(item) for item in items}
+            written = [
+                item
+                for item in self._replaying
+                if id(item) in done
+            ]
+            if not written:
+                return
+            self._replaying = [
+                item
+                for item in self._replaying
+                if id(item) not in done
+            ]
+            remove = Counter(map(self._line, written))
+            kept = []
+            for line in self._lines():
+                if remove[line] > 0:
+                    remove[line] -= 1
+                    continue
+                kept.append(line)
+            self._rewrite(kept)
+
+    def _rewrite(self, lines: list) -> None:
+        if not lines:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        temp = self.path + ".tmp"
+        with open(temp, "w", encoding="utf-8") as f:
+            for line in lines:
+                f.write(line + "\n")
+        os.replace(temp, self.path)
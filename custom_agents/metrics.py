@@ -0,0 +1,52 @@
+# custom_agents/metrics.py
+import threading
+from collections import deque
+
+
+class RollingStats:
+    """保留最近 N 个样本的滑动窗口统计（用于延迟、耗时等指标）"""
+
+    def __init__(self, window: int = 256):
+        self._samples: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value: float) -> None:
+        with self._lock:
+            self._samples.append(value)
+            self.count += 1
+            self.total += value
+
+    def percentile(self, p: float) -> float:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return 0.0
+        index = min(
+            len(samples) - 1,
+            max(0, round(p / 100 * (len(samples) - 1))),
+        )
+        return samples[index]
+
+    @property
+    def mean(self) -> float:
+        return (
+            self.total / self.count if self.count else 0.0
+        )
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+    def format(self, unit: str = "s") -> str:
+        s = self.summary()
+        return (
+            f"n={s['count']} p50={s['p50']:.3f}{unit} "
+            f"p95={s['p95']:.3f}{unit} p99={s['p99']:.3f}{unit}"
+        )
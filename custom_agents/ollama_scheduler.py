@@ -0,0 +1,162 @@
+# custom_agents/ollama_scheduler.py
+"""
+对话与后台记忆任务之间的 Ollama 调度
+
+本地只有一块 GPU（或只用 CPU）时 Ollama 会串行处理请求，后台的记忆抽取一旦与对话撞上，
+下一次回复就要多等几秒。调度器把记忆写入等后台任务视为低优先级：
+对话进行中先推迟，在两轮对话之间的空闲间隙再执行，并限制同时执行的后台任务数。
+推迟太久（max_defer_seconds）后不再等待，避免连续对话时记忆一直写不进去。
+
+回收的前台延迟按实测估算：分别统计与后台任务重叠、未重叠的对话轮次的首句耗时，
+两者中位数之差乘以因推迟而避开重叠的轮次数。
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from loguru import logger
+
+from custom_agents.metrics import RollingStats
+
+
+class OllamaScheduler:
+    def __init__(
+        self,
+        idle_seconds: float = 1.0,
+        max_defer_seconds: float = 30.0,
+        max_background: int = 1,
+    ):
+        self.idle_seconds = idle_seconds
+        self.max_defer_seconds = max_defer_seconds
+        self.max_background = max_background
+        self._foreground = 0
+        self._background = 0
+        self._last_foreground_end = 0.0
+        self._idle: asyncio.Event = None
+        self._slots: asyncio.Semaphore = None
+        self._deferred_waiting = 0
+        # 本轮开始时是否有后台任务因推迟而在等待 / 是否与后台任务重叠
+        self._turn_avoided = False
+        self._turn_contended = False
+
+        self.deferred = 0
+        self.forced = 0
+        self.avoided_turns = 0
+        self.defer_delay = RollingStats()
+        self.clean_latency = RollingStats()
+        self.contended_latency = RollingStats()
+
+    def _ensure_loop_state(self):
+        """在当前事件循环中惰性创建同步原语"""
+        if self._idle is None:
+            self._idle = asyncio.Event()
+            if not self._foreground:
+                self._idle.set()
+            self._slots = asyncio.Semaphore(
+                self.max_background
+            )
+
+    # ---- 前台（对话） ----
+
+    def begin_foreground(self):
+        self._ensure_loop_state()
+        self._foreground += 1
+        self._idle.clear()
+        self._turn_contended = self._background > 0
+        self._turn_avoided = self._deferred_waiting > 0
+
+    def end_foreground(self, latency: float = None):
+        """一轮对话结束；latency（首句耗时）用于估算回收的延迟"""
+        self._foreground = max(0, self._foreground - 1)
+        self._last_foreground_end = time.monotonic()
+        if latency is not None:
+            if self._turn_contended:
+                self.contended_latency.add(latency)
+            else:
+                self.clean_latency.add(latency)
+                if self._turn_avoided:
+                    self.avoided_turns += 1
+        if not self._foreground:
+            self._idle.set()
+
+    # ---- 后台（记忆写入等） ----
+
+    async def _wait_for_gap(self, deadline: float) -> bool:
+        """等到没有对话进行且已空闲 idle_seconds；超过期限返回 False"""
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if not self._foreground:
+                gap = (
+                    self._last_foreground_end
+                    + self.idle_seconds
+                    - time.monotonic()
+                )
+                if gap <= 0:
+                    return True
+                await asyncio.sleep(min(gap, remaining))
+                continue
+            try:
+                await asyncio.wait_for(
+                    self._idle.wait(), timeout=remaining
+                )
+            except asyncio.TimeoutError:
+                return False
+
+    @asynccontextmanager
+    async def background(self):
+        """后台任务在空闲间隙内、受并发上限约束地执行"""
+        self._ensure_loop_state()
+        start = time.monotonic()
+        busy = self._foreground or (
+            start - self._last_foreground_end
+            < self.idle_seconds
+        )
+        if busy:
+            self.deferred += 1
+            self._deferred_waiting += 1
+            try:
+                if not await self._wait_for_gap(
+                    start + self.max_defer_seconds
+                ):
+                    self.forced += 1
+                    logger.debug(
+                        f"Background task deferred {self.max_defer_seconds:.0f}s, running anyway"
+                    )
+            finally:
+                self._deferred_waiting -= 1
+        async with self._slots:
+            self.defer_delay.add(time.monotonic() - start)
+            self._background += 1
+            if self._foreground:
+                self._turn_contended = True
+            try:
+                yield
+            finally:
+                self._background -= 1
+
+    # ---- 统计 ----
+
+    def reclaimed_seconds(self) -> float:
+        """估算因推迟后台任务而节省的前台首句时间"""
+        if not (
+            self.clean_latency.count
+            and self.contended_latency.count
+        ):
+            return 0.0
+        penalty = self.contended_latency.percentile(
+            50
+        ) - self.clean_latency.percentile(50)
+        return max(0.0, penalty) * self.avoided_turns
+
+    def stats(self) -> str:
+        return (
+            f"deferred={self.deferred} forced={self.forced} "
+            f"avoided_turns={self.avoided_turns} "
+            f"reclaimed~{self.reclaimed_seconds():.2f}s "
+            f"defer_delay[{self.defer_delay.format()}] "
+            f"first_sentence clean[{self.clean_latency.format()}] "
+            f"contended[{self.contended_latency.format()}]"
+        )
@@ -0,0 +1,106 @@
+# custom_agents/ollama_stats.py
+import functools
+from typing import Any, Callable, Optional
+
+from loguru import logger
+
+from custom_agents.metrics import RollingStats
+
+# LLM 封装类里常见的 Ollama 客户端属性名
+_CLIENT_ATTRS = ("client", "_client", "async_client")
+
+
+def _field(obj: Any, name: str) -> Any:
+    """同时兼容 ollama 客户端返回的 pydantic 对象和普通字典"""
+    value = getattr(obj, name, None)
+    if value is None and isinstance(obj, dict):
+        value = obj.get(name)
+    return value
+
+
+class PromptEvalStats:
+    """记录 Ollama 每轮的 prompt_eval_count / prompt_eval_duration
+
+    Ollama 复用 KV 缓存时，prompt_eval_count 只包含缓存之后需要重新计算的 token，
+    因此它与本轮 prompt 总 token 数的差值就是被复用的前缀长度。
+    """
+
+    def __init__(self):
+        self.prompt_eval_count = RollingStats()
+        self.prompt_eval_seconds = RollingStats()
+        self.last: Optional[dict] = None
+
+    def record(self, response: Any):
+        count = _field(response, "prompt_eval_count")
+        duration = _field(response, "prompt_eval_duration")
+        if count is None:
+            return
+        seconds = (duration or 0) / 1e9
+        self.prompt_eval_count.add(count)
+        self.prompt_eval_seconds.add(seconds)
+        self.last = {
+            "prompt_eval_count": count,
+            "prompt_eval_seconds": seconds,
+            "eval_count": _field(response, "eval_count"),
+            "load_seconds": (
+                _field(response, "load_duration") or 0
+            )
+            / 1e9,
+        }
+
+    def take_last(self) -> Optional[dict]:
+        last, self.last = self.last, None
+        return last
+
+
+def _wrap_stream(stream, on_final: Callable):
+    async def wrapper():
+        async for chunk in stream:
+            if _field(chunk, "done"):
+                on_final(chunk)
+            yield chunk
+
+    return wrapper()
+
+
+def instrument_llm(
+    llm: Any, stats: PromptEvalStats
+) -> bool:
+    """给 LLM 封装里的 ollama.AsyncClient.chat 打补丁，记录每次调用的 prompt 评估统计
+
+    找不到 Ollama 原生客户端（例如 OpenAI 兼容接口）时返回 False，不做任何修改。
+    """
+    for attr in _CLIENT_ATTRS:
+        client = getattr(llm, attr, None)
+        chat = getattr(client, "chat", None)
+        if chat is None or not callable(chat):
+            continue
+        if getattr(
+            chat, "_prompt_eval_instrumented", False
+        ):
+            return True
+        if (
+            type(client).__module__.split(".")[0]
+            != "ollama"
+        ):
+            continue
+
+        @functools.wraps(chat)
+        async def instrumented_chat(*args, **kwargs):
+            response = await chat(*args, **kwargs)
+            if kwargs.get("stream"):
+                return _wrap_stream(response, stats.record)
+            stats.record(response)
+            return response
+
+        instrumented_chat._prompt_eval_instrumented = True
+        setattr(client, "chat", instrumented_chat)
+        logger.debug(
+            f"Instrumented {type(llm).__name__}.{attr}.chat for prompt eval stats"
+        )
+        return True
+    logger.debug(
+        f"No native Ollama client found on {type(llm).__name__}, "
+        "prompt eval stats unavailable"
+    )
+    return False
@@ -1,11 +1,74 @@
 # custom_agents/powermem_agent.py
 import asyncio
-from datetime import datetime
+import os
+import time
+import weakref
+from contextlib import nullcontext
 from typing import AsyncIterator, Union, Dict, Any
 
 from loguru import logger  # 导入 loguru
 
-from powermem import Memory, auto_config
+from powermem import auto_config
+
+from custom_agents.ann_index import IVFIndex
+from custom_agents.context_builder import ContextBuilder
+from custom_agents.http_pool import (
+    BACKGROUND,
+    all_pools,
+    attach_llm,
+    request_priority,
+)
+from custom_agents.image_cache import ImagePreprocessor
+from custom_agents.lexical_index import (
+    LexicalIndex,
+    reciprocal_rank_fusion,
+)
+from custom_agents.log_config import hot_log
+from custom_agents.memory_cache import (
+    TTLCache,
+    normalize_query,
+    text_similarity,
+)
+from custom_agents.memory_consolidation import (
+    MemoryConsolidator,
+    format_report,
+)
+from custom_agents.memory_registry import (
+    acquire_memory,
+    close_all_memory,
+    registry_stats,
+    release_memory,
+)
+from custom_agents.memory_rerank import rerank_memories
+from custom_agents.memory_writer import (
+    MemoryJournal,
+    MemoryWriteQueue,
+    PendingInteraction,
+    UnwrittenError,
+)
+from custom_agents.metrics import RollingStats
+from custom_agents.ollama_scheduler import (
+    OllamaScheduler,
+)
+from custom_agents.ollama_stats import (
+    PromptEvalStats,
+    instrument_llm,
+)
+from custom_agents.tag_engine import TagEngine
+from custom_agents.tracing import (
+    Tracer,
+    current_trace,
+    mark,
+    mark_first_item,
+    span,
+)
+from custom_agents.tts_cache import tts_cache_stats
+from custom_agents.vector_rows import (
+    fetch_memories,
+    fetch_vectors,
+)
+from custom_agents.warmup import startup_phase
+from custom_agents.write_gate import WriteGate
 
 # 导入父类（需要确保 Python 路径正确）
 from open_llm_vtuber.agent.agents.basic_memory_agent import (
@@ -20,6 +83,100 @@ from open_llm_vtuber.agent.output_types import (
     DisplayText,
 )
 
+# memory_injection 为 "message" 时放在回忆前面：这条消息以 user 角色发送，需说明它不是用户说的话
+_RECALL_NOTE = (
+    "（系统提示：以下是你自己关于用户的回忆，不是用户说的话。"
+    "请自然地参考，不要复述这段提示。下一条消息才是用户本轮说的话。）\n"
+)
+
+# 当前进程中存活的 PowerMemAgent，供 main.py 在退出时统一刷写记忆
+_LIVE_AGENTS = weakref.WeakSet()
+
+
+async def aclose_all():
+    """关闭所有存活的 PowerMemAgent，刷写尚未写入的记忆"""
+    agents = list(_LIVE_AGENTS)
+    if agents:
+        await asyncio.gather(
+            *(agent.aclose() for agent in agents)
+        )
+    close_all_memory()
+
+
+def _weak_method(method):
+    """包装成只持有 Agent 弱引用的可调用对象，后台任务不会让已丢弃的会话一直存活"""
+    ref = weakref.WeakMethod(method)
+
+    def call(*args, **kwargs):
+        bound = ref()
+        if bound is None:
+            raise RuntimeError(
+                "PowerMemAgent has been discarded"
+            )
+        return bound(*args, **kwargs)
+
+    return call
+
+
+def _discard_session(write_queue, journal, shard):
+    """会话结束（aclose）或会话对象未经 aclose 被回收时调用：
+    未写入的对话存入磁盘日志，归还分片"""
+    unwritten = write_queue.abandon()
+    if unwritten:
+        journal.spill(unwritten)
+    release_memory(shard)
+
+
+async def _consolidate(
+    shard, consolidator, scheduler
+) -> dict:
+    """在对话间隙整理一次分片的记忆，并同步分片共享的索引"""
+    async with (
+        scheduler.background()
+        if scheduler
+        else nullcontext()
+    ):
+        report = await asyncio.to_thread(consolidator.run)
+    deleted = report.get("deleted_ids", [])
+    ann_index = shard.get("ann_index")
+    if ann_index is not None and deleted:
+        ann_index.remove(deleted)
+    lexical_index = shard.get("lexical_index")
+    if lexical_index is not None:
+        lexical_index.remove(deleted)
+    if deleted or report.get("updated_ids"):
+        # 递增记忆代数，所有会话的检索结果缓存随之失效
+        shard.generation += 1
+    logger.info(
+        f"Memory consolidation: {format_report(report)}"
+    )
+    return report
+
+
+async def _consolidation_loop(
+    shard,
+    consolidator,
+    scheduler,
+    interval: float,
+    min_new: int,
+):
+    """分片的定期整理任务：每个分片一个，不引用任何会话"""
+    while True:
+        await asyncio.sleep(interval)
+        pending = await asyncio.to_thread(
+            consolidator.pending
+        )
+        if pending < min_new:
+            continue
+        try:
+            await _consolidate(
+                shard, consolidator, scheduler
+            )
+        except Exception as e:
+            logger.error(
+                f"Memory consolidation failed: {e}"
+            )
+
 
 class PowerMemAgent(BasicMemoryAgent):
     """继承 BasicMemoryAgent，增加 PowerMem 长期记忆功能"""
@@ -44,6 +201,32 @@ class PowerMemAgent(BasicMemoryAgent):
         memory_top_k: int = 3,
         memory_threshold: float = 0.6,
         powermem_embed_config: dict = None,
+        powermem_llm_config: dict = None,
+        memory_cache_size: int = 256,
+        memory_cache_ttl: float = 600.0,
+        memory_write_queue_size: int = 32,
+        memory_write_batch_size: int = 4,
+        memory_write_coalesce_seconds: float = 2.0,
+        memory_flush_timeout: float = 10.0,
+        memory_prefetch_similarity: float = 0.8,
+        memory_retrieval_timeout_ms: int = 0,
+        memory_search_mode: str = "exact",
+        memory_ann_nprobe: int = 8,
+        memory_vector_storage: str = "json",
+        memory_rerank_config: dict = None,
+        context_token_budget: int = 0,
+        memory_injection: str = "system",
+        memory_tag_keywords: dict = None,
+        trace_summary_every: int = 20,
+        ollama_http_config: dict = None,
+        memory_scheduler_config: dict = None,
+        memory_consolidation_config: dict = None,
+        memory_registry_config: dict = None,
+        memory_hybrid_config: dict = None,
+        memory_write_gate_config: dict = None,
+        tts_cache_config: dict = None,
+        streaming_asr_config: dict = None,
+        image_config: dict = None,
     ):
         super().__init__(
             llm=llm,
@@ -74,16 +257,217 @@ class PowerMemAgent(BasicMemoryAgent):
                 f"Embedding config: {powermem_embed_config}"
             )
 
-        # 初始化 PowerMem
+        self.memory_top_k = memory_top_k
+        self.memory_threshold = memory_threshold
+        self._last_user_input = None
+
+        # 两级检索缓存：归一化查询 -> 向量；(查询, top_k, 记忆代数) -> 检索结果
+        # 每次写入新记忆都会递增代数，使旧的结果缓存自然失效
+        self._embedding_cache = TTLCache(
+            maxsize=memory_cache_size, ttl=memory_cache_ttl
+        )
+        self._result_cache = TTLCache(
+            maxsize=memory_cache_size, ttl=memory_cache_ttl
+        )
+        self._avg_search_cost = 0.0
+        self._cache_saved_seconds = 0.0
+
+        # 后台记忆任务调度：对话进行中推迟写入，在两轮之间的空闲间隙执行；
+        # 调度器随分片在同一用户的会话间共享，任一会话的对话都会让后台任务让路
+        scheduler_config = dict(
+            memory_scheduler_config or {}
+        )
+        self._scheduler_config = (
+            scheduler_config
+            if scheduler_config.pop("enabled", True)
+            else None
+        )
+        self._scheduler = None
+
+        # 定期记忆整理：合并近似重复、清理过期记忆并压缩数据库
+        consolidation_config = dict(
+            memory_consolidation_config or {}
+        )
+        self._consolidation_enabled = (
+            consolidation_config.pop("enabled", False)
+        )
+        self.memory_consolidation_interval = (
+            consolidation_config.pop("interval_minutes", 60)
+            * 60
+        )
+        self.memory_consolidation_min_new = (
+            consolidation_config.pop("min_new_memories", 20)
+        )
+        self._consolidation_options = consolidation_config
+        self._consolidator = None
+        self.memory_flush_timeout = memory_flush_timeout
+        self._closed = False
+
+        # 记忆预取：ASR 部分结果或输入框文本可提前触发检索；
+        # 检索超过期限时本轮不等待，结果留到下一轮注入
+        self.memory_prefetch_similarity = (
+            memory_prefetch_similarity
+        )
+        self.memory_retrieval_timeout = (
+            memory_retrieval_timeout_ms / 1000
+        )
+        self._prefetch_text = None
+        self._prefetch_task = None
+        self._prefetch_next_text = None
+        self._late_memory_task = None
+        self.prefetch_hits = 0
+        self.prefetch_misses = 0
+        self.retrieval_timeouts = 0
+
+        # 检索方式："exact" 使用 PowerMem 自带的 SQLite 全表扫描，
+        # "ann" 使用 .db 旁边内存映射的 IVF 近似索引
+        if memory_search_mode not in ("exact", "ann"):
+            raise ValueError(
+                f"Unknown memory_search_mode: {memory_search_mode}"
+            )
+        self.memory_search_mode = memory_search_mode
+        self.memory_ann_nprobe = memory_ann_nprobe
+        self._ann_index = None
+        # 向量存储格式："json"（PowerMem 默认）、"float16" 或 "int8"
+        self.memory_vector_storage = memory_vector_storage
+
+        # 检索后处理：过量召回候选，按相似度 + 时间衰减 + 标签加权重排，
+        # 再用 MMR 去掉同一事实的重复拷贝
+        rerank_config = dict(memory_rerank_config or {})
+        self.memory_rerank = rerank_config.pop(
+            "enabled", bool(memory_rerank_config)
+        )
+        self.memory_candidate_factor = rerank_config.pop(
+            "candidate_factor", 4
+        )
+        self._rerank_options = rerank_config
+
+        # 混合检索：先查记忆库内的 FTS5 关键词索引，再与向量检索结果按 RRF 融合；
+        # 关键词命中足够强时直接返回，省掉嵌入请求和向量检索
+        hybrid_config = dict(memory_hybrid_config or {})
+        self.memory_hybrid = hybrid_config.pop(
+            "enabled", False
+        )
+        self.memory_rrf_k = hybrid_config.pop("rrf_k", 60)
+        self.memory_lexical_candidates = hybrid_config.pop(
+            "candidates", 20
+        )
+        self.memory_lexical_min_coverage = (
+            hybrid_config.pop("min_coverage", 0.3)
+        )
+        self.memory_skip_vector_coverage = (
+            hybrid_config.pop("skip_vector_coverage", 0.6)
+        )
+        self.memory_skip_vector_min_terms = (
+            hybrid_config.pop("skip_vector_min_terms", 2)
+        )
+        self._lexical_index = None
+        self.lexical_only_searches = 0
+        self.hybrid_searches = 0
+
+        # 写入预筛：寒暄、重复和与最近记忆几乎相同的对话不交给 LLM 做事实抽取
+        write_gate_config = dict(
+            memory_write_gate_config or {}
+        )
+        self._write_gate_enabled = write_gate_config.pop(
+            "enabled", False
+        )
+        self._write_gate_options = write_gate_config
+        self._write_gate = None
+
+        # TTS 音频缓存由 main.py 在创建引擎前装上；这里只决定是否每产出一句就预取合成，
+        # 预取用的是本会话的 TTS 引擎（会话上下文创建后由 attach_tts_engine 交给 Agent）
+        tts_cache_config = dict(tts_cache_config or {})
+        self._tts_prefetch = tts_cache_config.get(
+            "enabled", False
+        ) and tts_cache_config.get("prefetch", True)
+        self._tts_engine = None
+        # streaming_asr_config 由 main.py 读取：ASR 部分结果通过 self.prefetch 提前检索记忆
+
+        # 图片预处理：缩小、重新编码并按内容哈希缓存，历史中只保留文字占位
+        image_config = dict(image_config or {})
+        self._images = (
+            ImagePreprocessor(**image_config)
+            if image_config.pop("enabled", False)
+            else None
+        )
+        self._turn_images = 0
+        self._turn_processed: dict = {}
+        self._image_prompt_eval = RollingStats()
+
+        # 上下文 token 预算（0 表示不限制，沿用完整历史）
+        self._context_builder = (
+            ContextBuilder(context_token_budget)
+            if context_token_budget > 0
+            else None
+        )
+
+        # 记忆注入位置："system" 拼接到系统提示词末尾；
+        # "message" 保持系统提示词逐字节不变，把记忆作为单独一条消息放在本轮输入之前，
+        # 这样人设提示词和历史构成的前缀每轮相同，Ollama 可以复用 KV 缓存
+        if memory_injection not in ("system", "message"):
+            raise ValueError(
+                f"Unknown memory_injection: {memory_injection}"
+            )
+        self.memory_injection = memory_injection
+        self._turn_memory = ""
+
+        # 共享 keep-alive 连接池：对话、嵌入和 PowerMem 抽取按 base URL 共用连接，
+        # 限制并发并让对话请求优先于后台记忆写入（须在 instrument_llm 之前替换客户端）
+        http_config = dict(ollama_http_config or {})
+        self._http_pool_config = (
+            http_config
+            if http_config.pop("enabled", False)
+            else None
+        )
+        if self._http_pool_config is not None:
+            attach_llm(self._llm, self._http_pool_config)
+        self._prompt_eval = PromptEvalStats()
+        instrument_llm(self._llm, self._prompt_eval)
+
+        # 标签规则（标签 -> 关键词列表）在初始化时编译一次；
+        # 回复在流式输出时就边生成边匹配，写入记忆时标签已经就绪
+        self._tag_engine = TagEngine(memory_tag_keywords)
+        self._tag_scanner = None
+
+        # 每轮耗时追踪：检索、prompt 组装、首 token、首句输出、记忆写入完成
+        self._tracer = Tracer(trace_summary_every)
+        mark_first_item(
+            self._llm, "chat_completion", "first_token"
+        )
+
+        # 初始化 PowerMem（同一用户的会话共用注册表中的 Memory 客户端）
+        self._registry_options = dict(
+            memory_registry_config or {}
+        )
         self._init_powermem(
             powermem_user_id,
             powermem_data_dir,
             embed_config=powermem_embed_config,
+            llm_config=powermem_llm_config,
         )
 
-        self.memory_top_k = memory_top_k
-        self.memory_threshold = memory_threshold
-        self._last_user_input = None
+        # 单写者后台队列：合并多轮对话后批量写入 PowerMem（写入任务只持有本会话的弱引用）
+        self._write_queue = MemoryWriteQueue(
+            _weak_method(self._store_interactions),
+            maxsize=memory_write_queue_size,
+            max_batch=memory_write_batch_size,
+            coalesce_seconds=memory_write_coalesce_seconds,
+            scheduler=self._scheduler,
+        )
+        # aclose 时调用；会话被丢弃而没有 aclose 时随垃圾回收调用
+        self._discard.detach()
+        self._discard = weakref.finalize(
+            self,
+            _discard_session,
+            self._write_queue,
+            self._journal,
+            self._shard,
+        )
+        # 重放上次关闭时未来得及写入的对话
+        self._replay_journal()
+        startup_phase("powermem_ready")
+        _LIVE_AGENTS.add(self)
         # 删除实例属性 chat，确保后续调用使用子类的方法
         if hasattr(self, "chat"):
             delattr(self, "chat")
@@ -91,16 +475,16 @@ class PowerMemAgent(BasicMemoryAgent):
                 "Deleted instance attribute 'chat', now using subclass method"
             )
         logger.info("PowerMemAgent initialization complete")
+        startup_phase("agent_ready")
 
     def _init_powermem(
         self,
         user_id: str,
         data_dir: str,
         embed_config: dict = None,
+        llm_config: dict = None,
     ):
         """配置并初始化 PowerMem 实例（遵循官方文档，使用 ollama provider）"""
-        import os
-
         os.makedirs(data_dir, exist_ok=True)
         db_path = os.path.join(
             data_dir, f"{user_id}_memory.db"
@@ -137,12 +521,21 @@ class PowerMemAgent(BasicMemoryAgent):
         }
 
         # 3. LLM 配置 - 保持使用 openai 兼容模式（已验证可行）
+        if llm_config is None:
+            llm_config = {}
         llm_config = {
             "provider": "openai",
             "config": {
-                "api_key": "ollama",
-                "openai_base_url": "http://localhost:11434/v1",
-                "model": "goekdenizguelmez/JOSIEFIED-Qwen2.5:7b",
+                "api_key": llm_config.get(
+                    "api_key", "ollama"
+                ),
+                "openai_base_url": llm_config.get(
+                    "base_url", "http://localhost:11434/v1"
+                ),
+                "model": llm_config.get(
+                    "model",
+                    "goekdenizguelmez/JOSIEFIED-Qwen2.5:7b",
+                ),
                 "temperature": 0.7,
                 "max_tokens": 1000,
             },
@@ -152,10 +545,30 @@ class PowerMemAgent(BasicMemoryAgent):
             "vector_store": vector_store_config,
             "embedder": embedder_config,
             "llm": llm_config,
+            # PowerMem 审计日志默认写到工作目录下的 audit.log，放到数据目录里
+            "audit": {
+                "log_file": os.path.join(
+                    data_dir, "audit.log"
+                )
+            },
         }
 
+        chat_model = getattr(self._llm, "model", None)
+        if chat_model == llm_config["config"]["model"]:
+            logger.info(
+                "Memory extraction uses the chat model; set powermem_llm_config.model "
+                "to a smaller model to keep background extraction cheaper"
+            )
+
         try:
-            self.memory = Memory(config=full_config)
+            self._shard = acquire_memory(
+                user_id,
+                db_path,
+                full_config,
+                vector_storage=self.memory_vector_storage,
+                http_pool_config=self._http_pool_config,
+                **self._registry_options,
+            )
             self.user_id = user_id
             logger.info(
                 "PowerMem client successfully created with SQLite backend"
@@ -166,6 +579,161 @@ class PowerMemAgent(BasicMemoryAgent):
                 f"Failed to initialize PowerMem client: {e}"
             )
             raise
+        # 初始化未完成就被丢弃时也归还分片（写入队列创建后换成 _discard_session）
+        self._discard = weakref.finalize(
+            self, release_memory, self._shard
+        )
+        if self._scheduler_config is not None:
+            self._scheduler = self._shard.shared(
+                "scheduler",
+                lambda: OllamaScheduler(
+                    **self._scheduler_config
+                ),
+            )
+        if self.memory_vector_storage != "json":
+            logger.info(
+                f"Using {self.memory_vector_storage} vector storage"
+            )
+
+        # 4. 可选的 ANN 索引：启动时只核对 id，需要重建时推迟到第一次检索；
+        # 索引随分片在同一用户的会话间共享
+        if self.memory_search_mode == "ann":
+            self._ann_index = self._shard.shared(
+                "ann_index", self._open_ann_index
+            )
+
+        # 5. 可选的关键词索引：与记忆表存在同一个 .db 中，打开时补齐其他进程写入的行
+        if self.memory_hybrid:
+            self._lexical_index = self._shard.shared(
+                "lexical_index", self._open_lexical_index
+            )
+
+        # 6. 写入预筛（每个会话一个，计数按会话统计）
+        if self._write_gate_enabled:
+            self._write_gate = WriteGate(
+                self._vector_store,
+                lambda text: self.memory.embedding.embed(
+                    text, memory_action="add"
+                ),
+                **self._write_gate_options,
+            )
+
+        # 7. 记忆整理的增量状态与数据库放在一起
+        if self._consolidation_enabled:
+            self._consolidator = self._shard.shared(
+                "consolidator",
+                lambda: MemoryConsolidator(
+                    self._vector_store,
+                    os.path.join(
+                        data_dir,
+                        f"{user_id}_consolidation.json",
+                    ),
+                    **self._consolidation_options,
+                ),
+            )
+
+        # 8. 未来得及写入的对话的磁盘日志（写入队列创建后重放）；
+        # 日志随分片共享，同一用户的会话只重放一次
+        self._journal = self._shard.shared(
+            "journal",
+            lambda: MemoryJournal(
+                os.path.join(
+                    data_dir, f"{user_id}_pending.jsonl"
+                )
+            ),
+        )
+
+    def _open_ann_index(self) -> IVFIndex:
+        index = IVFIndex(
+            self._shard.db_path,
+            nprobe=self.memory_ann_nprobe,
+        )
+        index.verify(self._vector_store)
+        return index
+
+    def _open_lexical_index(self) -> LexicalIndex:
+        index = LexicalIndex(self._vector_store)
+        index.sync()
+        return index
+
+    @property
+    def memory(self):
+        return self._shard.memory
+
+    @property
+    def _memory_generation(self) -> int:
+        return self._shard.generation
+
+    @property
+    def _vector_store(self):
+        """PowerMem 底层的 SQLiteVectorStore"""
+        return self.memory.storage.vector_store
+
+    def _replay_journal(self):
+        """把磁盘日志中的对话重新交给写入队列（无事件循环时直接同步写入）；
+        写入成功后才从日志中删除（见 _store_interactions）"""
+        items = self._journal.claim()
+        if not items:
+            return
+        logger.info(
+            f"Replaying {len(items)} interaction(s) from memory journal"
+        )
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            for item in items:
+                loop.create_task(
+                    self._write_queue.put(item)
+                )
+            return
+
+        batch_size = self._write_queue.max_batch
+        for i in range(0, len(items), batch_size):
+            try:
+                self._store_interactions(
+                    items[i : i + batch_size]
+                )
+            except Exception as e:
+                # 没写入的对话还在日志里，下次启动时再重放
+                logger.error(
+                    f"Failed to replay memory journal: {e}"
+                )
+                return
+
+    async def aclose(self, timeout: float = None):
+        """会话结束时调用（客户端断开或进程退出）：刷写尚未写入的记忆，
+        超过期限仍未写完的对话保存到磁盘日志，然后归还分片；重复调用无效"""
+        if self._closed:
+            return
+        self._closed = True
+        if timeout is None:
+            timeout = self.memory_flush_timeout
+        logger.info(
+            f"Flushing pending memory writes (deadline {timeout:.1f}s)"
+        )
+        unwritten = await self._write_queue.aclose(timeout)
+        if unwritten:
+            self._journal.spill(unwritten)
+        if self._ann_index is not None:
+            await asyncio.to_thread(self._ann_index.flush)
+        _LIVE_AGENTS.discard(self)
+        self._discard()
+        logger.info(
+            f"PowerMemAgent closed: {self._write_queue.stats()}"
+        )
+        logger.info(f"PowerMem clients: {registry_stats()}")
+        if self._write_gate is not None:
+            logger.info(
+                f"Memory write gate: {self._write_gate.stats()}"
+            )
+        for stats in tts_cache_stats():
+            logger.info(f"TTS cache {stats}")
+        if self._scheduler is not None:
+            logger.info(
+                f"Ollama scheduler: {self._scheduler.stats()}"
+            )
 
     def _add_message(
         self,
@@ -181,7 +749,7 @@ class PowerMemAgent(BasicMemoryAgent):
         )
 
         if skip_memory:
-            logger.debug(
+            hot_log.debug(
                 f"Skipping memory storage for {role} message (skip_memory=True)"
             )
             return
@@ -197,7 +765,7 @@ class PowerMemAgent(BasicMemoryAgent):
             text_content = str(message)
 
         if not text_content:
-            logger.debug(
+            hot_log.debug(
                 f"Empty content for {role} message, skipping memory storage"
             )
             return
@@ -205,121 +773,461 @@ class PowerMemAgent(BasicMemoryAgent):
         # 存储逻辑
         if role == "user":
             self._last_user_input = text_content
-            logger.debug(
+            hot_log.debug(
                 f"Stored user input for later pairing: {text_content[:50]}..."
             )
         elif (
             role == "assistant"
             and self._last_user_input is not None
         ):
-            logger.debug(
+            hot_log.debug(
                 f"Pairing assistant response with last user input: {text_content[:50]}..."
             )
-            asyncio.create_task(
-                self._store_interaction_async(
-                    self._last_user_input, text_content
+            tags = None
+            trace = current_trace()
+            if trace is not None:
+                trace.pending_write = True
+            if self._tag_scanner is not None:
+                tags = self._tag_scanner.tags()
+                self._tag_scanner = None
+            self._write_queue.submit(
+                PendingInteraction(
+                    self._last_user_input,
+                    text_content,
+                    tags=tags,
+                    trace_id=(
+                        trace.turn_id if trace else None
+                    ),
                 )
             )
             self._last_user_input = None
 
-    async def _store_interaction_async(
-        self, user_input: str, response: str
+    def _store_interactions(
+        self, batch: list[PendingInteraction]
     ):
-        """异步存储一次对话到 PowerMem（使用线程池避免阻塞）"""
+        """写入一批对话（由写入队列在线程池中调用）"""
+        # 抽取和嵌入请求以后台优先级排队，不与正在进行的对话抢连接
+        with request_priority(BACKGROUND):
+            self._write_interactions(batch)
 
-        def sync_store():
+    def _write_interactions(
+        self, batch: list[PendingInteraction]
+    ):
+        """逐条交给 memory.add：每轮抽取出的记忆只带这一轮自己的标签和时间，
+        标签加权、时间衰减和整理时的合并规则才有正确的依据"""
+        for index, item in enumerate(batch):
             try:
-                memory_content = f"用户说：{user_input}\n你回答：{response}"
-                tags = self._extract_tags(
-                    user_input, response
-                )
-                self.memory.add(
-                    memory_content,
-                    user_id=self.user_id,
-                    metadata={
-                        "type": "conversation",
-                        "tags": tags,
-                        "timestamp": datetime.now().isoformat(),
-                    },
-                )
-                logger.debug(
-                    f"Stored interaction with tags: {tags}"
-                )
+                self._write_interaction(item)
             except Exception as e:
-                logger.error(
-                    f"Failed to store interaction to PowerMem: {e}"
+                raise UnwrittenError(batch[index:]) from e
+            self._journal.written([item])
+            self._tracer.complete(
+                item.trace_id, "memory_write_end"
+            )
+
+    def _write_interaction(self, item: PendingInteraction):
+        tags = (
+            item.tags
+            if item.tags is not None
+            else self._extract_tags(
+                item.user_input, item.response
+            )
+        )
+        decision = None
+        if self._write_gate is not None:
+            decision = self._gate_interaction(item, tags)
+            if decision is None:
+                return
+        self._add_interaction(item, tags)
+        # 写入成功后才记下这轮对话，失败重试时不会被当成重复跳过
+        if decision is not None:
+            self._write_gate.record(decision)
+
+    def _gate_interaction(
+        self, item: PendingInteraction, tags: list
+    ):
+        """按预筛结果跳过或并入已有记忆；仍需交给 PowerMem 抽取时返回预筛结果，否则返回 None"""
+        gate = self._write_gate
+        decision = gate.check(
+            item.user_input, item.response, tags
+        )
+        try:
+            if decision.action == "merge":
+                if not gate.merge(
+                    decision, tags, item.timestamp
+                ):
+                    return decision
+                gate.record(decision)
+                self._invalidate_retrieval_cache()
+                hot_log.debug(
+                    f"Merged interaction into memory {decision.target_id} "
+                    f"(similarity {decision.similarity:.3f})"
                 )
+                return None
+            if decision.action == "skip":
+                hot_log.debug(
+                    f"Skipped memory write ({decision.reason}): "
+                    f"{item.user_input[:30]}"
+                )
+                return None
+            return decision
+        finally:
+            hot_log.debug(
+                f"Memory write gate: {gate.stats()}"
+            )
+
+    def _add_interaction(
+        self, item: PendingInteraction, tags: list
+    ):
+        start = time.perf_counter()
+        result = self.memory.add(
+            f"用户说：{item.user_input}\n你回答：{item.response}",
+            user_id=self.user_id,
+            metadata={
+                "type": "conversation",
+                "tags": tags,
+                "timestamp": item.timestamp,
+            },
+        )
+        if self._write_gate is not None:
+            self._write_gate.record_extraction(
+                time.perf_counter() - start, 1
+            )
+        self._sync_indexes(result)
+        self._invalidate_retrieval_cache()
+        hot_log.debug(
+            f"Stored interaction with tags: {tags}"
+        )
 
-        await asyncio.to_thread(sync_store)
+    def _sync_indexes(self, add_result: dict):
+        """根据 memory.add 返回的事件增量更新 ANN 索引和关键词索引"""
+        if not add_result or (
+            self._ann_index is None
+            and self._lexical_index is None
+        ):
+            return
+        changed, deleted = [], []
+        for item in add_result.get("results", []):
+            if item.get("id") is None:
+                continue
+            if item.get("event") == "DELETE":
+                deleted.append(int(item["id"]))
+            else:
+                changed.append(int(item["id"]))
+        if self._lexical_index is not None:
+            self._lexical_index.remove(deleted)
+            self._lexical_index.upsert(changed)
+        if self._ann_index is None:
+            return
+        if deleted:
+            self._ann_index.remove(deleted)
+        if changed:
+            ids, vectors = fetch_vectors(
+                self._vector_store, changed
+            )
+            self._ann_index.upsert(ids, vectors)
+
+    def _ensure_consolidation(self):
+        """在事件循环中惰性启动分片的定期整理任务（同一用户的会话共用一个）"""
+        if self._consolidator is None:
+            return
+        shard, consolidator, scheduler = (
+            self._shard,
+            self._consolidator,
+            self._scheduler,
+        )
+        interval, min_new = (
+            self.memory_consolidation_interval,
+            self.memory_consolidation_min_new,
+        )
+        shard.ensure_task(
+            "consolidation",
+            lambda: asyncio.create_task(
+                _consolidation_loop(
+                    shard,
+                    consolidator,
+                    scheduler,
+                    interval,
+                    min_new,
+                ),
+                name="powermem-consolidation",
+            ),
+        )
+
+    async def consolidate_memories(self) -> dict:
+        """整理一次长期记忆（在对话间隙执行），返回整理报告"""
+        if self._consolidator is None:
+            return {}
+        report = await _consolidate(
+            self._shard, self._consolidator, self._scheduler
+        )
+        self._result_cache.clear()
+        return report
 
     def _extract_tags(
         self, user_input: str, response: str
     ) -> list:
-        """简单关键词标签提取"""
-        tags = []
-        combined = (user_input + " " + response).lower()
-        if any(
-            word in combined
-            for word in ["难过", "伤心", "不开心", "郁闷"]
-        ):
-            tags.append("need_comfort")
-        if any(
-            word in combined
-            for word in ["名字", "我叫", "我是"]
-        ):
-            tags.append("user_identity")
-        if any(
-            word in combined
-            for word in ["喜欢", "爱", "讨厌"]
-        ):
-            tags.append("preference")
+        """关键词标签提取（流式扫描结果不可用时的兜底，如从日志恢复的对话）"""
+        tags = self._tag_engine.tags(user_input, response)
         if tags:
-            logger.debug(f"Extracted tags: {tags}")
+            hot_log.debug(f"Extracted tags: {tags}")
         return tags
 
+    def _invalidate_retrieval_cache(self):
+        """记忆库发生写入后调用：递增记忆代数并清空结果缓存（向量缓存仍然有效）"""
+        self._shard.generation += 1
+        self._result_cache.clear()
+
+    def _embed_query(
+        self, query_key: str, query: str
+    ) -> list:
+        """获取查询向量，优先使用缓存，未命中时才请求 Ollama"""
+        embedding = self._embedding_cache.get(query_key)
+        if embedding is None:
+            with span("embedding"):
+                embedding = self.memory.embedding.embed(
+                    query, memory_action="search"
+                )
+            self._embedding_cache.put(query_key, embedding)
+        return embedding
+
+    def _search_memories(self, query: str) -> list:
+        """执行（带缓存的）向量检索，返回 PowerMem 格式的结果列表"""
+        query_key = normalize_query(query)
+        result_key = (
+            query_key,
+            self.memory_top_k,
+            self._memory_generation,
+        )
+        cached = self._result_cache.get(result_key)
+        if cached is not None:
+            self._cache_saved_seconds += (
+                self._avg_search_cost
+            )
+            hot_log.debug(
+                f"Memory result cache hit, saved ~{self._avg_search_cost:.3f}s "
+                f"(total {self._cache_saved_seconds:.1f}s)"
+            )
+            return cached
+
+        start_time = time.perf_counter()
+        if self._lexical_index is not None:
+            results = self._hybrid_search(query_key, query)
+        else:
+            results = self._dense_search(query_key, query)
+        elapsed = time.perf_counter() - start_time
+        # 未命中时的检索耗时（指数滑动平均），用来估算缓存命中节省的时间
+        self._avg_search_cost = (
+            elapsed
+            if not self._avg_search_cost
+            else 0.8 * self._avg_search_cost + 0.2 * elapsed
+        )
+        self._result_cache.put(result_key, results)
+        return results
+
+    def _dense_search(
+        self, query_key: str, query: str
+    ) -> list:
+        """嵌入查询后做向量检索（可选重排）"""
+        embedding = self._embed_query(query_key, query)
+        if self.memory_rerank:
+            return self._rerank(
+                embedding,
+                self._vector_search(
+                    embedding,
+                    query,
+                    self.memory_top_k
+                    * self.memory_candidate_factor,
+                ),
+            )
+        return self._vector_search(
+            embedding, query, self.memory_top_k
+        )
+
+    def _hybrid_search(
+        self, query_key: str, query: str
+    ) -> list:
+        """关键词检索先行；命中足够强时直接返回，否则与向量检索结果按 RRF 融合"""
+        with span("lexical_search"):
+            hits = [
+                hit
+                for hit in self._lexical_index.search(
+                    query, self.memory_lexical_candidates
+                )
+                if hit[1]
+                >= self.memory_lexical_min_coverage
+            ]
+            lexical = fetch_memories(
+                self._vector_store,
+                [
+                    (memory_id, coverage)
+                    for memory_id, coverage, _ in hits
+                ],
+                user_id=self.user_id,
+            )
+        for item in lexical:
+            item["lexical_match"] = True
+
+        if self.memory_skip_vector_coverage > 0 and any(
+            coverage >= self.memory_skip_vector_coverage
+            and terms >= self.memory_skip_vector_min_terms
+            for _, coverage, terms in hits
+        ):
+            self.lexical_only_searches += 1
+            hot_log.debug(
+                f"Strong lexical match, skipped embedding; "
+                f"lexical-only {self.lexical_only_searches}/"
+                f"{self.lexical_only_searches + self.hybrid_searches} searches"
+            )
+            return lexical[: self.memory_top_k]
+
+        self.hybrid_searches += 1
+        dense = [
+            item
+            for item in self._dense_search(query_key, query)
+            if item.get("score", 0) > self.memory_threshold
+        ]
+        return reciprocal_rank_fusion(
+            [dense, lexical],
+            self.memory_top_k,
+            k=self.memory_rrf_k,
+        )
+
+    def _vector_search(
+        self, embedding: list, query: str, limit: int
+    ) -> list:
+        """按配置走 ANN 索引或 PowerMem 自带的精确检索"""
+        with span("vector_search"):
+            if self._ann_index is not None:
+                self._ann_index.ensure_ready(
+                    self._vector_store
+                )
+                return fetch_memories(
+                    self._vector_store,
+                    self._ann_index.search(
+                        embedding, limit
+                    ),
+                    user_id=self.user_id,
+                )
+            # 直接查存储层以复用缓存的查询向量（Memory.search 每次都会重新嵌入）；
+            # 代价是跳过 Memory.search 的 intelligence 结果处理、插件 on_search
+            # （遗忘曲线等生命周期更新）和 memory.search 审计事件。
+            # 本项目的配置没有启用 intelligence 和插件，启用它们时需改回 Memory.search
+            return self.memory.storage.search_memories(
+                query_embedding=embedding,
+                user_id=self.user_id,
+                limit=limit,
+                query=query,
+            )
+
+    def _rerank(
+        self, embedding: list, candidates: list
+    ) -> list:
+        """对超过阈值的候选做向量化重排与去重，返回 top_k 条"""
+        candidates = [
+            c
+            for c in candidates
+            if c.get("score", 0) > self.memory_threshold
+        ]
+        if len(candidates) <= 1:
+            return candidates
+        ids, vectors = fetch_vectors(
+            self._vector_store,
+            [c["id"] for c in candidates],
+        )
+        row_of = {int(i): row for row, i in enumerate(ids)}
+        candidates = [
+            c for c in candidates if int(c["id"]) in row_of
+        ]
+        vectors = vectors[
+            [row_of[int(c["id"])] for c in candidates]
+        ]
+        reranked = rerank_memories(
+            embedding,
+            candidates,
+            vectors,
+            self.memory_top_k,
+            **self._rerank_options,
+        )
+        hot_log.debug(
+            f"Reranked {len(candidates)} candidates into {len(reranked)} memories"
+        )
+        return reranked
+
     def _retrieve_relevant(self, query: str) -> str:
         """从 PowerMem 检索相关记忆，返回格式化文本（同步方法，应在线程池中调用）"""
-        import time
-
-        start_time = time.time()
+        start_time = time.perf_counter()
         try:
-            logger.debug(
+            hot_log.debug(
                 f"Retrieving memories for query: {query[:50]}..."
             )
-            results = self.memory.search(
-                query,
-                user_id=self.user_id,
-                limit=self.memory_top_k,
-            )
-            if not results or not results.get("results"):
-                logger.debug("No relevant memories found")
+            results = self._search_memories(query)
+            if not results:
+                hot_log.debug("No relevant memories found")
                 return ""
 
             memory_text = "【回忆】\n"
             count = 0
-            for item in results["results"]:
+            used = []
+            for item in results:
                 score = item.get("score", 0)
-                if score > self.memory_threshold:
+                # 混合检索中关键词命中的记忆不受向量相似度阈值限制
+                if (
+                    score > self.memory_threshold
+                    or item.get("lexical_match")
+                ):
                     content = item.get("memory", "")[:100]
                     memory_text += (
                         f"- 我记得：{content}...\n"
                     )
                     count += 1
-            elapsed = time.time() - start_time
-            logger.info(
+                    if item.get("id") is not None:
+                        used.append(item["id"])
+            # 记下被用到的记忆，过期清理不会删除它们
+            if self._consolidator is not None and used:
+                self._consolidator.note_retrieved(used)
+            elapsed = time.perf_counter() - start_time
+            hot_log.info(
                 f"Retrieved {count} relevant memories in {elapsed:.3f}s"
             )
+            hot_log.debug(
+                f"Memory cache stats: result[{self._result_cache.stats()}] "
+                f"embedding[{self._embedding_cache.stats()}]"
+            )
             return memory_text
         except Exception as e:
             logger.error(f"Memory retrieval error: {e}")
             return ""
 
+    def _history_window(
+        self, user_message: dict = None
+    ) -> list[dict[str, Any]]:
+        """本轮要发送的历史：有 token 预算时只取预算内的最近若干条"""
+        if self._context_builder is None:
+            return self._memory.copy()
+        prefix = self._system
+        if self._turn_memory:
+            prefix += "\n\n" + self._memory_message()
+        window = self._context_builder.window(
+            self._memory, prefix, user_message
+        )
+        stats = self._context_builder.last_turn
+        hot_log.info(
+            f"Prompt tokens: total={stats['total']} system={stats['system']} "
+            f"history={stats['history']} ({stats['history_turns']} msgs, "
+            f"{stats['dropped_turns']} dropped) user={stats['user']}"
+        )
+        hot_log.debug(
+            f"Prompt tokens per turn: {self._context_builder.prompt_tokens.format(unit='')}"
+        )
+        return window
+
     def _to_messages(
         self, input_data: BatchInput
     ) -> list[dict[str, Any]]:
-        messages = self._memory.copy()
         user_content = []
         text_prompt = ""
+        self._turn_images = 0
         if input_data.texts:
             text_prompt = input_data.texts[0].content
             user_content.append(
@@ -328,17 +1236,29 @@ class PowerMemAgent(BasicMemoryAgent):
 
         if input_data.images:
             image_added = False
+            sent = set()
             for img_data in input_data.images:
                 if isinstance(
                     img_data.data, str
                 ) and img_data.data.startswith(
                     "data:image"
                 ):
+                    url = img_data.data
+                    if self._images is not None:
+                        # 本轮开始时已在工作线程里处理过（_preprocess_images）
+                        image = self._turn_processed.get(
+                            url
+                        ) or self._images.process(url)
+                        # 同一轮里重复的画面只发送一次
+                        if image.digest in sent:
+                            continue
+                        sent.add(image.digest)
+                        url = image.url
                     user_content.append(
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": img_data.data,
+                                "url": url,
                                 "detail": "auto",
                             },
                         }
@@ -352,12 +1272,32 @@ class PowerMemAgent(BasicMemoryAgent):
                 logger.warning(
                     "User input contains images but none could be processed."
                 )
+            if self._images is not None:
+                self._turn_processed = {}
+                self._turn_images = len(sent)
+                hot_log.debug(
+                    f"Image preprocessing: {self._images.stats()}"
+                )
 
         if user_content:
             user_message = {
                 "role": "user",
                 "content": user_content,
             }
+            with span("prompt_build"):
+                messages = self._history_window(
+                    user_message
+                )
+                if self._turn_memory:
+                    # 不用 system 角色：不少聊天模板只把 system 渲染在提示词开头，前缀又会每轮变化。
+                    # 这条 user 消息会按原样单独渲染（不会与本轮输入合并），所以内容里写明
+                    # 这是角色自己的回忆而不是用户说的话
+                    messages.append(
+                        {
+                            "role": "user",
+                            "content": self._memory_message(),
+                        }
+                    )
             messages.append(user_message)
 
             skip_memory = False
@@ -371,53 +1311,349 @@ class PowerMemAgent(BasicMemoryAgent):
 
             if not skip_memory:
                 self._add_message(
-                    (
-                        text_prompt
-                        if text_prompt
-                        else "[User provided image(s)]"
+                    self._history_text(
+                        text_prompt, self._turn_images
                     ),
                     "user",
                 )
         else:
+            messages = self._history_window()
             logger.warning(
                 "No content generated for user message."
             )
 
         return messages
 
+    def _preprocess_images(
+        self, input_data: BatchInput
+    ) -> dict:
+        """解码、缩小并重新编码本轮的图片（同步，在工作线程中调用），返回 data URL -> 处理结果"""
+        return {
+            img_data.data: self._images.process(
+                img_data.data
+            )
+            for img_data in input_data.images or []
+            if isinstance(img_data.data, str)
+            and img_data.data.startswith("data:image")
+        }
+
+    def _memory_message(self) -> str:
+        """memory_injection 为 "message" 时单独一条消息的内容：本轮检索到的回忆，并注明其来源"""
+        return _RECALL_NOTE + self._turn_memory
+
+    def _history_text(
+        self, text_prompt: str, images: int
+    ) -> str:
+        """写入历史的用户消息：图片不进历史，只留一个很短的文字占位"""
+        if self._images is None or not images:
+            return (
+                text_prompt
+                if text_prompt
+                else "[User provided image(s)]"
+            )
+        placeholder = f"[图片×{images}]"
+        return (
+            f"{text_prompt} {placeholder}"
+            if text_prompt
+            else placeholder
+        )
+
+    def attach_tts_engine(self, engine):
+        """会话上下文创建好 TTS 引擎后调用（见 custom_agents/tts_cache.py），逐句预取只进入它的合成池"""
+        self._tts_engine = engine
+
+    def prefetch(self, text: str):
+        """在最终文本到达前提前检索记忆（可由 ASR 部分结果或输入框文本多次调用）
+
+        同一时间只有一个预取在执行；执行期间到达的新文本会在其完成后
+        再预取一次（若与已预取的文本足够相似则跳过）。必须在事件循环中调用。
+        """
+        if not text or not text.strip():
+            return
+        if self._prefetch_task is not None:
+            if (
+                text_similarity(text, self._prefetch_text)
+                >= self.memory_prefetch_similarity
+            ):
+                return
+            if not self._prefetch_task.done():
+                self._prefetch_next_text = text
+                return
+        hot_log.debug(
+            f"Prefetching memories for: {text[:50]}..."
+        )
+        self._prefetch_text = text
+        self._prefetch_next_text = None
+        self._prefetch_task = asyncio.ensure_future(
+            asyncio.to_thread(self._retrieve_relevant, text)
+        )
+        self._prefetch_task.add_done_callback(
+            self._on_prefetch_done
+        )
+
+    def _on_prefetch_done(self, task: asyncio.Future):
+        if task is not self._prefetch_task:
+            return
+        next_text = self._prefetch_next_text
+        if next_text:
+            self.prefetch(next_text)
+
+    def _take_retrieval(
+        self, user_text: str
+    ) -> asyncio.Future:
+        """取得本轮的检索任务：复用足够相似的预取结果，否则新开一次检索"""
+        task, prefetched = (
+            self._prefetch_task,
+            self._prefetch_text,
+        )
+        self._prefetch_task = None
+        self._prefetch_text = None
+        self._prefetch_next_text = None
+        if (
+            task is not None
+            and text_similarity(user_text, prefetched)
+            >= self.memory_prefetch_similarity
+        ):
+            self.prefetch_hits += 1
+            hot_log.debug(
+                f"Reusing prefetched memories for: {prefetched[:50]}..."
+            )
+            return task
+        if task is not None:
+            self.prefetch_misses += 1
+        return asyncio.ensure_future(
+            asyncio.to_thread(
+                self._retrieve_relevant, user_text
+            )
+        )
+
+    @staticmethod
+    def _merge_memory_context(*contexts: str) -> str:
+        """合并多段【回忆】文本并去掉重复条目"""
+        lines = []
+        for context in contexts:
+            for line in context.splitlines():
+                if (
+                    line.startswith("- ")
+                    and line not in lines
+                ):
+                    lines.append(line)
+        if not lines:
+            return ""
+        return "【回忆】\n" + "\n".join(lines) + "\n"
+
+    async def _get_memory_context(
+        self, user_text: str
+    ) -> str:
+        """在检索期限内取得记忆文本；超时则本轮跳过，结果留到下一轮"""
+        late_context = ""
+        late_task = self._late_memory_task
+        if late_task is not None and late_task.done():
+            self._late_memory_task = None
+            if (
+                not late_task.cancelled()
+                and not late_task.exception()
+            ):
+                late_context = late_task.result()
+                if late_context:
+                    logger.info(
+                        "Injecting memories that missed the previous turn's deadline"
+                    )
+
+        with span("memory_retrieval"):
+            task = self._take_retrieval(user_text)
+            if self.memory_retrieval_timeout <= 0:
+                context = await task
+            else:
+                try:
+                    context = await asyncio.wait_for(
+                        asyncio.shield(task),
+                        timeout=self.memory_retrieval_timeout,
+                    )
+                except asyncio.TimeoutError:
+                    self.retrieval_timeouts += 1
+                    self._late_memory_task = task
+                    logger.info(
+                        f"Memory retrieval exceeded {self.memory_retrieval_timeout * 1000:.0f}ms, "
+                        "continuing without memories (deferred to next turn)"
+                    )
+                    context = ""
+        hot_log.debug(
+            f"Prefetch stats: hits={self.prefetch_hits} misses={self.prefetch_misses} "
+            f"timeouts={self.retrieval_timeouts}"
+        )
+        if late_context:
+            return self._merge_memory_context(
+                late_context, context
+            )
+        return context
+
+    def _log_prompt_eval(self):
+        """输出本轮 Ollama 的 prompt 评估统计（仅原生 Ollama 客户端可用）"""
+        last = self._prompt_eval.take_last()
+        if last is None:
+            return
+        evaluated = last["prompt_eval_count"]
+        message = (
+            f"Prompt eval: {evaluated} tokens in "
+            f"{last['prompt_eval_seconds'] * 1000:.0f}ms"
+        )
+        if self._context_builder is not None:
+            estimated = self._context_builder.last_turn.get(
+                "total", 0
+            )
+            message += f" (~{max(0, estimated - evaluated)} of ~{estimated} reused from KV cache)"
+        logger.info(message)
+        if self._turn_images:
+            self._image_prompt_eval.add(
+                last["prompt_eval_seconds"]
+            )
+            logger.info(
+                f"Prompt eval with {self._turn_images} image(s): "
+                f"{self._image_prompt_eval.format()}; {self._images.stats()}"
+            )
+            self._turn_images = 0
+        hot_log.debug(
+            f"Prompt eval tokens per turn: {self._prompt_eval.prompt_eval_count.format(unit='')}; "
+            f"time: {self._prompt_eval.prompt_eval_seconds.format()}"
+        )
+
+    def _log_http_stats(self):
+        if self._http_pool_config is None:
+            return
+        for pool in all_pools():
+            hot_log.debug(f"HTTP pool {pool.stats()}")
+
+    async def _chat_with_tags(
+        self, input_data: BatchInput, user_text: str
+    ) -> AsyncIterator[
+        Union[SentenceOutput, Dict[str, Any]]
+    ]:
+        """调用父类 chat，同时把用户输入和逐句输出喂给标签扫描器，并结束本轮追踪"""
+        self._tag_scanner = self._tag_engine.scanner()
+        self._tag_scanner.feed(user_text)
+        trace = current_trace()
+        try:
+            async for output in super().chat(input_data):
+                if isinstance(output, SentenceOutput):
+                    mark("first_sentence")
+                    if (
+                        self._tts_prefetch
+                        and self._tts_engine is not None
+                        and output.tts_text
+                    ):
+                        self._tts_engine.prefetch(
+                            output.tts_text
+                        )
+                    self._tag_scanner.feed(
+                        output.display_text.text
+                        if output.display_text
+                        else ""
+                    )
+                yield output
+        finally:
+            if trace is not None:
+                self._tracer.finish_turn(trace)
+
     async def chat(
         self, input_data: BatchInput
     ) -> AsyncIterator[
         Union[SentenceOutput, Dict[str, Any]]
     ]:
-        logger.debug(
+        if self._scheduler is None:
+            async for output in self._chat_turn(input_data):
+                yield output
+            return
+
+        # 本轮进行期间后台记忆任务让路；首句耗时用于估算回收的延迟
+        self._scheduler.begin_foreground()
+        start = time.perf_counter()
+        first_sentence = None
+        try:
+            async for output in self._chat_turn(input_data):
+                if first_sentence is None and isinstance(
+                    output, SentenceOutput
+                ):
+                    first_sentence = (
+                        time.perf_counter() - start
+                    )
+                yield output
+        finally:
+            self._scheduler.end_foreground(first_sentence)
+            hot_log.debug(
+                f"Ollama scheduler: {self._scheduler.stats()}"
+            )
+
+    async def _chat_turn(
+        self, input_data: BatchInput
+    ) -> AsyncIterator[
+        Union[SentenceOutput, Dict[str, Any]]
+    ]:
+        hot_log.debug(
             "Starting chat method with memory retrieval"
         )
-        logger.debug(
+        self._ensure_consolidation()
+        self._tracer.start_turn()
+        hot_log.debug(
             f"input_data.texts: {[(t.source, t.content) for t in input_data.texts]}"
         )
 
         user_text = ""
         if input_data.texts:
             user_text = input_data.texts[0].content
-            logger.debug(
+            hot_log.debug(
                 f"Using first text as user input: {user_text}"
             )
         else:
-            logger.debug("No texts in input_data")
+            hot_log.debug("No texts in input_data")
+
+        # 图片在工作线程里处理，与记忆检索同时进行，不阻塞事件循环
+        images_task = None
+        if self._images is not None and input_data.images:
+            images_task = asyncio.ensure_future(
+                asyncio.to_thread(
+                    self._preprocess_images, input_data
+                )
+            )
 
         memory_context = ""
         if user_text:
-            logger.debug(
+            hot_log.debug(
                 f"Retrieving memories for user input: {user_text[:50]}..."
             )
-            memory_context = await asyncio.to_thread(
-                self._retrieve_relevant, user_text
+            memory_context = await self._get_memory_context(
+                user_text
             )
         else:
             logger.info(
                 "No user input found in BatchInput, skipping memory retrieval"
             )
+        if images_task is not None:
+            self._turn_processed = await images_task
+
+        if memory_context and self._context_builder:
+            memory_context = (
+                self._context_builder.fit_memory(
+                    memory_context
+                )
+            )
+
+        if self.memory_injection == "message":
+            if memory_context:
+                logger.info(
+                    "Injecting retrieved memories as a separate message"
+                )
+            self._turn_memory = memory_context
+            try:
+                async for output in self._chat_with_tags(
+                    input_data, user_text
+                ):
+                    yield output
+            finally:
+                self._turn_memory = ""
+                self._log_prompt_eval()
+                self._log_http_stats()
+            return
 
         original_system = self._system
         if memory_context:
@@ -428,14 +1664,18 @@ class PowerMemAgent(BasicMemoryAgent):
                 original_system + "\n\n" + memory_context
             )
         else:
-            logger.debug("No memory context to inject")
+            hot_log.debug("No memory context to inject")
 
         try:
-            async for output in super().chat(input_data):
+            async for output in self._chat_with_tags(
+                input_data, user_text
+            ):
                 yield output
         finally:
             if memory_context:
-                logger.debug(
+                hot_log.debug(
                     "Restoring original system prompt"
                 )
                 self._system = original_system
+            self._log_prompt_eval()
+            self._log_http_stats()
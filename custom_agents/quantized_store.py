@@ -0,0 +1,502 @@
+# custom_agents/quantized_store.py
+"""
+紧凑向量存储：PowerMem SQLite 向量库的 float16 / int8 版本
+
+float16：向量列保存半精度向量，检索时扫描常驻内存的半精度矩阵。
+int8   ：向量列保存逐向量缩放的 int8 码，vector_exact 列另存半精度向量；
+         先用常驻内存的 int8 矩阵粗排，再读取前 rerank_factor × limit 个候选的
+         半精度向量精排，只有这一小部分需要从磁盘读取。
+旧的 JSON 行仍然可以读取，用下面的命令一次性迁移现有数据库：
+    uv run python -m custom_agents.quantized_store powermem_data/kristina_memory.db --mode int8
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import time
+
+import numpy as np
+from loguru import logger
+from powermem.storage.base import OutputData
+from powermem.storage.sqlite.sqlite_vector_store import (
+    SQLiteVectorStore,
+)
+from powermem.utils.utils import generate_snowflake_id
+
+from custom_agents.vector_rows import (
+    decode_vector,
+    encode_vector,
+)
+
+STORAGE_MODES = ("float16", "int8")
+
+
+def _coarse(vector: np.ndarray, mode: str) -> np.ndarray:
+    """把 float32 向量转成常驻内存的粗排表示"""
+    if mode == "float16":
+        return vector.astype(np.float16)
+    scale = float(np.abs(vector).max()) / 127 or 1.0
+    return np.round(vector / scale).astype(np.int8)
+
+
+class QuantizedSQLiteVectorStore(SQLiteVectorStore):
+    """以 float16 / int8 保存向量的 SQLiteVectorStore，接口与父类一致"""
+
+    def __init__(
+        self,
+        database_path: str = ":memory:",
+        collection_name: str = "memories",
+        mode: str = "int8",
+        rerank_factor: int = 8,
+        **kwargs,
+    ):
+        if mode not in STORAGE_MODES:
+            raise ValueError(
+                f"Unknown storage mode: {mode}"
+            )
+        self.mode = mode
+        self.rerank_factor = rerank_factor
+        self._ids = None
+        self._codes = None
+        self._norms = None
+        super().__init__(
+            database_path, collection_name, **kwargs
+        )
+        self._ensure_exact_column()
+
+    def _ensure_exact_column(self):
+        with self._lock:
+            columns = [
+                row[1]
+                for row in self.connection.execute(
+                    f"PRAGMA table_info({self.collection_name})"
+                )
+            ]
+            if "vector_exact" not in columns:
+                self.connection.execute(
+                    f"ALTER TABLE {self.collection_name} "
+                    "ADD COLUMN vector_exact BLOB"
+                )
+                self.connection.commit()
+
+    def _encode(self, vector) -> tuple:
+        exact = (
+            encode_vector(vector, "float16")
+            if self.mode == "int8"
+            else None
+        )
+        return encode_vector(vector, self.mode), exact
+
+    # ---------- 常驻内存的粗排矩阵 ----------
+
+    def _load_matrix(self):
+        rows = self.connection.execute(
+            f"SELECT id, vector FROM {self.collection_name}"
+        ).fetchall()
+        if not rows:
+            self._ids = np.empty(0, dtype=np.int64)
+            self._codes = None
+            self._norms = np.empty(0, dtype=np.float32)
+            return
+        self._ids = np.fromiter(
+            (row[0] for row in rows),
+            dtype=np.int64,
+            count=len(rows),
+        )
+        self._codes = np.stack(
+            [
+                _coarse(decode_vector(row[1]), self.mode)
+                for row in rows
+            ]
+        )
+        self._refresh_norms()
+
+    def _refresh_norms(self):
+        self._norms = np.linalg.norm(
+            self._codes.astype(np.float32), axis=1
+        )
+        self._norms[self._norms == 0] = 1.0
+
+    def _append_matrix(self, ids: list, vectors: list):
+        if self._ids is None:
+            return
+        codes = np.stack(
+            [
+                _coarse(
+                    np.asarray(v, dtype=np.float32),
+                    self.mode,
+                )
+                for v in vectors
+            ]
+        )
+        self._ids = np.concatenate(
+            (self._ids, np.asarray(ids, dtype=np.int64))
+        )
+        self._codes = (
+            codes
+            if self._codes is None
+            else np.concatenate((self._codes, codes))
+        )
+        self._refresh_norms()
+
+    def _invalidate_matrix(self):
+        self._ids = self._codes = self._norms = None
+
+    @property
+    def resident_bytes(self) -> int:
+        """粗排矩阵占用的内存字节数"""
+        if self._codes is None:
+            return 0
+        return self._codes.nbytes + self._norms.nbytes
+
+    # ---------- 写入 ----------
+
+    def insert(
+        self, vectors, payloads=None, ids=None
+    ) -> list:
+        if not vectors:
+            return []
+        if payloads is None:
+            payloads = [{} for _ in vectors]
+        generated_ids = [
+            generate_snowflake_id() for _ in vectors
+        ]
+        with self._lock:
+            for vector, payload, vector_id in zip(
+                vectors, payloads, generated_ids
+            ):
+                encoded, exact = self._encode(vector)
+                self.connection.execute(
+                    f"INSERT INTO {self.collection_name} "
+                    "(id, vector, payload, vector_exact) VALUES (?, ?, ?, ?)",
+                    (
+                        vector_id,
+                        encoded,
+                        json.dumps(payload),
+                        exact,
+                    ),
+                )
+            self.connection.commit()
+            self._append_matrix(generated_ids, vectors)
+        return generated_ids
+
+    def update(self, vector_id, vector=None, payload=None):
+        updates, values = [], []
+        if vector is not None:
+            encoded, exact = self._encode(vector)
+            updates += ["vector = ?", "vector_exact = ?"]
+            values += [encoded, exact]
+        if payload is not None:
+            updates.append("payload = ?")
+            values.append(json.dumps(payload))
+        if not updates:
+            return
+        values.append(vector_id)
+        with self._lock:
+            self.connection.execute(
+                f"UPDATE {self.collection_name} "
+                f"SET {', '.join(updates)} WHERE id = ?",
+                values,
+            )
+            self.connection.commit()
+            if vector is not None:
+                self._invalidate_matrix()
+
+    def delete(self, vector_id):
+        super().delete(vector_id)
+        with self._lock:
+            self._invalidate_matrix()
+
+    def reset(self):
+        super().reset()
+        self._ensure_exact_column()
+        with self._lock:
+            self._invalidate_matrix()
+
+    # ---------- 读取 ----------
+
+    def get(self, vector_id):
+        with self._lock:
+            row = self.connection.execute(
+                f"SELECT id, payload FROM {self.collection_name} WHERE id = ?",
+                (vector_id,),
+            ).fetchone()
+        if not row:
+            return None
+        return OutputData(
+            id=row[0], score=1.0, payload=json.loads(row[1])
+        )
+
+    def list(
+        self,
+        filters=None,
+        limit=None,
+        offset=None,
+        order_by=None,
+        order="desc",
+    ):
+        query, params = self._filtered_sql(
+            "SELECT id, payload", filters
+        )
+        if order_by in ("created_at", "updated_at"):
+            query += f" ORDER BY json_extract(payload, '$.{order_by}') {order.upper()}"
+        elif order_by == "id":
+            query += f" ORDER BY id {order.upper()}"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        if offset:
+            query += f" OFFSET {int(offset)}"
+        with self._lock:
+            rows = self.connection.execute(
+                query, params
+            ).fetchall()
+        return [
+            OutputData(
+                id=row[0],
+                score=1.0,
+                payload=json.loads(row[1]),
+            )
+            for row in rows
+        ]
+
+    def _filtered_sql(self, select: str, filters) -> tuple:
+        query = f"{select} FROM {self.collection_name}"
+        params = []
+        conditions = []
+        for key, value in (filters or {}).items():
+            conditions.append(
+                f"json_extract(payload, '$.{key}') = ?"
+            )
+            params.append(value)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        return query, params
+
+    def search(
+        self, query, vectors=None, limit=5, filters=None
+    ):
+        """粗排（int8/float16 常驻矩阵）+ 精排（候选的半精度向量）"""
+        if vectors and len(vectors) > 0:
+            query_vector = vectors[0]
+        else:
+            query_vector = (
+                query if isinstance(query, list) else None
+            )
+        if query_vector is None:
+            return []
+        q = np.asarray(query_vector, dtype=np.float32)
+        q /= np.linalg.norm(q) or 1.0
+
+        with self._lock:
+            if self._ids is None:
+                self._load_matrix()
+            if self._codes is None:
+                return []
+            scores = (
+                self._codes.astype(np.float32) @ q
+            ) / self._norms
+            ids = self._ids
+            effective_filters = {
+                k: v
+                for k, v in (filters or {}).items()
+                if v is not None
+            }
+            if effective_filters:
+                sql, params = self._filtered_sql(
+                    "SELECT id", effective_filters
+                )
+                allowed = np.fromiter(
+                    (
+                        row[0]
+                        for row in self.connection.execute(
+                            sql, params
+                        )
+                    ),
+                    dtype=np.int64,
+                )
+                keep = np.isin(ids, allowed)
+                ids, scores = ids[keep], scores[keep]
+
+            n_candidates = min(
+                len(ids),
+                limit
+                * (
+                    self.rerank_factor
+                    if self.mode == "int8"
+                    else 1
+                ),
+            )
+            if n_candidates == 0:
+                return []
+            top = np.argpartition(
+                -scores, n_candidates - 1
+            )[:n_candidates]
+            candidates = {
+                int(ids[i]): float(scores[i]) for i in top
+            }
+            placeholders = ",".join("?" * len(candidates))
+            rows = self.connection.execute(
+                f"SELECT id, payload, vector_exact FROM {self.collection_name} "
+                f"WHERE id IN ({placeholders})",
+                tuple(candidates),
+            ).fetchall()
+
+        results = []
+        for vector_id, payload_str, exact in rows:
+            score = candidates[vector_id]
+            if exact is not None:
+                v = decode_vector(exact)
+                score = float(
+                    v @ q / (np.linalg.norm(v) or 1.0)
+                )
+            results.append(
+                OutputData(
+                    id=vector_id,
+                    score=score,
+                    payload=json.loads(payload_str),
+                )
+            )
+        results.sort(key=lambda x: x.score, reverse=True)
+        return results[:limit]
+
+
+# ---------- 迁移命令 ----------
+
+
+def _load_float32(db_path: str, table: str):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(
+        f"SELECT id, vector FROM {table}"
+    ).fetchall()
+    conn.close()
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    matrix = np.stack(
+        [decode_vector(row[1]) for row in rows]
+    )
+    return ids, matrix
+
+
+def _recall_at_k(
+    store: QuantizedSQLiteVectorStore,
+    ids: np.ndarray,
+    matrix: np.ndarray,
+    k: int,
+    n_queries: int = 100,
+) -> float:
+    """用库内向量加噪声作为查询，对比 float32 精确结果与量化检索结果"""
+    rng = np.random.default_rng(0)
+    normalized = matrix / np.linalg.norm(
+        matrix, axis=1, keepdims=True
+    )
+    picks = rng.integers(
+        0, len(ids), min(n_queries, len(ids))
+    )
+    noise = rng.normal(
+        scale=float(np.abs(matrix).mean()),
+        size=(len(picks), matrix.shape[1]),
+    )
+    hits = 0
+    for q in matrix[picks] + noise:
+        qn = q / np.linalg.norm(q)
+        exact = set(
+            ids[np.argsort(-(normalized @ qn))[:k]].tolist()
+        )
+        got = {
+            r.id
+            for r in store.search(
+                "", vectors=[q.tolist()], limit=k
+            )
+        }
+        hits += len(exact & got)
+    return hits / (len(picks) * k)
+
+
+def migrate(
+    db_path: str,
+    mode: str = "int8",
+    table: str = "memories",
+    backup: bool = True,
+    k: int = 3,
+):
+    """把 JSON 向量行一次性转换为紧凑格式，并报告磁盘、内存与 recall@k 的变化"""
+    size_before = os.path.getsize(db_path)
+    ids, matrix = _load_float32(db_path, table)
+    if len(ids) == 0:
+        logger.info("No memories to migrate")
+        return
+    if backup:
+        shutil.copy2(db_path, db_path + ".bak")
+        logger.info(f"Backup written to {db_path}.bak")
+
+    start = time.perf_counter()
+    store = QuantizedSQLiteVectorStore(
+        db_path, collection_name=table, mode=mode
+    )
+    with store._lock:
+        rows = store.connection.execute(
+            f"SELECT id, vector FROM {table}"
+        ).fetchall()
+        converted = 0
+        for vector_id, vector in rows:
+            if not isinstance(vector, str):
+                continue
+            encoded, exact = store._encode(
+                decode_vector(vector)
+            )
+            store.connection.execute(
+                f"UPDATE {table} SET vector = ?, vector_exact = ? WHERE id = ?",
+                (encoded, exact, vector_id),
+            )
+            converted += 1
+        store.connection.commit()
+        store.connection.execute("VACUUM")
+        store._invalidate_matrix()
+    elapsed = time.perf_counter() - start
+
+    recall = _recall_at_k(store, ids, matrix, k)
+    size_after = os.path.getsize(db_path)
+    print(
+        f"Converted {converted}/{len(ids)} rows to {mode} in {elapsed:.2f}s"
+    )
+    print(
+        f"Disk size      : {size_before / 1024:.1f} KB -> {size_after / 1024:.1f} KB"
+    )
+    print(
+        f"Resident matrix: {matrix.nbytes / 1024:.1f} KB (float32) -> "
+        f"{store.resident_bytes / 1024:.1f} KB ({mode})"
+    )
+    print(
+        f"Recall@{k}      : 1.000 (float32) -> {recall:.3f} ({mode})"
+    )
+    store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Migrate a PowerMem SQLite database to compact vector storage"
+    )
+    parser.add_argument("db_path")
+    parser.add_argument(
+        "--mode", choices=STORAGE_MODES, default="int8"
+    )
+    parser.add_argument("--table", default="memories")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument(
+        "--no-backup",
+        action="store_true",
+        help="Skip the .bak copy",
+    )
+    args = parser.parse_args()
+    migrate(
+        args.db_path,
+        mode=args.mode,
+        table=args.table,
+        backup=not args.no_backup,
+        k=args.k,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,503 @@
+# custom_agents/streaming_asr.py
+"""
+流式语音识别：sherpa-onnx OnlineRecognizer + 端点检测
+
+现在的 sherpa_onnx_asr（SenseVoice 离线模型）要等前端 VAD 判定一句话说完、整段音频送到后才开始解码，
+PowerMemAgent.chat 又要等解码结束才能开始检索记忆。流式模式下：
+- 前端每送来一段麦克风音频（mic-audio-data）就立即喂给该客户端的在线识别流并解码，
+  识别器自己按尾部静音做端点检测，一句中间的停顿会把已确定的文本收进 segments；
+- 部分结果每增加 min_partial_chars 个字就交给 Agent.prefetch，记忆检索与用户说话同时进行；
+- 说话结束（mic-audio-end）后服务端照常调用 async_transcribe_np(整段音频)，
+  这里认出这段音频正是已经流式解码过的那一段，只需解码最后几百毫秒；
+  final_pass="offline" 时再用原来的离线模型解一遍，准确率不变，只省下检索的等待。
+对不上的音频（例如没有经过 mic-audio-data 的上传）仍交给原来的离线引擎。
+客户端断开或打断（interrupt-signal）时丢弃它正在识别的那段话。
+
+所有识别流在同一个解码线程里按到达顺序解码，不占用事件循环。
+"""
+
+import asyncio
+import inspect
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from loguru import logger
+
+from custom_agents.log_config import hot_log
+
+SAMPLE_RATE = 16000
+# 核对音频时比较的末尾样本数
+_TAIL = 160
+# 结束时补的静音，让模型输出最后一个字（sherpa-onnx 示例的做法）
+_TAIL_PADDING = 0.5
+
+
+def create_online_recognizer(
+    model_type: str = "transducer",
+    tokens: str = "",
+    encoder: str = "",
+    decoder: str = "",
+    joiner: str = "",
+    model: str = "",
+    num_threads: int = 2,
+    provider: str = "cpu",
+    decoding_method: str = "greedy_search",
+    hotwords_file: str = "",
+    hotwords_score: float = 1.5,
+    rule1_min_trailing_silence: float = 2.4,
+    rule2_min_trailing_silence: float = 0.8,
+    rule3_min_utterance_length: float = 20.0,
+):
+    """按 model_type 创建开启端点检测的 OnlineRecognizer"""
+    import sherpa_onnx
+
+    common = dict(
+        tokens=tokens,
+        num_threads=num_threads,
+        provider=provider,
+        decoding_method=decoding_method,
+        enable_endpoint_detection=True,
+        rule1_min_trailing_silence=rule1_min_trailing_silence,
+        rule2_min_trailing_silence=rule2_min_trailing_silence,
+        rule3_min_utterance_length=rule3_min_utterance_length,
+    )
+    if model_type == "transducer":
+        return sherpa_onnx.OnlineRecognizer.from_transducer(
+            encoder=encoder,
+            decoder=decoder,
+            joiner=joiner,
+            hotwords_file=hotwords_file,
+            hotwords_score=hotwords_score,
+            **common,
+        )
+    if model_type == "paraformer":
+        return sherpa_onnx.OnlineRecognizer.from_paraformer(
+            encoder=encoder, decoder=decoder, **common
+        )
+    if model_type == "zipformer2_ctc":
+        return sherpa_onnx.OnlineRecognizer.from_zipformer2_ctc(
+            model=model, **common
+        )
+    raise ValueError(
+        f"Unknown streaming ASR model_type: {model_type}"
+    )
+
+
+def _join(segments: list) -> str:
+    """拼接各段识别结果，英文单词之间补空格"""
+    text = ""
+    for segment in segments:
+        if (
+            text
+            and segment
+            and text[-1].isascii()
+            and text[-1].isalnum()
+            and segment[0].isascii()
+            and segment[0].isalnum()
+        ):
+            text += " "
+        text += segment
+    return text
+
+
+class StreamingUtterance:
+    """一个客户端正在说的一段话；accept / finish 只在解码线程中调用"""
+
+    def __init__(
+        self,
+        recognizer,
+        on_partial=None,
+        min_partial_chars: int = 2,
+    ):
+        self.recognizer = recognizer
+        self.stream = recognizer.create_stream()
+        self.on_partial = on_partial
+        self.min_partial_chars = min_partial_chars
+        self.segments: list = []
+        self.partial = ""
+        self.samples = 0
+        self.endpoints = 0
+        self.decode_seconds = 0.0
+        self._tail = np.empty(0, dtype=np.float32)
+        self._reported = 0
+
+    @property
+    def text(self) -> str:
+        return _join(self.segments + [self.partial])
+
+    def matches(self, audio: np.ndarray) -> bool:
+        """audio 是否正是喂进来的这段音频"""
+        return (
+            len(audio) == self.samples
+            and self.samples > 0
+            and np.array_equal(
+                audio[-len(self._tail) :], self._tail
+            )
+        )
+
+    def _decode(self):
+        recognizer = self.recognizer
+        while recognizer.is_ready(self.stream):
+            recognizer.decode_stream(self.stream)
+        self.partial = recognizer.get_result(self.stream)
+
+    def accept(self, samples: np.ndarray):
+        start = time.perf_counter()
+        self.stream.accept_waveform(SAMPLE_RATE, samples)
+        self.samples += len(samples)
+        self._tail = np.concatenate((self._tail, samples))[
+            -_TAIL:
+        ]
+        self._decode()
+        endpoint = self.recognizer.is_endpoint(self.stream)
+        if endpoint:
+            if self.partial:
+                self.segments.append(self.partial)
+                self.endpoints += 1
+            self.partial = ""
+            self.recognizer.reset(self.stream)
+        self.decode_seconds += time.perf_counter() - start
+
+        text = self.text
+        if self.on_partial is not None and (
+            len(text) - self._reported
+            >= self.min_partial_chars
+            or (endpoint and len(text) > self._reported)
+        ):
+            self._reported = len(text)
+            self.on_partial(text)
+
+    def finish(self) -> str:
+        """音频结束：补一段静音解码剩余部分，返回整段文本"""
+        start = time.perf_counter()
+        self.stream.accept_waveform(
+            SAMPLE_RATE,
+            np.zeros(
+                int(_TAIL_PADDING * SAMPLE_RATE),
+                dtype=np.float32,
+            ),
+        )
+        self.stream.input_finished()
+        self._decode()
+        self.decode_seconds += time.perf_counter() - start
+        return self.text
+
+
+class StreamingASREngine:
+    """ASR 引擎的代理：优先返回流式识别的结果，其余属性转发给原来的离线引擎"""
+
+    def __init__(
+        self,
+        fallback,
+        recognizer,
+        final_pass: str = "streaming",
+        min_partial_chars: int = 2,
+    ):
+        if final_pass not in ("streaming", "offline"):
+            raise ValueError(
+                f"Unknown final_pass: {final_pass}"
+            )
+        self._fallback = fallback
+        self.recognizer = recognizer
+        self.final_pass = final_pass
+        self.min_partial_chars = min_partial_chars
+        self._utterances: dict = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="streaming-asr",
+        )
+        self.streamed = 0
+        self.fallbacks = 0
+        self._finish_seconds = 0.0
+        self._audio_seconds = 0.0
+        self._decode_seconds = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self._fallback, name)
+
+    def feed(
+        self,
+        key,
+        samples: np.ndarray,
+        on_partial=None,
+        restart: bool = False,
+    ):
+        """在事件循环中调用：把一段音频交给 key 对应的识别流（restart 表示新的一句话开始）"""
+        if not len(samples):
+            return
+        utterance = self._utterances.get(key)
+        if utterance is None or restart:
+            callback = None
+            if on_partial is not None:
+                loop = asyncio.get_running_loop()
+
+                def callback(text):
+                    hot_log.debug(f"ASR partial: {text}")
+                    loop.call_soon_threadsafe(
+                        on_partial, text
+                    )
+
+            utterance = StreamingUtterance(
+                self.recognizer,
+                callback,
+                self.min_partial_chars,
+            )
+            self._utterances[key] = utterance
+        self._executor.submit(
+            utterance.accept, samples
+        ).add_done_callback(_log_failure)
+
+    def discard(self, key):
+        """丢弃 key 的识别流（客户端断开或打断时），不再等它的音频"""
+        self._utterances.pop(key, None)
+
+    def _match(self, audio: np.ndarray):
+        for key, utterance in list(
+            self._utterances.items()
+        ):
+            if utterance.matches(audio):
+                del self._utterances[key]
+                return utterance
+        return None
+
+    def _finish(
+        self, utterance: StreamingUtterance, audio
+    ) -> str:
+        start = time.perf_counter()
+        text = utterance.finish()
+        self.streamed += 1
+        self._finish_seconds += time.perf_counter() - start
+        self._audio_seconds += len(audio) / SAMPLE_RATE
+        self._decode_seconds += utterance.decode_seconds
+        hot_log.info(
+            f"Streaming ASR: '{text}' ({utterance.endpoints} endpoint(s), "
+            f"tail decode {(time.perf_counter() - start) * 1000:.0f}ms); {self.stats()}"
+        )
+        return text
+
+    def _decode_whole(self, audio: np.ndarray) -> str:
+        utterance = StreamingUtterance(self.recognizer)
+        utterance.accept(audio)
+        return utterance.finish()
+
+    async def async_transcribe_np(
+        self, audio: np.ndarray
+    ) -> str:
+        audio = np.asarray(audio, dtype=np.float32)
+        # 排在解码线程里尚未处理的音频之后核对
+        utterance = await asyncio.wrap_future(
+            self._executor.submit(self._match, audio)
+        )
+        if utterance is None:
+            self.fallbacks += 1
+            if self._fallback is not None:
+                return await self._fallback.async_transcribe_np(
+                    audio
+                )
+            return await asyncio.wrap_future(
+                self._executor.submit(
+                    self._decode_whole, audio
+                )
+            )
+        text = await asyncio.wrap_future(
+            self._executor.submit(
+                self._finish, utterance, audio
+            )
+        )
+        if (
+            self.final_pass == "offline"
+            and self._fallback is not None
+        ):
+            return await self._fallback.async_transcribe_np(
+                audio
+            )
+        return text
+
+    def transcribe_np(self, audio: np.ndarray) -> str:
+        audio = np.asarray(audio, dtype=np.float32)
+        utterance = self._executor.submit(
+            self._match, audio
+        ).result()
+        if utterance is not None:
+            text = self._executor.submit(
+                self._finish, utterance, audio
+            ).result()
+            if (
+                self.final_pass == "streaming"
+                or self._fallback is None
+            ):
+                return text
+        else:
+            self.fallbacks += 1
+        if self._fallback is not None:
+            return self._fallback.transcribe_np(audio)
+        return self._executor.submit(
+            self._decode_whole, audio
+        ).result()
+
+    def stats(self) -> str:
+        rtf = (
+            self._decode_seconds / self._audio_seconds
+            if self._audio_seconds
+            else 0.0
+        )
+        finish = (
+            self._finish_seconds / self.streamed * 1000
+            if self.streamed
+            else 0.0
+        )
+        return (
+            f"streamed={self.streamed} fallbacks={self.fallbacks} "
+            f"rtf={rtf:.3f} tail_decode={finish:.0f}ms"
+        )
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.error(
+            f"Streaming ASR decode failed: {future.exception()}"
+        )
+
+
+_RECOGNIZERS: dict = {}
+_LOCK = threading.Lock()
+
+
+def shared_recognizer(options: dict):
+    """同一组模型参数只加载一次（切换角色时服务端会重新创建 ASR 引擎）"""
+    key = json.dumps(options, sort_keys=True)
+    with _LOCK:
+        recognizer = _RECOGNIZERS.get(key)
+        if recognizer is None:
+            start = time.perf_counter()
+            recognizer = _RECOGNIZERS[key] = (
+                create_online_recognizer(**options)
+            )
+            logger.info(
+                f"Loaded streaming ASR model ({options.get('model_type', 'transducer')}) "
+                f"in {time.perf_counter() - start:.2f}s"
+            )
+        return recognizer
+
+
+def install_streaming_asr(options: dict) -> bool:
+    """包装 Open-LLM-VTuber 的 ASRFactory 和麦克风音频处理，之后创建的 ASR 引擎都带流式识别"""
+    try:
+        from open_llm_vtuber.asr.asr_factory import (
+            ASRFactory,
+        )
+        from open_llm_vtuber.websocket_handler import (
+            WebSocketHandler,
+        )
+    except ImportError as e:
+        logger.warning(f"Streaming ASR disabled: {e}")
+        return False
+    options = dict(options)
+    final_pass = options.pop("final_pass", "streaming")
+    min_partial_chars = options.pop("min_partial_chars", 2)
+    original_factory = ASRFactory.get_asr_system
+
+    def get_asr_system(system_name, **kwargs):
+        engine = original_factory(system_name, **kwargs)
+        logger.info(
+            f"Streaming ASR enabled in front of {system_name} "
+            f"(final pass: {final_pass})"
+        )
+        return StreamingASREngine(
+            engine,
+            shared_recognizer(options),
+            final_pass=final_pass,
+            min_partial_chars=min_partial_chars,
+        )
+
+    ASRFactory.get_asr_system = staticmethod(get_asr_system)
+
+    original_audio = WebSocketHandler._handle_audio_data
+
+    async def _handle_audio_data(
+        self, websocket, client_uid, data
+    ):
+        result = original_audio(
+            self, websocket, client_uid, data
+        )
+        if inspect.isawaitable(result):
+            await result
+        context = self.client_contexts.get(client_uid)
+        engine = getattr(context, "asr_engine", None)
+        if not isinstance(engine, StreamingASREngine):
+            return
+        samples = np.asarray(
+            data.get("audio") or [], dtype=np.float32
+        )
+        # 缓冲区只剩这一段，说明上一句已经处理完或被丢弃
+        buffer = self.received_data_buffers.get(client_uid)
+        agent = getattr(context, "agent_engine", None)
+        engine.feed(
+            client_uid,
+            samples,
+            on_partial=getattr(agent, "prefetch", None),
+            restart=buffer is not None
+            and len(buffer) == len(samples),
+        )
+
+    WebSocketHandler._handle_audio_data = _handle_audio_data
+    # 客户端断开或打断（interrupt-signal）后，这句话的音频不会再交给 async_transcribe_np
+    for name in ("handle_disconnect", "_handle_interrupt"):
+        _discard_after(WebSocketHandler, name)
+    return True
+
+
+def _discard_after(handler_class, name: str):
+    """包装 WebSocketHandler 的方法：调用后丢弃该客户端的识别流（会话上下文在调用前取出，断开时它会被删掉）"""
+    original = getattr(handler_class, name, None)
+    if original is None:
+        logger.warning(
+            f"WebSocketHandler.{name} not found, "
+            "streaming ASR state is not discarded on it"
+        )
+        return
+
+    async def wrapper(self, *args, **kwargs):
+        # handle_disconnect(client_uid) / _handle_interrupt(websocket, client_uid, data)
+        client_uid = kwargs.get(
+            "client_uid",
+            args[0 if name == "handle_disconnect" else 1],
+        )
+        context = self.client_contexts.get(client_uid)
+        try:
+            result = original(self, *args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        finally:
+            engine = getattr(context, "asr_engine", None)
+            if isinstance(engine, StreamingASREngine):
+                engine.discard(client_uid)
+
+    setattr(handler_class, name, wrapper)
+
+
+def install_from_config(config_path) -> bool:
+    """main.py 调用：按 conf.yaml 中 Agent 设置的 streaming_asr_config 决定是否启用"""
+    import yaml
+
+    from custom_agents.warmup import AGENT_KEY
+
+    with open(config_path, encoding="utf-8") as f:
+        conf = yaml.safe_load(f)
+    character = conf.get("character_config", {})
+    settings = (
+        character.get("agent_config", {})
+        .get("agent_settings", {})
+        .get(AGENT_KEY)
+        or {}
+    )
+    options = dict(
+        settings.get("streaming_asr_config") or {}
+    )
+    if not options.pop("enabled", False):
+        return False
+    return install_streaming_asr(options)
@@ -0,0 +1,138 @@
+# custom_agents/tag_engine.py
+import re
+from typing import Iterable, Optional
+
+from loguru import logger
+
+# 未在 conf.yaml 中配置 memory_tag_keywords 时使用的默认规则
+DEFAULT_TAG_KEYWORDS = {
+    "need_comfort": ["难过", "伤心", "不开心", "郁闷"],
+    "user_identity": ["名字", "我叫", "我是"],
+    "preference": ["喜欢", "爱", "讨厌"],
+}
+
+
+def _trie_pattern(keywords: Iterable[str]) -> str:
+    """把关键词构造成前缀树形状的正则，同一位置只需沿共同前缀比较一次
+
+    节点本身是关键词且还有更长的分支时，用贪婪的可选组，保证优先匹配最长的关键词。
+    """
+    trie: dict = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        terminal = "" in node
+        branches = [
+            re.escape(char) + build(child)
+            for char, child in sorted(node.items())
+            if char
+        ]
+        if not branches:
+            return ""
+        body = (
+            branches[0]
+            if len(branches) == 1
+            else "(?:" + "|".join(branches) + ")"
+        )
+        if terminal:
+            body = (
+                f"(?:{body})?"
+                if len(branches) == 1
+                else body + "?"
+            )
+        return body
+
+    return build(trie)
+
+
+class TagEngine:
+    """多模式关键词标签匹配：所有标签的关键词编译成一个前缀树正则，一次扫描得到全部标签
+
+    正则用零宽前瞻在每个位置尝试匹配，每个位置只会命中最长的关键词；因此构建时给每个关键词预先合并
+    “被它包含的其他关键词”的标签，结果与逐个关键词做子串判断完全一致。
+    """
+
+    def __init__(self, tag_keywords: Optional[dict] = None):
+        tag_keywords = (
+            DEFAULT_TAG_KEYWORDS
+            if tag_keywords is None
+            else tag_keywords
+        )
+        self.tag_order = list(tag_keywords)
+        direct: dict = {}
+        for tag, keywords in tag_keywords.items():
+            for keyword in keywords or []:
+                keyword = str(keyword).lower()
+                if keyword:
+                    direct.setdefault(keyword, set()).add(
+                        tag
+                    )
+
+        self._keyword_tags = {}
+        for keyword in direct:
+            tags = set()
+            for other, other_tags in direct.items():
+                if other in keyword:
+                    tags |= other_tags
+            self._keyword_tags[keyword] = frozenset(tags)
+
+        self.max_keyword_len = max(
+            (len(k) for k in direct), default=0
+        )
+        if direct:
+            self._pattern = re.compile(
+                f"(?=({_trie_pattern(direct)}))",
+                re.IGNORECASE,
+            )
+        else:
+            self._pattern = None
+        logger.debug(
+            f"Tag engine compiled {len(direct)} keywords for {len(self.tag_order)} tags"
+        )
+
+    def match(self, text: str) -> set:
+        """返回文本命中的标签集合"""
+        found = set()
+        if not text or self._pattern is None:
+            return found
+        for keyword in set(self._pattern.findall(text)):
+            found |= self._keyword_tags[keyword.lower()]
+        return found
+
+    def ordered(self, tags: Iterable[str]) -> list:
+        """按配置中的顺序输出标签"""
+        tags = set(tags)
+        return [t for t in self.tag_order if t in tags]
+
+    def tags(self, *texts: str) -> list:
+        found = set()
+        for text in texts:
+            found |= self.match(text)
+        return self.ordered(found)
+
+    def scanner(self) -> "TagScanner":
+        return TagScanner(self)
+
+
+class TagScanner:
+    """流式扫描：逐段喂入 LLM 输出，跨段的关键词通过保留上一段末尾若干字符来匹配"""
+
+    def __init__(self, engine: TagEngine):
+        self.engine = engine
+        self.found: set = set()
+        self._tail = ""
+
+    def feed(self, chunk: str):
+        if not chunk:
+            return
+        text = self._tail + chunk
+        self.found |= self.engine.match(text)
+        keep = self.engine.max_keyword_len - 1
+        self._tail = text[-keep:] if keep > 0 else ""
+
+    def tags(self) -> list:
+        return self.engine.ordered(self.found)
@@ -0,0 +1,193 @@
+# custom_agents/tracing.py
+import contextvars
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional
+
+from loguru import logger
+
+from custom_agents.metrics import RollingStats
+
+# 当前轮次的追踪对象；asyncio 任务和 asyncio.to_thread 都会继承它
+_current_trace: contextvars.ContextVar = (
+    contextvars.ContextVar("current_trace", default=None)
+)
+
+
+class TurnTrace:
+    """一轮对话的耗时记录，时间全部取自 time.perf_counter()
+
+    spans：某个阶段的累计耗时（同名阶段多次出现时相加，如多次 embedding）；
+    marks：某个事件相对本轮开始的时刻，只记录第一次（如首个 token）。
+    """
+
+    def __init__(self, turn_id: int):
+        self.turn_id = turn_id
+        self.started = time.perf_counter()
+        self.spans: dict = {}
+        self.marks: dict = {}
+        self.pending_write = False
+
+    def add_span(self, name: str, seconds: float):
+        self.spans[name] = (
+            self.spans.get(name, 0.0) + seconds
+        )
+
+    def mark(self, name: str):
+        if name not in self.marks:
+            self.marks[name] = (
+                time.perf_counter() - self.started
+            )
+
+    def to_dict(self) -> dict:
+        return {
+            "turn": self.turn_id,
+            "spans_ms": {
+                k: round(v * 1000, 2)
+                for k, v in self.spans.items()
+            },
+            "marks_ms": {
+                k: round(v * 1000, 2)
+                for k, v in self.marks.items()
+            },
+        }
+
+
+def current_trace() -> Optional[TurnTrace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str):
+    """把代码块的耗时记到当前轮次上；不在追踪中时几乎没有开销"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, time.perf_counter() - start)
+
+
+def mark(name: str):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.mark(name)
+
+
+class Tracer:
+    """按轮次收集追踪数据，结束时输出一行 JSON（经 loguru extra）并更新滑动分位数
+
+    需要等待后台记忆写入的轮次先挂起，写入完成（complete）后再输出；
+    挂起的轮次最多保留 max_pending 个，超出时最早的一个直接输出。
+    """
+
+    def __init__(
+        self, summary_every: int = 20, max_pending: int = 64
+    ):
+        self.summary_every = summary_every
+        self.max_pending = max_pending
+        self.stats: dict = {}
+        self._pending: OrderedDict = OrderedDict()
+        self._next_id = 0
+        self._finished = 0
+        self._lock = threading.Lock()
+
+    def start_turn(self) -> TurnTrace:
+        with self._lock:
+            self._next_id += 1
+            trace = TurnTrace(self._next_id)
+        _current_trace.set(trace)
+        return trace
+
+    def finish_turn(self, trace: TurnTrace):
+        """对话输出结束；本轮提交了记忆写入（pending_write）时等写入完成后再导出"""
+        trace.mark("turn_end")
+        if _current_trace.get() is trace:
+            _current_trace.set(None)
+        if not trace.pending_write:
+            self._export(trace)
+            return
+        with self._lock:
+            self._pending[trace.turn_id] = trace
+            evicted = None
+            if len(self._pending) > self.max_pending:
+                _, evicted = self._pending.popitem(
+                    last=False
+                )
+        if evicted is not None:
+            self._export(evicted)
+
+    def complete(self, turn_id: Optional[int], name: str):
+        """后台任务完成时调用（如记忆写入），记录时刻并导出该轮"""
+        if turn_id is None:
+            return
+        with self._lock:
+            trace = self._pending.pop(turn_id, None)
+        if trace is None:
+            return
+        trace.mark(name)
+        self._export(trace)
+
+    def _export(self, trace: TurnTrace):
+        for name, value in trace.spans.items():
+            self._stat(name).add(value)
+        for name, value in trace.marks.items():
+            self._stat(name).add(value)
+        logger.bind(
+            trace=json.dumps(trace.to_dict())
+        ).debug(f"Turn {trace.turn_id} trace")
+        with self._lock:
+            self._finished += 1
+            report = (
+                self.summary_every > 0
+                and self._finished % self.summary_every == 0
+            )
+        if report:
+            self.log_summary()
+
+    def _stat(self, name: str) -> RollingStats:
+        stat = self.stats.get(name)
+        if stat is None:
+            stat = self.stats.setdefault(
+                name, RollingStats()
+            )
+        return stat
+
+    def summary(self) -> dict:
+        return {
+            name: stat.summary()
+            for name, stat in sorted(self.stats.items())
+        }
+
+    def log_summary(self):
+        lines = [
+            f"  {name:<16} {stat.format()}"
+            for name, stat in sorted(self.stats.items())
+        ]
+        logger.info(
+            "Turn latency summary:\n" + "\n".join(lines)
+        )
+
+
+def mark_first_item(obj, attr: str, name: str) -> bool:
+    """包装 obj 上返回异步生成器的方法，在产出第一个元素时记录 name 时刻"""
+    method = getattr(obj, attr, None)
+    if method is None:
+        return False
+
+    async def traced(*args, **kwargs):
+        first = True
+        async for item in method(*args, **kwargs):
+            if first:
+                first = False
+                mark(name)
+            yield item
+
+    setattr(obj, attr, traced)
+    return True
@@ -0,0 +1,563 @@
+# custom_agents/tts_cache.py
+"""
+句子级 TTS 音频缓存与流水线合成
+
+Kristina 的回复里有大量重复的短句和语气词（“嘿嘿”“我在这儿啦！”），每句却都要交给
+tts_model 重新合成。这里在 Open-LLM-VTuber 创建 TTS 引擎时包一层：
+- 按 (引擎, 引擎配置, 归一化句子) 的哈希在磁盘上缓存合成好的音频，总大小超过 max_mb 时
+  按最近使用时间淘汰（命中时更新文件 mtime，重启后沿用同一顺序）；
+- 启动时从 chat_history/ 统计 AI 回复中出现最多的句子，在后台线程里预先合成；
+- Agent 每产出一句就调用本会话 TTS 引擎的 prefetch，未命中的句子立即进入合成池，与 LLM 后续的流式输出并行；
+  会话上下文创建好 TTS 引擎和 Agent 后，把引擎交给 Agent（attach_tts_engine），预取只进入本会话的合成池；
+  合成池最多同时合成 workers 句，按提交顺序开始；服务端按原顺序取音频时，
+  已在合成的句子直接等待同一个任务，不会重复合成。
+
+服务端发送完音频会删除引擎返回的文件，所以命中时返回的是缓存文件的硬链接（不支持时复制）。
+缓存目录不能放在 cache/ 下：run_server.py 启动时会清空它。
+"""
+
+import asyncio
+import hashlib
+import inspect
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import unicodedata
+import uuid
+from collections import Counter, OrderedDict
+from pathlib import Path
+
+from loguru import logger
+
+from custom_agents.log_config import hot_log
+
+
+def normalize_sentence(text: str) -> str:
+    """缓存键用的句子文本：全半角统一、压缩空白；标点影响语调，保留"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return " ".join(text.split())
+
+
+class AudioCache:
+    """内容寻址的磁盘音频缓存，按总字节数做 LRU 淘汰"""
+
+    def __init__(self, directory: str, max_mb: float = 200):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        # 按 mtime 恢复上次的使用顺序；中断留下的临时文件直接删除
+        files = []
+        for path in self.directory.iterdir():
+            if path.name.endswith(".tmp"):
+                path.unlink(missing_ok=True)
+            elif path.is_file():
+                stat = path.stat()
+                files.append(
+                    (stat.st_mtime, path, stat.st_size)
+                )
+        for _, path, size in sorted(files):
+            self._entries[path.stem] = (path, size)
+            self._bytes += size
+        self._evict()
+
+    @staticmethod
+    def key(engine: str, voice: str, text: str) -> str:
+        return hashlib.blake2b(
+            f"{engine}\n{voice}\n{normalize_sentence(text)}".encode(
+                "utf-8"
+            ),
+            digest_size=16,
+        ).hexdigest()
+
+    def __contains__(self, digest: str) -> bool:
+        with self._lock:
+            return digest in self._entries
+
+    def get(self, digest: str, count: bool = True):
+        """返回缓存文件路径，未命中返回 None；count 为 False 时不计入命中率"""
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None or not entry[0].exists():
+                if entry is not None:
+                    del self._entries[digest]
+                    self._bytes -= entry[1]
+                self.misses += count
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += count
+        try:
+            os.utime(entry[0])
+        except OSError:
+            pass
+        return entry[0]
+
+    def put(self, digest: str, source) -> Path:
+        """把合成好的音频移入缓存（原文件被移走），返回缓存文件路径"""
+        source = Path(source)
+        target = self.directory / f"{digest}{source.suffix}"
+        tmp = target.with_name(target.name + ".tmp")
+        shutil.move(str(source), tmp)
+        os.replace(tmp, target)
+        size = target.stat().st_size
+        with self._lock:
+            old = self._entries.pop(digest, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[digest] = (target, size)
+            self._bytes += size
+            self._evict()
+        return target
+
+    def _evict(self):
+        # 刚写入的一条即使单独超过上限也保留，避免立即被删掉
+        while (
+            self._bytes > self.max_bytes
+            and len(self._entries) > 1
+        ):
+            _, (path, size) = self._entries.popitem(
+                last=False
+            )
+            self._bytes -= size
+            self.evicted += 1
+            path.unlink(missing_ok=True)
+
+    def stats(self) -> str:
+        with self._lock:
+            total = self.hits + self.misses
+            return (
+                f"hits={self.hits} misses={self.misses} "
+                f"hit_rate={self.hits / total if total else 0:.1%} "
+                f"entries={len(self._entries)} "
+                f"size={self._bytes / 1024 / 1024:.1f}MB evicted={self.evicted}"
+            )
+
+
+class SynthesisPool:
+    """同一引擎配置下的缓存与合成任务；同一句话同一时间只合成一次"""
+
+    def __init__(
+        self,
+        engine,
+        engine_name: str,
+        voice: str,
+        cache: AudioCache,
+        workers: int = 2,
+        max_pending: int = 16,
+    ):
+        self.engine = engine
+        self.engine_name = engine_name
+        self.voice = voice
+        self.cache = cache
+        self.max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(workers)
+        self._pending: dict = {}
+        self.prefetched = 0
+        self.prefetch_hits = 0
+        self.synthesized = 0
+        # 调用方等到音频的耗时：命中缓存 / 等待预取中的合成 / 现场合成
+        self._wait = {
+            "hit": [0, 0.0],
+            "prefetch": [0, 0.0],
+            "miss": [0, 0.0],
+        }
+
+    def digest(self, text: str) -> str:
+        return AudioCache.key(
+            self.engine_name, self.voice, text
+        )
+
+    async def _synthesize(self, text: str, digest: str):
+        # asyncio.Semaphore 按等待顺序放行，先提交的句子先开始合成
+        async with self._semaphore:
+            cached = self.cache.get(digest, count=False)
+            if cached is not None:
+                return cached
+            path = await self.engine.async_generate_audio(
+                text,
+                f"tts_{digest[:16]}_{uuid.uuid4().hex[:8]}",
+            )
+            self.synthesized += 1
+            return await asyncio.to_thread(
+                self.cache.put, digest, path
+            )
+
+    def _submit(self, text: str, digest: str):
+        task = self._pending.get(digest)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._synthesize(text, digest)
+            )
+            self._pending[digest] = task
+            task.add_done_callback(
+                lambda _: self._pending.pop(digest, None)
+            )
+        return task
+
+    def prefetch(self, text: str) -> bool:
+        """在事件循环中调用：句子未缓存时立即开始合成，返回是否提交了新任务"""
+        if not normalize_sentence(text):
+            return False
+        digest = self.digest(text)
+        if (
+            digest in self._pending
+            or digest in self.cache
+            or len(self._pending) >= self.max_pending
+        ):
+            return False
+        self._submit(text, digest).add_done_callback(
+            _log_failure
+        )
+        self.prefetched += 1
+        return True
+
+    async def audio(self, text: str):
+        """返回这句话的缓存音频路径（命中、等待进行中的合成或新合成）"""
+        start = time.perf_counter()
+        digest = self.digest(text)
+        path = self.cache.get(digest)
+        kind = "hit"
+        if path is None:
+            task = self._pending.get(digest)
+            if task is not None:
+                kind = "prefetch"
+                self.prefetch_hits += 1
+            else:
+                kind = "miss"
+                task = self._submit(text, digest)
+            path = await asyncio.shield(task)
+        count, total = self._wait[kind]
+        self._wait[kind] = [
+            count + 1,
+            total + time.perf_counter() - start,
+        ]
+        return path
+
+    def stats(self) -> str:
+        waits = " ".join(
+            f"{kind}_wait={total / count * 1000:.0f}ms"
+            for kind, (count, total) in self._wait.items()
+            if count
+        )
+        return (
+            f"{self.engine_name}: {self.cache.stats()} "
+            f"prefetched={self.prefetched} prefetch_hits={self.prefetch_hits} "
+            f"synthesized={self.synthesized} {waits}"
+        ).rstrip()
+
+
+def _log_failure(task):
+    if not task.cancelled() and task.exception():
+        logger.warning(
+            f"TTS prefetch failed: {task.exception()}"
+        )
+
+
+class CachedTTSEngine:
+    """TTS 引擎的代理：生成音频先查缓存，其余属性原样转发给真实引擎"""
+
+    def __init__(self, engine, pool: SynthesisPool):
+        self._engine = engine
+        self._pool = pool
+
+    def __getattr__(self, name):
+        return getattr(self._engine, name)
+
+    def prefetch(self, text: str) -> bool:
+        """在事件循环中调用：这句话交给本引擎的合成池提前合成"""
+        return self._pool.prefetch(text)
+
+    def _checkout(
+        self, cached: Path, file_name_no_ext
+    ) -> str:
+        """给调用方一份可以随意删除的文件：缓存文件的硬链接，不支持时复制"""
+        name = (
+            file_name_no_ext or f"temp_{uuid.uuid4().hex}"
+        )
+        make_name = getattr(
+            self._engine, "generate_cache_file_name", None
+        )
+        if make_name is not None:
+            target = make_name(
+                name, cached.suffix.lstrip(".")
+            )
+        else:
+            os.makedirs("cache", exist_ok=True)
+            target = os.path.join(
+                "cache", f"{name}{cached.suffix}"
+            )
+        if os.path.exists(target):
+            os.remove(target)
+        try:
+            os.link(cached, target)
+        except OSError:
+            shutil.copyfile(cached, target)
+        return target
+
+    async def async_generate_audio(
+        self, text: str, file_name_no_ext=None
+    ) -> str:
+        if not normalize_sentence(text):
+            return await self._engine.async_generate_audio(
+                text, file_name_no_ext
+            )
+        cached = await self._pool.audio(text)
+        self._maybe_log()
+        return self._checkout(cached, file_name_no_ext)
+
+    def generate_audio(
+        self, text: str, file_name_no_ext=None
+    ) -> str:
+        digest = self._pool.digest(text)
+        cached = self._pool.cache.get(digest)
+        if cached is None:
+            path = self._engine.generate_audio(
+                text, file_name_no_ext
+            )
+            if not normalize_sentence(text):
+                return path
+            self._pool.synthesized += 1
+            cached = self._pool.cache.put(digest, path)
+        return self._checkout(cached, file_name_no_ext)
+
+    def _maybe_log(self):
+        cache = self._pool.cache
+        if (cache.hits + cache.misses) % 20 == 0:
+            hot_log.info(f"TTS cache {self._pool.stats()}")
+
+
+def frequent_sentences(
+    history_dir: str, limit: int = 100, min_count: int = 3
+) -> list:
+    """统计 chat_history 中 AI 回复里出现最多的句子（去掉表情标签和括号里的动作描写）"""
+    counts = Counter()
+    for path in Path(history_dir).rglob("*.json"):
+        try:
+            messages = json.loads(
+                path.read_text(encoding="utf-8")
+            )
+        except (OSError, ValueError):
+            continue
+        for message in messages:
+            if (
+                not isinstance(message, dict)
+                or message.get("role") != "ai"
+            ):
+                continue
+            text = _STAGE.sub(
+                "", message.get("content", "")
+            )
+            for sentence in _SENTENCE.findall(text):
+                sentence = normalize_sentence(sentence)
+                if sentence:
+                    counts[sentence] += 1
+    return [
+        sentence
+        for sentence, count in counts.most_common(limit)
+        if count >= min_count
+    ]
+
+
+# 与 tts_preprocessor_config 的默认行为一致：方括号表情、括号里的动作和 * 号内容不读出来
+_STAGE = re.compile(
+    r"\[[^\]]*\]|\([^)]*\)|（[^）]*）|\*[^*]*\*"
+)
+_SENTENCE = re.compile(r"[^。！？!?~～…\n]+[。！？!?~～…]*")
+
+_POOLS: dict = {}
+_CACHES: dict = {}
+_LOCK = threading.Lock()
+
+
+def _freeze(value) -> str:
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def _warm(
+    pool: SynthesisPool, sentences: list, delay: float
+):
+    """在后台线程中逐句合成高频句子（用引擎的同步接口，不占用事件循环）"""
+    time.sleep(delay)
+    start, done = time.perf_counter(), 0
+    for sentence in sentences:
+        digest = pool.digest(sentence)
+        if digest in pool.cache:
+            continue
+        try:
+            path = pool.engine.generate_audio(
+                sentence, f"tts_warm_{digest[:16]}"
+            )
+            pool.cache.put(digest, path)
+            done += 1
+        except Exception as e:
+            logger.warning(
+                f"TTS cache warm-up stopped: {e}"
+            )
+            break
+    logger.info(
+        f"TTS cache warmed {done}/{len(sentences)} frequent sentence(s) "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+
+
+def wrap_engine(
+    engine,
+    engine_name: str,
+    engine_config: dict,
+    directory: str = "tts_cache",
+    max_mb: float = 200,
+    workers: int = 2,
+    max_pending: int = 16,
+    warm_history_dir: str = "chat_history",
+    warm_sentences: int = 100,
+    warm_min_count: int = 3,
+    warm_delay: float = 10.0,
+) -> CachedTTSEngine:
+    """给新建的 TTS 引擎加上缓存；相同引擎配置的会话共用同一个合成池"""
+    voice = _freeze(engine_config)
+    with _LOCK:
+        cache = _CACHES.get(directory)
+        if cache is None:
+            cache = _CACHES[directory] = AudioCache(
+                directory, max_mb
+            )
+        key = (engine_name, voice)
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = _POOLS[key] = SynthesisPool(
+                engine,
+                engine_name,
+                voice,
+                cache,
+                workers=workers,
+                max_pending=max_pending,
+            )
+            if warm_history_dir and warm_sentences:
+                sentences = frequent_sentences(
+                    warm_history_dir,
+                    warm_sentences,
+                    warm_min_count,
+                )
+                if sentences:
+                    # 推迟一会儿再开始，避开启动时的模型加载
+                    threading.Thread(
+                        target=_warm,
+                        args=(pool, sentences, warm_delay),
+                        name="tts-cache-warm",
+                        daemon=True,
+                    ).start()
+    return CachedTTSEngine(engine, pool)
+
+
+def install_tts_cache(options: dict) -> bool:
+    """包装 Open-LLM-VTuber 的 TTSFactory，之后创建的 TTS 引擎都带缓存"""
+    try:
+        from open_llm_vtuber.tts.tts_factory import (
+            TTSFactory,
+        )
+    except ImportError as e:
+        logger.warning(f"TTS cache disabled: {e}")
+        return False
+    original = TTSFactory.get_tts_engine
+
+    def get_tts_engine(engine_type, **kwargs):
+        engine = original(engine_type, **kwargs)
+        logger.info(f"TTS cache enabled for {engine_type}")
+        return wrap_engine(
+            engine, engine_type, kwargs, **options
+        )
+
+    TTSFactory.get_tts_engine = staticmethod(get_tts_engine)
+    _link_sessions()
+    return True
+
+
+def _attach(context):
+    """把会话的 TTS 引擎交给同一会话的 Agent，Agent 逐句预取时只用这个引擎"""
+    engine = getattr(context, "tts_engine", None)
+    attach = getattr(
+        getattr(context, "agent_engine", None),
+        "attach_tts_engine",
+        None,
+    )
+    if attach is not None and isinstance(
+        engine, CachedTTSEngine
+    ):
+        attach(engine)
+
+
+def _link_sessions():
+    """包装 ServiceContext 创建 TTS 引擎和 Agent 的方法，两者谁后创建都会重新关联"""
+    try:
+        from open_llm_vtuber.service_context import (
+            ServiceContext,
+        )
+    except ImportError as e:
+        logger.warning(
+            f"TTS prefetch not linked to sessions: {e}"
+        )
+        return
+    for name in ("init_tts", "init_agent"):
+        original = getattr(ServiceContext, name, None)
+        if original is None:
+            logger.warning(
+                f"ServiceContext.{name} not found, TTS prefetch may stay off"
+            )
+            continue
+        if inspect.iscoroutinefunction(original):
+
+            async def wrapper(
+                self, *args, _original=original, **kwargs
+            ):
+                result = await _original(
+                    self, *args, **kwargs
+                )
+                _attach(self)
+                return result
+
+        else:
+
+            def wrapper(
+                self, *args, _original=original, **kwargs
+            ):
+                result = _original(self, *args, **kwargs)
+                _attach(self)
+                return result
+
+        setattr(ServiceContext, name, wrapper)
+
+
+def install_from_config(config_path) -> bool:
+    """main.py 调用：按 conf.yaml 中 Agent 设置的 tts_cache_config 决定是否启用"""
+    import yaml
+
+    from custom_agents.warmup import AGENT_KEY
+
+    with open(config_path, encoding="utf-8") as f:
+        conf = yaml.safe_load(f)
+    settings = (
+        conf.get("character_config", {})
+        .get("agent_config", {})
+        .get("agent_settings", {})
+        .get(AGENT_KEY)
+        or {}
+    )
+    options = dict(settings.get("tts_cache_config") or {})
+    # prefetch 由 Agent 读取
+    options.pop("prefetch", None)
+    if not options.pop("enabled", False):
+        return False
+    return install_tts_cache(options)
+
+
+def tts_cache_stats() -> list:
+    return [pool.stats() for pool in list(_POOLS.values())]
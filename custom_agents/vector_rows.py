@@ -0,0 +1,156 @@
+# custom_agents/vector_rows.py
+"""直接读取 PowerMem SQLite 向量库中的行（向量与 payload）
+
+PowerMem 的 SQLiteVectorStore 把向量和 payload 以 JSON 文本存在同一张表里，
+这里的辅助函数供 ANN 索引、重排序等需要批量拿到向量的模块共用。
+向量列也可能是 QuantizedSQLiteVectorStore 写入的紧凑二进制格式：
+  b"h" + float16 向量
+  b"q" + float32 缩放系数 + int8 码
+"""
+
+import json
+from typing import Iterable, Optional
+
+import numpy as np
+
+
+def _rows(store, sql: str, params: tuple = ()) -> list:
+    with store._lock:
+        return store.connection.execute(
+            sql, params
+        ).fetchall()
+
+
+def _in_clause(ids: list) -> str:
+    return ",".join("?" * len(ids))
+
+
+def encode_vector(vector, mode: str) -> bytes:
+    """把向量编码为紧凑的二进制格式（mode 为 "float16" 或 "int8"）"""
+    vector = np.asarray(vector, dtype=np.float32)
+    if mode == "float16":
+        return b"h" + vector.astype(np.float16).tobytes()
+    if mode == "int8":
+        scale = float(np.abs(vector).max()) / 127 or 1.0
+        codes = np.round(vector / scale).astype(np.int8)
+        return (
+            b"q"
+            + np.float32(scale).tobytes()
+            + codes.tobytes()
+        )
+    raise ValueError(f"Unknown vector encoding: {mode}")
+
+
+def decode_vector(value) -> np.ndarray:
+    """把库里存的一列向量解码为 float32 数组（int8 格式会反量化）"""
+    if isinstance(value, str):
+        return np.asarray(
+            json.loads(value), dtype=np.float32
+        )
+    value = bytes(value)
+    if value[:1] == b"h":
+        return np.frombuffer(
+            value[1:], dtype=np.float16
+        ).astype(np.float32)
+    if value[:1] == b"q":
+        scale = np.frombuffer(value[1:5], dtype=np.float32)[
+            0
+        ]
+        codes = np.frombuffer(value[5:], dtype=np.int8)
+        return codes.astype(np.float32) * scale
+    raise ValueError("Unknown vector encoding in database")
+
+
+def fetch_vectors(
+    store, ids: Optional[Iterable[int]] = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """读取向量，返回 (ids, 矩阵)；ids 为 None 时读取整张表"""
+    table = store.collection_name
+    if ids is None:
+        rows = _rows(
+            store, f"SELECT id, vector FROM {table}"
+        )
+    else:
+        ids = [int(i) for i in ids]
+        if not ids:
+            rows = []
+        else:
+            rows = _rows(
+                store,
+                f"SELECT id, vector FROM {table} "
+                f"WHERE id IN ({_in_clause(ids)})",
+                tuple(ids),
+            )
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(
+            (0, 0), dtype=np.float32
+        )
+    row_ids = np.fromiter(
+        (row[0] for row in rows),
+        dtype=np.int64,
+        count=len(rows),
+    )
+    matrix = np.stack(
+        [decode_vector(row[1]) for row in rows]
+    )
+    return row_ids, matrix
+
+
+def fetch_ids(store) -> np.ndarray:
+    rows = _rows(
+        store, f"SELECT id FROM {store.collection_name}"
+    )
+    return np.fromiter(
+        (row[0] for row in rows),
+        dtype=np.int64,
+        count=len(rows),
+    )
+
+
+def payload_to_result(
+    memory_id: int, payload: dict, score: float
+) -> dict:
+    """把 payload 转成与 PowerMem 检索结果相同格式的字典"""
+    return {
+        "id": memory_id,
+        "memory": payload.get("data", ""),
+        "created_at": payload.get("created_at"),
+        "updated_at": payload.get("updated_at"),
+        "score": float(score),
+        "user_id": payload.get("user_id"),
+        "metadata": payload.get("metadata") or {},
+    }
+
+
+def fetch_memories(
+    store,
+    scored: list,
+    user_id: Optional[str] = None,
+) -> list:
+    """按 [(id, score), ...] 的顺序读取记忆，返回 PowerMem 格式的结果列表"""
+    if not scored:
+        return []
+    ids = [int(memory_id) for memory_id, _ in scored]
+    rows = _rows(
+        store,
+        f"SELECT id, payload FROM {store.collection_name} "
+        f"WHERE id IN ({_in_clause(ids)})",
+        tuple(ids),
+    )
+    payloads = {row[0]: json.loads(row[1]) for row in rows}
+    results = []
+    for memory_id, score in scored:
+        payload = payloads.get(int(memory_id))
+        if payload is None:
+            continue
+        if (
+            user_id is not None
+            and payload.get("user_id") != user_id
+        ):
+            continue
+        results.append(
+            payload_to_result(
+                int(memory_id), payload, score
+            )
+        )
+    return results
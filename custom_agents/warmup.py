@@ -0,0 +1,485 @@
+# custom_agents/warmup.py
+"""
+快速启动：启动阶段计时、导入耗时统计、延迟导入和并行预热
+
+main.py --fast-start 时：
+- 未选用的重型后端（torch、llama_cpp 等）改为延迟导入，真正用到时才执行模块代码；
+- 在后台线程中并行预热：让 Ollama 预先加载对话模型和嵌入模型、把记忆库和
+  sherpa-onnx 模型文件读进系统页缓存，与 run_server.py 的导入同时进行；
+- 记录每个阶段距进程启动的耗时和按顶层包统计的导入耗时，
+  Agent 初始化完成且预热结束时输出汇总（即“可以开始对话”的时间）。
+
+预热线程只做网络和磁盘 IO，不导入模块，避免与主线程的导入互相等待。
+"""
+
+import builtins
+import importlib.util
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from loguru import logger
+
+# 默认延迟导入的重型后端：只在对应的提供商被选用时才需要
+DEFAULT_DEFERRED_IMPORTS = (
+    "anthropic",
+    "groq",
+    "hume",
+    "letta_client",
+    "llama_cpp",
+    "mistralai",
+    "torch",
+    "transformers",
+    "zhipuai",
+)
+AGENT_KEY = "custom_agents.powermem_agent.PowerMemAgent"
+
+
+class StartupTimeline:
+    """记录各启动阶段完成时距进程启动的秒数"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: list = []
+        self._lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def mark(self, name: str) -> float:
+        elapsed = self.elapsed()
+        with self._lock:
+            self.phases.append((name, elapsed))
+        logger.debug(
+            f"Startup phase '{name}' at {elapsed:.2f}s"
+        )
+        return elapsed
+
+    def format(self) -> str:
+        with self._lock:
+            phases = sorted(self.phases, key=lambda p: p[1])
+        return ", ".join(
+            f"{name}={elapsed:.2f}s"
+            for name, elapsed in phases
+        )
+
+
+class ImportTimer:
+    """包装 builtins.__import__，按顶层包统计导入的自身耗时（不含其中嵌套导入的其他包）"""
+
+    def __init__(self):
+        self.totals: dict = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._original = None
+
+    def install(self):
+        if self._original is None:
+            self._original = builtins.__import__
+            builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self._original is not None:
+            builtins.__import__ = self._original
+            self._original = None
+
+    def _import(
+        self,
+        name,
+        globals=None,
+        locals=None,
+        fromlist=(),
+        level=0,
+    ):
+        original = self._original
+        if level == 0 and name in sys.modules:
+            return original(
+                name, globals, locals, fromlist, level
+            )
+        if level:
+            package = (globals or {}).get(
+                "__package__"
+            ) or ""
+            top = package.partition(".")[0]
+        else:
+            top = name.partition(".")[0]
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return original(
+                name, globals, locals, fromlist, level
+            )
+        finally:
+            elapsed = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self._lock:
+                self.totals[top] = (
+                    self.totals.get(top, 0.0)
+                    + elapsed
+                    - children
+                )
+
+    def top(self, n: int = 10) -> list:
+        with self._lock:
+            totals = sorted(
+                self.totals.items(),
+                key=lambda item: item[1],
+                reverse=True,
+            )
+        return totals[:n]
+
+    def format(self, n: int = 10) -> str:
+        return ", ".join(
+            f"{name}={seconds * 1000:.0f}ms"
+            for name, seconds in self.top(n)
+        )
+
+
+def defer_imports(names=DEFAULT_DEFERRED_IMPORTS) -> list:
+    """把尚未导入的模块注册为延迟模块：import 语句立即返回，首次访问属性时才执行
+
+    `from x import y` 会立即访问属性，因此只对 `import x` 形式的导入有效。
+    """
+    deferred = []
+    for name in names:
+        if name in sys.modules:
+            continue
+        try:
+            spec = importlib.util.find_spec(name)
+        except (ImportError, ValueError):
+            continue
+        if spec is None or spec.loader is None:
+            continue
+        if not hasattr(spec.loader, "exec_module"):
+            continue
+        spec.loader = importlib.util.LazyLoader(spec.loader)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+        deferred.append(name)
+    return deferred
+
+
+def _read_through(path: Path, block: int = 1 << 20) -> int:
+    """顺序读完文件，让它进入系统页缓存"""
+    size = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(block):
+            size += len(chunk)
+    return size
+
+
+class WarmUp:
+    """在后台线程中并行执行的预热任务"""
+
+    def __init__(
+        self,
+        timeline: StartupTimeline,
+        llm: dict = None,
+        embedder: dict = None,
+        memory_db: str = None,
+        asr_files: list = None,
+        http_config: dict = None,
+        max_workers: int = 4,
+    ):
+        self.timeline = timeline
+        self.llm = llm
+        self.embedder = embedder
+        self.memory_db = memory_db
+        self.asr_files = asr_files or []
+        self.http_config = http_config or {}
+        self.results: dict = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="warmup",
+        )
+        self._futures: list = []
+        self._done = threading.Event()
+
+    @classmethod
+    def from_config(
+        cls, config_path: Path, timeline: StartupTimeline
+    ) -> "WarmUp":
+        """从 conf.yaml 读取要预热的模型、记忆库和 ASR 模型文件"""
+        import yaml
+
+        with open(config_path, encoding="utf-8") as f:
+            conf = yaml.safe_load(f)
+        character = conf.get("character_config", {})
+        agent_config = character.get("agent_config", {})
+        settings = (
+            agent_config.get("agent_settings", {}).get(
+                AGENT_KEY
+            )
+            or {}
+        )
+        root = Path(config_path).parent
+
+        llm = None
+        provider = settings.get("llm_provider", "")
+        llm_settings = (
+            agent_config.get("llm_configs", {}).get(
+                provider
+            )
+            or {}
+        )
+        if "ollama" in provider and llm_settings.get(
+            "model"
+        ):
+            llm = {
+                "base_url": llm_settings.get(
+                    "base_url", "http://localhost:11434"
+                )
+                .rstrip("/")
+                .removesuffix("/v1"),
+                "model": llm_settings["model"],
+                "keep_alive": llm_settings.get(
+                    "keep_alive", -1
+                ),
+            }
+
+        embed = settings.get("powermem_embed_config") or {}
+        embedder = None
+        if embed.get("provider", "ollama") == "ollama":
+            embedder = {
+                "base_url": embed.get(
+                    "base_url", "http://localhost:11434"
+                ),
+                "model": embed.get(
+                    "model", "nomic-embed-text"
+                ),
+            }
+
+        memory_db = None
+        if settings:
+            memory_db = str(
+                root
+                / settings.get(
+                    "powermem_data_dir", "./powermem_data"
+                )
+                / f"{settings.get('powermem_user_id', 'kristina_default')}_memory.db"
+            )
+
+        asr_files = []
+        asr = character.get("asr_config", {})
+        if asr.get("asr_model") == "sherpa_onnx_asr":
+            for key, value in (
+                asr.get("sherpa_onnx_asr") or {}
+            ).items():
+                if isinstance(
+                    value, str
+                ) and value.endswith((".onnx", ".txt")):
+                    asr_files.append(root / value)
+        streaming = (
+            settings.get("streaming_asr_config") or {}
+        )
+        if streaming.get("enabled"):
+            for value in streaming.values():
+                if isinstance(
+                    value, str
+                ) and value.endswith((".onnx", ".txt")):
+                    asr_files.append(root / value)
+
+        http_config = dict(
+            settings.get("ollama_http_config") or {}
+        )
+        http_config.pop("enabled", None)
+        return cls(
+            timeline,
+            llm=llm,
+            embedder=embedder,
+            memory_db=memory_db,
+            asr_files=asr_files,
+            http_config=http_config,
+        )
+
+    # ---- 预热任务 ----
+
+    def _client(self, base_url: str):
+        # 用 Agent 之后也会使用的共享连接池，预热时建立的连接可以直接复用；
+        # 在主线程中创建（会导入 httpx 并创建 SSL 上下文）
+        from custom_agents.http_pool import get_pool
+
+        return get_pool(
+            base_url, **self.http_config
+        ).client(base_url=base_url)
+
+    def _warm_llm(self, client) -> str:
+        # 不带 prompt 的 generate 请求只加载模型
+        with client:
+            client.post(
+                "/api/generate",
+                json={
+                    "model": self.llm["model"],
+                    "keep_alive": self.llm["keep_alive"],
+                },
+            ).raise_for_status()
+        return self.llm["model"]
+
+    def _warm_embedder(self, client) -> str:
+        with client:
+            client.post(
+                "/api/embed",
+                json={
+                    "model": self.embedder["model"],
+                    "input": "warm up",
+                },
+            ).raise_for_status()
+        return self.embedder["model"]
+
+    def _warm_memory_db(self) -> str:
+        if not os.path.exists(self.memory_db):
+            return "no database yet"
+        size = _read_through(Path(self.memory_db))
+        conn = sqlite3.connect(self.memory_db)
+        try:
+            rows = conn.execute(
+                "SELECT COUNT(*) FROM memories"
+            ).fetchone()[0]
+        except sqlite3.Error:
+            rows = 0
+        finally:
+            conn.close()
+        return f"{rows} memories, {size / 1024:.0f} KB"
+
+    def _warm_asr(self) -> str:
+        size = sum(
+            _read_through(path)
+            for path in self.asr_files
+            if path.exists()
+        )
+        return f"{size / 1024 / 1024:.0f} MB of model files"
+
+    def _run(self, name: str, task):
+        start = time.perf_counter()
+        try:
+            detail = task()
+            self.results[name] = time.perf_counter() - start
+            self.timeline.mark(f"warm_{name}")
+            logger.info(
+                f"Warm-up '{name}' done in {self.results[name]:.2f}s ({detail})"
+            )
+        except Exception as e:
+            self.results[name] = None
+            logger.warning(f"Warm-up '{name}' failed: {e}")
+
+    def start(self):
+        tasks = {}
+        if self.llm:
+            client = self._client(self.llm["base_url"])
+            tasks["llm"] = lambda: self._warm_llm(client)
+        if self.embedder:
+            embed_client = self._client(
+                self.embedder["base_url"]
+            )
+            tasks["embedder"] = lambda: self._warm_embedder(
+                embed_client
+            )
+        if self.memory_db:
+            tasks["memory_db"] = self._warm_memory_db
+        if self.asr_files:
+            tasks["asr"] = self._warm_asr
+        for name, task in tasks.items():
+            self._futures.append(
+                self._executor.submit(self._run, name, task)
+            )
+        threading.Thread(
+            target=self._wait,
+            name="warmup-wait",
+            daemon=True,
+        ).start()
+        logger.info(
+            f"Warming up in background: {', '.join(tasks) or 'nothing to do'}"
+        )
+
+    def _wait(self):
+        for future in self._futures:
+            future.result()
+        self._executor.shutdown(wait=False)
+        self.timeline.mark("warm_up_done")
+        self._done.set()
+        _report_if_ready()
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+
+_timeline = None
+_import_timer = None
+_warmup = None
+_agent_ready = False
+_reported = False
+_report_lock = threading.Lock()
+
+
+def begin_fast_start(
+    config_path: Path,
+    started: float = None,
+    deferred=DEFAULT_DEFERRED_IMPORTS,
+) -> StartupTimeline:
+    """main.py 调用：开始计时导入、注册延迟导入并启动预热
+
+    started 为进程启动时的 time.perf_counter()，各阶段耗时从这里算起。
+    """
+    global _timeline, _import_timer, _warmup
+    _timeline = StartupTimeline()
+    if started is not None:
+        _timeline.started = started
+    _import_timer = ImportTimer()
+    _import_timer.install()
+    names = defer_imports(deferred)
+    if names:
+        logger.debug(
+            f"Deferred imports: {', '.join(names)}"
+        )
+    _timeline.mark("deferred_imports")
+    try:
+        _warmup = WarmUp.from_config(config_path, _timeline)
+        _warmup.start()
+    except Exception as e:
+        logger.warning(f"Warm-up skipped: {e}")
+    _timeline.mark("warm_up_started")
+    return _timeline
+
+
+def startup_phase(name: str):
+    """记录一个启动阶段；未使用 --fast-start 时什么也不做"""
+    global _agent_ready
+    if _timeline is None:
+        return
+    _timeline.mark(name)
+    if name == "agent_ready":
+        _agent_ready = True
+        _report_if_ready()
+
+
+def _report_if_ready():
+    """Agent 已就绪且预热结束时输出一次启动汇总"""
+    global _reported
+    if _timeline is None or not _agent_ready:
+        return
+    if _warmup is not None and not _warmup.done:
+        return
+    with _report_lock:
+        if _reported:
+            return
+        _reported = True
+    logger.info(
+        f"Ready to talk {_timeline.elapsed():.2f}s after launch"
+    )
+    logger.info(f"Startup phases: {_timeline.format()}")
+    if _import_timer is not None:
+        logger.info(
+            f"Slowest imports: {_import_timer.format()}"
+        )
+        _import_timer.uninstall()
@@ -0,0 +1,252 @@
+# custom_agents/write_gate.py
+"""
+记忆写入前的廉价预筛：决定一轮对话是交给 PowerMem 抽取（store）、并入已有记忆（merge）还是跳过（skip）
+
+PowerMem 的 memory.add 每次都要用对话模型做一遍事实抽取，“嗯”“hi”这样的寒暄、
+和刚说过一模一样的话也不例外。预筛按代价从低到高依次检查，任何一步都不调用 LLM：
+  1. 内容哈希：与最近 recent_hashes 次成功写入完全相同（归一化后）的对话直接跳过；
+     哈希在写入成功后才记录（record），写入失败的对话重试时不会被当成重复；
+  2. 寒暄：用户这句话整句只由语气词和标点组成（“嗯嗯”“哈哈”“ok”）、也没有命中任何标签的跳过；
+     短而有信息的话（“我叫李”“好冷”）照常写入；
+  3. 合并（默认关闭，merge_similarity 为 0）：把这轮对话嵌入一次，与库中最新的
+     recent_memories 条记忆比较，只有余弦相似度达到 merge_similarity、且用户这句话与那条记忆的
+     文字相似度达到 merge_text_similarity（同一内容，而不只是同一话题）时才并入那条记忆
+     （标签取并集、时间更新为本轮、merged 计数加一，与记忆整理的合并规则一致），不再抽取；
+  4. 其余照常写入。
+被跳过或并入的对话按最近实际抽取的平均耗时估算省下的 LLM 时间。
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Optional
+
+import numpy as np
+
+from custom_agents.memory_cache import (
+    is_filler,
+    normalize_query,
+    text_similarity,
+)
+from custom_agents.vector_rows import fetch_vectors
+
+
+@dataclass
+class GateDecision:
+    action: str  # "store" / "merge" / "skip"
+    reason: str
+    digest: str = ""
+    target_id: Optional[int] = None
+    similarity: float = 0.0
+
+
+class WriteGate:
+    def __init__(
+        self,
+        store,
+        embed: Callable[[str], list],
+        recent_hashes: int = 256,
+        recent_memories: int = 64,
+        merge_similarity: float = 0.0,
+        merge_text_similarity: float = 0.6,
+    ):
+        self.store = store
+        self.embed = embed
+        self.recent_hashes = recent_hashes
+        self.recent_memories = recent_memories
+        self.merge_similarity = merge_similarity
+        self.merge_text_similarity = merge_text_similarity
+        self._hashes: OrderedDict = OrderedDict()
+        self._recent_ids: list = []
+        self._matrix_ids = np.empty(0, dtype=np.int64)
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._lock = threading.Lock()
+
+        self.counts = {
+            "store": 0,
+            "merge": 0,
+            "repeat": 0,
+            "filler": 0,
+        }
+        self.avoided = 0
+        self._seconds_per_item = 0.0
+
+    @staticmethod
+    def _digest(user_input: str, response: str) -> str:
+        text = (
+            normalize_query(user_input)
+            + "\n"
+            + normalize_query(response)
+        )
+        return hashlib.blake2b(
+            text.encode("utf-8"), digest_size=16
+        ).hexdigest()
+
+    def record(self, decision: GateDecision):
+        """本轮已成功写入（或并入）后调用，之后完全相同的对话才会被当成重复跳过"""
+        with self._lock:
+            self._hashes[decision.digest] = None
+            self._hashes.move_to_end(decision.digest)
+            while len(self._hashes) > self.recent_hashes:
+                self._hashes.popitem(last=False)
+
+    def _recent(self) -> tuple:
+        """库中最新的若干条记忆（id 与归一化向量），id 没变时复用上次读取的结果"""
+        table = self.store.collection_name
+        with self.store._lock:
+            ids = [
+                row[0]
+                for row in self.store.connection.execute(
+                    f"SELECT id FROM {table} ORDER BY id DESC LIMIT ?",
+                    (self.recent_memories,),
+                )
+            ]
+        if ids != self._recent_ids:
+            row_ids, matrix = fetch_vectors(self.store, ids)
+            if len(row_ids):
+                norms = np.linalg.norm(
+                    matrix, axis=1, keepdims=True
+                )
+                matrix = matrix / np.where(
+                    norms == 0, 1, norms
+                )
+            self._recent_ids = ids
+            self._matrix_ids, self._matrix = row_ids, matrix
+        return self._matrix_ids, self._matrix
+
+    def check(
+        self, user_input: str, response: str, tags: list
+    ) -> GateDecision:
+        """判断一轮对话如何写入（可能请求一次嵌入，应在后台线程调用）"""
+        digest = self._digest(user_input, response)
+        with self._lock:
+            if digest in self._hashes:
+                self.counts["repeat"] += 1
+                self.avoided += 1
+                return GateDecision(
+                    "skip", "exact repeat", digest
+                )
+            if not tags and is_filler(user_input):
+                self.counts["filler"] += 1
+                self.avoided += 1
+                return GateDecision(
+                    "skip", "filler", digest
+                )
+
+        target = (
+            self._same_content(user_input, response)
+            if self.merge_similarity > 0
+            else None
+        )
+        if target is not None:
+            with self._lock:
+                self.counts["merge"] += 1
+                self.avoided += 1
+            return GateDecision(
+                "merge",
+                "same content",
+                digest,
+                target_id=target[0],
+                similarity=target[1],
+            )
+        with self._lock:
+            self.counts["store"] += 1
+        return GateDecision(
+            "store", "new information", digest
+        )
+
+    def _same_content(
+        self, user_input: str, response: str
+    ) -> Optional[tuple]:
+        """与本轮内容相同的最近一条记忆 (id, 余弦相似度)：向量足够接近只说明话题相同，
+        还要求用户这句话与记忆文字本身相近"""
+        ids, matrix = self._recent()
+        if len(ids) and matrix.shape[1]:
+            vector = np.asarray(
+                self.embed(
+                    f"用户说：{user_input}\n你回答：{response}"
+                ),
+                dtype=np.float32,
+            )
+            if vector.shape[0] == matrix.shape[1]:
+                scores = matrix @ (
+                    vector / (np.linalg.norm(vector) or 1.0)
+                )
+                best = int(np.argmax(scores))
+                if scores[best] >= self.merge_similarity:
+                    record = self.store.get(int(ids[best]))
+                    data = (
+                        (record.payload or {}).get("data")
+                        if record is not None
+                        else None
+                    )
+                    if (
+                        data
+                        and text_similarity(
+                            user_input, data
+                        )
+                        >= self.merge_text_similarity
+                    ):
+                        return int(ids[best]), float(
+                            scores[best]
+                        )
+        return None
+
+    def merge(
+        self,
+        decision: GateDecision,
+        tags: list,
+        timestamp: str,
+    ) -> bool:
+        """把本轮并入 decision.target_id 对应的记忆；该记忆已不存在时返回 False"""
+        record = self.store.get(decision.target_id)
+        if record is None:
+            # 目标刚被整理删除，改为正常写入
+            with self._lock:
+                self.counts["merge"] -= 1
+                self.counts["store"] += 1
+                self.avoided -= 1
+            return False
+        payload = dict(record.payload or {})
+        metadata = dict(payload.get("metadata") or {})
+        merged_tags = list(metadata.get("tags") or [])
+        for tag in tags:
+            if tag not in merged_tags:
+                merged_tags.append(tag)
+        metadata["tags"] = merged_tags
+        metadata["merged"] = metadata.get("merged", 1) + 1
+        metadata["timestamp"] = timestamp
+        payload["metadata"] = metadata
+        payload["updated_at"] = (
+            datetime.now().astimezone().isoformat()
+        )
+        self.store.update(
+            decision.target_id, payload=payload
+        )
+        return True
+
+    def record_extraction(self, seconds: float, items: int):
+        """记录一次实际抽取的耗时，用来估算跳过的对话省下的时间"""
+        per_item = seconds / max(items, 1)
+        with self._lock:
+            self._seconds_per_item = (
+                per_item
+                if not self._seconds_per_item
+                else 0.8 * self._seconds_per_item
+                + 0.2 * per_item
+            )
+
+    @property
+    def avoided_seconds(self) -> float:
+        return self.avoided * self._seconds_per_item
+
+    def stats(self) -> str:
+        return (
+            f"stored={self.counts['store']} merged={self.counts['merge']} "
+            f"skipped={self.counts['repeat'] + self.counts['filler']} "
+            f"(repeat={self.counts['repeat']} filler={self.counts['filler']}); "
+            f"extraction avoided for {self.avoided} interaction(s), "
+            f"~{self.avoided_seconds:.1f}s of LLM time"
+        )
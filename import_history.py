@@ -0,0 +1,443 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+从 chat_history/<conf_uid>/*.json 批量回填长期记忆
+按与 PowerMemAgent._add_message 相同的方式把用户输入和随后的回复配成一条对话记忆，
+批量请求 Ollama 生成向量（有上限的线程池），按块在单个事务中写入用户的记忆库。
+不经过 LLM 抽取事实，所以重建整个记忆库只需要几秒到几十秒。
+
+已导入的会话按文件 SHA-256 记录在检查点文件中，再次运行时跳过；
+中途中断后重新运行即可继续，已写入的记录按内容哈希去重，不会重复。
+导入时请先关闭 Kristina，避免与运行中的 Agent 同时写库。
+
+用法（项目根目录）：
+    uv run python import_history.py
+    uv run python import_history.py --conf-uid mao_pro_001 --batch-size 64 --workers 4
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import yaml
+from loguru import logger
+
+PROJECT_ROOT = Path(__file__).parent.absolute()
+AGENT_KEY = "custom_agents.powermem_agent.PowerMemAgent"
+
+
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def pair_turns(records: list):
+    """与 _add_message 一致：用户消息暂存，下一条 AI 回复与之配对"""
+    last_user = None
+    for record in records:
+        content = (record.get("content") or "").strip()
+        if not content:
+            continue
+        if record.get("role") == "human":
+            last_user = content
+        elif (
+            record.get("role") == "ai"
+            and last_user is not None
+        ):
+            yield last_user, content, record.get(
+                "timestamp"
+            )
+            last_user = None
+
+
+def _utc_iso(timestamp: str) -> str:
+    moment = (
+        datetime.fromisoformat(timestamp)
+        if timestamp
+        else datetime.now()
+    )
+    return moment.astimezone(timezone.utc).isoformat()
+
+
+def build_payload(
+    user_input: str,
+    response: str,
+    timestamp: str,
+    user_id: str,
+    tags: list,
+    session: str,
+) -> dict:
+    """与 PowerMem infer=False 写入的 payload 结构一致"""
+    content = f"用户说：{user_input}\n你回答：{response}"
+    created_at = _utc_iso(timestamp)
+    return {
+        "data": content,
+        "user_id": user_id,
+        "agent_id": None,
+        "run_id": None,
+        "actor_id": "",
+        "hash": hashlib.md5(
+            content.encode("utf-8")
+        ).hexdigest(),
+        "created_at": created_at,
+        "updated_at": created_at,
+        "category": "",
+        "fulltext_content": content,
+        "metadata": {
+            "type": "conversation",
+            "tags": tags,
+            "timestamp": timestamp
+            or datetime.now().isoformat(),
+            "source": "import",
+            "session": session,
+        },
+    }
+
+
+class Checkpoint:
+    """记录已完整导入的会话文件哈希（原子替换写入）"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.sessions: dict = {}
+        if path.exists():
+            with open(path, encoding="utf-8") as f:
+                self.sessions = json.load(f).get(
+                    "sessions", {}
+                )
+
+    def __contains__(self, digest: str) -> bool:
+        return digest in self.sessions
+
+    def mark(self, digest: str, name: str):
+        self.sessions[digest] = name
+
+    def save(self):
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                {"sessions": self.sessions},
+                f,
+                ensure_ascii=False,
+                indent=1,
+            )
+        os.replace(tmp, self.path)
+
+
+def iter_sessions(
+    history_dir: Path, checkpoint: Checkpoint
+):
+    """逐个读取会话文件，跳过检查点中已导入的"""
+    for path in sorted(history_dir.glob("*.json")):
+        digest = file_hash(path)
+        if digest in checkpoint:
+            yield path, digest, None
+            continue
+        try:
+            with open(path, encoding="utf-8") as f:
+                records = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(
+                f"Skipping unreadable {path.name}: {e}"
+            )
+            continue
+        yield path, digest, list(pair_turns(records))
+
+
+def load_agent_settings(config_path: Path) -> tuple:
+    with open(config_path, encoding="utf-8") as f:
+        conf = yaml.safe_load(f)
+    character = conf.get("character_config", {})
+    settings = (
+        character.get("agent_config", {})
+        .get("agent_settings", {})
+        .get(AGENT_KEY, {})
+    )
+    return character.get("conf_uid", ""), settings or {}
+
+
+def open_store(db_path: str, storage: str):
+    from powermem.storage.sqlite.sqlite_vector_store import (
+        SQLiteVectorStore,
+    )
+
+    if storage == "json":
+        return SQLiteVectorStore(db_path)
+    from custom_agents.quantized_store import (
+        QuantizedSQLiteVectorStore,
+    )
+
+    return QuantizedSQLiteVectorStore(db_path, mode=storage)
+
+
+def existing_hashes(store, user_id: str) -> set:
+    with store._lock:
+        rows = store.connection.execute(
+            f"SELECT json_extract(payload, '$.hash') FROM {store.collection_name} "
+            "WHERE json_extract(payload, '$.user_id') = ?",
+            (user_id,),
+        ).fetchall()
+    return {row[0] for row in rows if row[0]}
+
+
+def run_import(args) -> dict:
+    from ollama import Client
+
+    from custom_agents.tag_engine import TagEngine
+
+    conf_uid, settings = load_agent_settings(
+        Path(args.config)
+    )
+    conf_uid = args.conf_uid or conf_uid
+    user_id = args.user_id or settings.get(
+        "powermem_user_id", "kristina_default"
+    )
+    # 未指定时与运行中的 Agent 一样相对项目根目录解析
+    data_dir = (
+        Path(args.data_dir)
+        if args.data_dir
+        else PROJECT_ROOT
+        / settings.get(
+            "powermem_data_dir", "./powermem_data"
+        )
+    )
+    embed_config = (
+        settings.get("powermem_embed_config") or {}
+    )
+    storage = settings.get("memory_vector_storage", "json")
+    history_dir = (
+        Path(args.history_dir)
+        if args.history_dir
+        else PROJECT_ROOT / "chat_history" / conf_uid
+    )
+    data_dir.mkdir(parents=True, exist_ok=True)
+    db_path = str(data_dir / f"{user_id}_memory.db")
+    checkpoint = Checkpoint(
+        Path(args.checkpoint)
+        if args.checkpoint
+        else data_dir / f"{user_id}_import.json"
+    )
+
+    logger.info(
+        f"Importing {history_dir} into {db_path} (user '{user_id}', {storage} vectors)"
+    )
+    client = Client(
+        host=embed_config.get(
+            "base_url", "http://localhost:11434"
+        )
+    )
+    model = embed_config.get("model", "nomic-embed-text")
+    tag_engine = TagEngine(
+        settings.get("memory_tag_keywords")
+    )
+    store = open_store(db_path, storage)
+    known = existing_hashes(store, user_id)
+
+    stats = {
+        "sessions": 0,
+        "skipped_sessions": 0,
+        "records": 0,
+        "duplicates": 0,
+        "embed_seconds": 0.0,
+    }
+
+    stats_lock = threading.Lock()
+
+    def embed(batch: list) -> list:
+        start = time.perf_counter()
+        response = client.embed(
+            model=model,
+            input=[payload["data"] for payload in batch],
+        )
+        with stats_lock:
+            stats["embed_seconds"] += (
+                time.perf_counter() - start
+            )
+        return response["embeddings"]
+
+    def batches():
+        """产出 (payloads, 在这一批结束的会话)；同一会话内的记录保持顺序"""
+        batch, finished = [], []
+        for path, digest, pairs in iter_sessions(
+            history_dir, checkpoint
+        ):
+            if pairs is None:
+                stats["skipped_sessions"] += 1
+                continue
+            stats["sessions"] += 1
+            for user_input, response, timestamp in pairs:
+                payload = build_payload(
+                    user_input,
+                    response,
+                    timestamp,
+                    user_id,
+                    tag_engine.tags(user_input, response),
+                    path.name,
+                )
+                if payload["hash"] in known:
+                    stats["duplicates"] += 1
+                    continue
+                known.add(payload["hash"])
+                batch.append(payload)
+                if len(batch) >= args.batch_size:
+                    yield batch, finished
+                    batch, finished = [], []
+            finished.append((digest, path.name))
+        if batch or finished:
+            yield batch, finished
+
+    pending_vectors, pending_payloads, pending_sessions = (
+        [],
+        [],
+        [],
+    )
+
+    def commit():
+        # 一块记录在一个事务里写入（SQLiteVectorStore.insert 末尾统一 commit）
+        if pending_payloads and not args.dry_run:
+            store.insert(pending_vectors, pending_payloads)
+        stats["records"] += len(pending_payloads)
+        if not args.dry_run:
+            for digest, name in pending_sessions:
+                checkpoint.mark(digest, name)
+            checkpoint.save()
+        logger.debug(
+            f"Committed {len(pending_payloads)} records, "
+            f"{len(pending_sessions)} session(s) completed"
+        )
+        pending_vectors.clear()
+        pending_payloads.clear()
+        pending_sessions.clear()
+
+    start = time.perf_counter()
+    # 有上限的流水线：最多 workers × 2 个批次在途，结果按提交顺序写库
+    inflight: deque = deque()
+    with ThreadPoolExecutor(
+        max_workers=args.workers
+    ) as pool:
+        for batch, finished in batches():
+            future = (
+                pool.submit(embed, batch) if batch else None
+            )
+            inflight.append((future, batch, finished))
+            while len(inflight) >= args.workers * 2:
+                _collect(
+                    inflight.popleft(),
+                    pending_vectors,
+                    pending_payloads,
+                    pending_sessions,
+                )
+                if len(pending_payloads) >= args.chunk_size:
+                    commit()
+        while inflight:
+            _collect(
+                inflight.popleft(),
+                pending_vectors,
+                pending_payloads,
+                pending_sessions,
+            )
+            if len(pending_payloads) >= args.chunk_size:
+                commit()
+    commit()
+    store.close()
+
+    elapsed = time.perf_counter() - start
+    stats["seconds"] = elapsed
+    stats["records_per_sec"] = (
+        stats["records"] / elapsed if elapsed else 0.0
+    )
+    return stats
+
+
+def _collect(
+    entry, vectors: list, payloads: list, sessions: list
+):
+    future, batch, finished = entry
+    if future is not None:
+        vectors.extend(future.result())
+        payloads.extend(batch)
+    sessions.extend(finished)
+
+
+def main():
+    logger.remove()
+    parser = argparse.ArgumentParser(
+        description="Backfill PowerMem long-term memory from chat history"
+    )
+    parser.add_argument(
+        "--config", default=str(PROJECT_ROOT / "conf.yaml")
+    )
+    parser.add_argument(
+        "--conf-uid",
+        help="defaults to character_config.conf_uid",
+    )
+    parser.add_argument(
+        "--history-dir",
+        help="defaults to chat_history/<conf_uid>",
+    )
+    parser.add_argument(
+        "--user-id", help="defaults to powermem_user_id"
+    )
+    parser.add_argument(
+        "--data-dir", help="defaults to powermem_data_dir"
+    )
+    parser.add_argument(
+        "--checkpoint",
+        help="defaults to <data_dir>/<user>_import.json",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=64,
+        help="texts per embedding request",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="concurrent embedding requests",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=512,
+        help="records per transaction",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="embed but do not write",
+    )
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logger.add(
+        sys.stderr,
+        level="DEBUG" if args.verbose else "INFO",
+    )
+    if str(PROJECT_ROOT) not in sys.path:
+        sys.path.insert(0, str(PROJECT_ROOT))
+
+    stats = run_import(args)
+    logger.info(
+        f"Imported {stats['records']} records from {stats['sessions']} session(s) "
+        f"in {stats['seconds']:.2f}s ({stats['records_per_sec']:.1f} records/sec, "
+        f"embedding {stats['embed_seconds']:.2f}s across workers); "
+        f"skipped {stats['skipped_sessions']} imported session(s) "
+        f"and {stats['duplicates']} duplicate record(s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -5,38 +5,35 @@ Kristina 项目启动脚本
 设置 Python 路径，创建资源符号链接/复制，然后执行 Open-LLM-VTuber 的 run_server.py。
 工作目录保持在项目根目录，确保 conf.yaml 被正确读取。
 使用 loguru 统一日志风格，并将命令行参数透明传递给子脚本。
+--log-mode production：日志经后台线程写入，按大小轮转、压缩、定期清理，热路径 DEBUG 日志限流。
+--fast-start：延迟导入未选用的重型后端，并在后台并行预热 Ollama 模型、记忆库和 ASR 模型，
+输出各启动阶段与导入耗时（见 custom_agents/warmup.py）。
 """
 
 import sys, time
 import os, argparse
+import asyncio
+import inspect
 import shutil
 from pathlib import Path
 import runpy
 from loguru import logger
 
+LAUNCH_TIME = time.perf_counter()
+
 # 获取当前脚本所在目录，即项目根目录
 PROJECT_ROOT = Path(__file__).parent.absolute()
 SUBMODULE_ROOT = PROJECT_ROOT / "Open-LLM-VTuber"
 
 
-def init_logger(console_log_level: str = "INFO") -> None:
-    logger.remove()
-    # Console output
-    logger.add(
-        sys.stderr,
-        level=console_log_level,
-        format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> | {message}",
-        colorize=True,
-    )
+def init_logger(
+    console_log_level: str = "INFO",
+    log_mode: str = "debug",
+) -> None:
+    # "debug" 每次启动一个同步写入的 DEBUG 日志文件；"production" 见 custom_agents/log_config.py
+    from custom_agents.log_config import configure_logging
 
-    # File output
-    logger.add(
-        f"logs/debug_{time.time()}.log",
-        level="DEBUG",
-        format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <8} | {name}:{function}:{line} | {message} | {extra}",
-        backtrace=True,
-        diagnose=True,
-    )
+    configure_logging(console_log_level, log_mode)
 
 
 # 需要从子仓库链接到项目根目录的目录和文件列表（相对于子仓库根目录）
@@ -107,6 +104,66 @@ def setup_resources():
     return all_success
 
 
+def flush_memory_agents():
+    """退出前刷写 PowerMemAgent 尚未写入的记忆（未加载该模块时跳过）"""
+    module = sys.modules.get("custom_agents.powermem_agent")
+    if module is None:
+        return
+    try:
+        asyncio.run(module.aclose_all())
+    except Exception as e:
+        logger.error(
+            f"Failed to flush pending memories: {e}"
+        )
+
+
+def install_session_end_hook() -> bool:
+    """客户端断开时关闭该会话的 Agent：刷写尚未写入的记忆并归还记忆分片
+    （Open-LLM-VTuber 断开时只丢弃会话上下文，不会通知 Agent）"""
+    try:
+        from open_llm_vtuber.websocket_handler import (
+            WebSocketHandler,
+        )
+    except ImportError as e:
+        logger.warning(
+            f"Session end hook not installed: {e}"
+        )
+        return False
+    original = getattr(
+        WebSocketHandler, "handle_disconnect", None
+    )
+    if original is None:
+        logger.warning(
+            "WebSocketHandler.handle_disconnect not found, "
+            "agents are only closed on exit"
+        )
+        return False
+
+    async def handle_disconnect(
+        self, client_uid, *args, **kwargs
+    ):
+        context = self.client_contexts.get(client_uid)
+        result = original(self, client_uid, *args, **kwargs)
+        if inspect.isawaitable(result):
+            result = await result
+        aclose = getattr(
+            getattr(context, "agent_engine", None),
+            "aclose",
+            None,
+        )
+        if aclose is not None:
+            try:
+                await aclose()
+            except Exception as e:
+                logger.error(
+                    f"Failed to close agent for {client_uid}: {e}"
+                )
+        return result
+
+    WebSocketHandler.handle_disconnect = handle_disconnect
+    return True
+
+
 def parse_args():
     parser = argparse.ArgumentParser(
         description="Open-LLM-VTuber Server"
@@ -116,14 +173,45 @@ def parse_args():
         action="store_true",
         help="Enable verbose logging",
     )
+    parser.add_argument(
+        "--fast-start",
+        action="store_true",
+        help="Defer heavy imports and warm up models in the background",
+    )
+    parser.add_argument(
+        "--log-mode",
+        choices=("debug", "production"),
+        default="debug",
+        help="production: queued, rotated and compressed logs with rate-limited hot-path debug",
+    )
     return parser.parse_args()
 
 
+# 只供本脚本使用、不转发给 run_server.py 的参数（值为参数后面跟的取值个数）
+LAUNCHER_ARGS = {"--fast-start": 0, "--log-mode": 1}
+
+
+def forwarded_argv(argv: list) -> list:
+    """去掉启动脚本自己的参数，其余原样转发给 run_server.py"""
+    forwarded, skip = [], 0
+    for arg in argv:
+        if skip:
+            skip -= 1
+            continue
+        name = arg.split("=", 1)[0]
+        if name in LAUNCHER_ARGS:
+            if "=" not in arg:
+                skip = LAUNCHER_ARGS[name]
+            continue
+        forwarded.append(arg)
+    return forwarded
+
+
 args = parse_args()
 if args.verbose:
-    init_logger("DEBUG")
+    init_logger("DEBUG", args.log_mode)
 else:
-    init_logger("INFO")
+    init_logger("INFO", args.log_mode)
 
 # 需要加入 Python 路径的目录列表
 paths_to_add = [
@@ -152,6 +240,39 @@ logger.debug(
     f"PowerMem data directory: {powermem_data_dir}"
 )
 
+startup = None
+if args.fast_start:
+    from custom_agents.warmup import begin_fast_start
+
+    # 从进程启动算起，计入参数解析和日志初始化
+    startup = begin_fast_start(
+        PROJECT_ROOT / "conf.yaml", started=LAUNCH_TIME
+    )
+
+# TTS 音频缓存要在 run_server.py 创建 TTS 引擎之前装上（在延迟导入注册之后，见 custom_agents/tts_cache.py）
+try:
+    from custom_agents.tts_cache import install_from_config
+
+    install_from_config(PROJECT_ROOT / "conf.yaml")
+except Exception as e:
+    logger.warning(f"TTS cache not installed: {e}")
+
+# 流式 ASR 同样要在创建 ASR 引擎之前装上（见 custom_agents/streaming_asr.py）
+try:
+    from custom_agents.streaming_asr import (
+        install_from_config as install_streaming_asr,
+    )
+
+    install_streaming_asr(PROJECT_ROOT / "conf.yaml")
+except Exception as e:
+    logger.warning(f"Streaming ASR not installed: {e}")
+
+# 会话结束时关闭 Agent（见 install_session_end_hook）
+try:
+    install_session_end_hook()
+except Exception as e:
+    logger.warning(f"Session end hook not installed: {e}")
+
 # 设置资源链接/复制
 if not setup_resources():
     logger.error(
@@ -167,6 +288,8 @@ if not setup_resources():
     sys.exit(1)
 
 logger.info("Starting Kristina")
+if startup is not None:
+    startup.mark("resources")
 
 # 执行子仓库的启动脚本 run_server.py
 run_server_path = SUBMODULE_ROOT / "run_server.py"
@@ -176,8 +299,10 @@ if not run_server_path.exists():
 
 # 保存原始 argv
 original_argv = sys.argv
-# 构造新的 argv：第一个元素是子脚本路径，后面原样保留用户传入的参数
-sys.argv = [str(run_server_path)] + sys.argv[1:]
+# 构造新的 argv：第一个元素是子脚本路径，后面原样保留用户传入的参数（去掉只供本脚本使用的参数）
+sys.argv = [str(run_server_path)] + forwarded_argv(
+    sys.argv[1:]
+)
 
 try:
     # 保持工作目录为项目根目录，以便 conf.yaml 被正确找到
@@ -193,5 +318,7 @@ except Exception as e:
     logger.exception(f"An unexpected error occurred: {e}")
     sys.exit(1)
 finally:
+    # 刷写尚未写入的记忆（超时部分会落盘，下次启动时重放）
+    flush_memory_agents()
     # 恢复原始 argv（良好习惯）
     sys.argv = original_argv